@@ -0,0 +1,116 @@
+"""
+Database connection health checks and read-replica routing for the site.
+
+Connections persist between requests for `CONN_MAX_AGE` seconds. Django
+closes them at the start of a request once they are too old or have had
+errors. A connection that has sat idle for longer than
+`SURVEYS_CONNECTION_IDLE_SECONDS` may also have been dropped meanwhile, e.g.
+because the database restarted, so `ReplicaMiddleware` checks it with a
+round trip before the request uses it and closes it if it has gone bad, to
+be reopened on first use rather than failing the request. Connections in
+steady use are not checked.
+
+The owner API's heavy read-only views declare `read_replica = True`. Safe
+GETs of those views have every read routed to the database named by
+`SURVEYS_READ_REPLICA` by `ReplicaRouter`, while writes and all other views
+stay on the primary. A client that has just written, i.e. made an unsafe
+request, is pinned to the primary by a cookie for `SURVEYS_REPLICA_PIN_SECONDS`
+so that it reads its own writes while the replica catches up.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+PIN_COOKIE = 'pushkin_primary'
+"""
+The cookie that pins a client's reads to the primary after a write
+"""
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_local = threading.local()
+
+
+def check_connections():
+    """ Closes every open connection that has been idle for longer than
+    `SURVEYS_CONNECTION_IDLE_SECONDS`, or was never used by a request of this
+    thread, and no longer answers, so that it is reopened when next used.
+    Connections held by a transaction are left alone.
+    """
+    last_used = getattr(_local, 'last_used', {})
+    idle_since = time.monotonic() - settings.SURVEYS_CONNECTION_IDLE_SECONDS
+    for connection in connections.all():
+        if (connection.connection is not None
+                and not connection.in_atomic_block
+                and last_used.get(connection.alias, 0) < idle_since
+                and not connection.is_usable()):
+            connection.close()
+
+
+def mark_connections_used():
+    """ Records the connections this thread holds open at the end of a
+    request as last used now
+    """
+    now = time.monotonic()
+    _local.last_used = {connection.alias : now
+                        for connection in connections.all()
+                        if connection.connection is not None}
+
+
+def read_database():
+    """ The database that reads of the request being served by this thread
+    are routed to, or None for the default routing
+    """
+    return getattr(_local, 'read_db', None)
+
+
+class ReplicaRouter(object):
+    """ Routes the reads of requests that `ReplicaMiddleware` has sent to the
+    replica. Everything else is left to the default routing.
+    """
+
+    # pylint: disable=no-self-use,unused-argument
+    def db_for_read(self, model, **hints):
+        """ The replica, for the reads of a request routed to it """
+        return read_database()
+
+
+class ReplicaMiddleware(object):
+    """ Checks reused connections, routes the reads of safe requests to views
+    with `read_replica` set to the replica unless the client is pinned to the
+    primary, and pins clients to the primary when they write.
+    """
+
+    # pylint: disable=no-self-use
+    def process_request(self, request):
+        """ Checks the connections and resets the routing for the request """
+        check_connections()
+        _local.read_db = None
+
+    # pylint: disable=unused-argument
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """ Routes the request's reads to the replica if the view allows it """
+        replica = settings.SURVEYS_READ_REPLICA
+        view = getattr(view_func, 'cls', None)
+        if (replica and request.method in SAFE_METHODS
+                and getattr(view, 'read_replica', False)
+                and PIN_COOKIE not in request.COOKIES):
+            _local.read_db = replica
+
+    def process_response(self, request, response):
+        """ Pins a client that wrote to the primary, ends the routing, and
+        records the use of the connections
+        """
+        _local.read_db = None
+        mark_connections_used()
+        if (settings.SURVEYS_READ_REPLICA
+                and request.method not in SAFE_METHODS
+                and response.status_code < 400):
+            response.set_cookie(PIN_COOKIE, '1',
+                                max_age=settings.SURVEYS_REPLICA_PIN_SECONDS,
+                                httponly=True)
+        return response
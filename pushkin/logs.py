@@ -0,0 +1,88 @@
+"""
+Logging handlers and filters that keep diagnostics cheap enough to leave on
+under load.
+
+`QueuedRotatingFileHandler` only puts records on a queue on the thread that
+logs them; a background thread writes them to a size-rotated file.
+`SlowQueryFilter` lets through the SQL statements logged to
+`django.db.backends` that took longer than a threshold, and a random sample of
+the rest.
+"""
+
+import logging
+import queue
+import random
+from logging import handlers
+
+
+class SlowQueryFilter(logging.Filter):
+    """ Passes the SQL statements that took at least `threshold` seconds, and
+    a `sample_rate` fraction of the quicker ones. Records that aren't timed
+    statements always pass.
+
+    Attributes:
+        threshold      The time in seconds above which a statement is logged
+        sample_rate    The fraction of quicker statements to log, from 0 to 1
+    """
+
+    def __init__(self, threshold=0.1, sample_rate=0.0):
+        super(SlowQueryFilter, self).__init__()
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        duration = getattr(record, 'duration', None)
+        return (duration is None or duration >= self.threshold or
+                random.random() < self.sample_rate)
+
+
+class QueuedRotatingFileHandler(handlers.QueueHandler):
+    """ Writes records to a file that is rotated by size, without blocking the
+    thread that logs them.
+
+    Records are put on a bounded queue and a `QueueListener` thread formats and
+    writes them. Once the queue is full, further records are counted in
+    `dropped` and discarded rather than holding up a request. The arguments
+    after `filename` are those of `RotatingFileHandler`.
+
+    Attributes:
+        target      The RotatingFileHandler that does the writing
+        listener    The QueueListener that feeds it from the queue
+        dropped     The number of records discarded because the queue was full
+    """
+
+    # pylint: disable=invalid-name,too-many-arguments
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding=None,
+                 queue_size=10000):
+        super(QueuedRotatingFileHandler, self).__init__(
+            queue.Queue(queue_size))
+        self.target = handlers.RotatingFileHandler(
+            filename, maxBytes=maxBytes, backupCount=backupCount,
+            encoding=encoding, delay=True)
+        self.listener = handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+        self.dropped = 0
+
+    def setFormatter(self, fmt):
+        """ Formats records with `fmt` on the writing thread """
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """ Queues records as they are, so that formatting happens off the
+        logging thread too
+        """
+        return record
+
+    def enqueue(self, record):
+        """ Queues a record, or drops it if the queue is full """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """ Writes out the queued records and closes the file """
+        if self.listener._thread is not None:  # pylint: disable=protected-access
+            self.listener.stop()
+        self.target.close()
+        super(QueuedRotatingFileHandler, self).close()
@@ -0,0 +1,269 @@
+"""
+Per-request latency and SQL instrumentation for the site.
+
+`MetricsMiddleware` times every request along with the number of SQL queries
+it made and the time spent in them. The totals are sent back to the client in a
+`Server-Timing` header and aggregated per view into histograms, which
+`MetricsView` serves at /metrics in the Prometheus text format.
+
+The histograms live in the memory of each server process, so with several
+worker processes each scrape sees the process that happened to serve it.
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from django.db import connections
+from django.db.backends import utils
+from rest_framework import permissions, renderers
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""
+Histogram bucket upper bounds for request and SQL time, in seconds
+"""
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+"""
+Histogram bucket upper bounds for the number of queries per request
+"""
+
+_local = threading.local()
+
+QUERY_LOGGER = logging.getLogger('django.db.backends')
+
+
+class QueryTimer(object):
+    """ Mixin for the database cursor wrappers that times each statement and
+    adds it to the running totals of the request being served by this thread
+
+    Attributes:
+        log_queries    Whether to log each statement and its duration to the
+                       `django.db.backends` logger, as the debug cursor
+                       wrapper already does
+    """
+    log_queries = False
+
+    def execute(self, sql, params=None):
+        """ Executes and times a statement """
+        start = time.perf_counter()
+        try:
+            return super(QueryTimer, self).execute(sql, params)
+        finally:
+            self.record(sql, params, time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        """ Executes and times a statement for each set of parameters """
+        start = time.perf_counter()
+        try:
+            return super(QueryTimer, self).executemany(sql, param_list)
+        finally:
+            self.record(sql, param_list, time.perf_counter() - start)
+
+    def record(self, sql, params, duration):
+        """ Adds a statement to the request's totals, and logs it """
+        totals = getattr(_local, 'totals', None)
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += duration
+        if self.log_queries and QUERY_LOGGER.isEnabledFor(logging.DEBUG):
+            QUERY_LOGGER.debug(
+                '(%.3f) %s; args=%s', duration, sql, params,
+                extra={'duration' : duration, 'sql' : sql, 'params' : params})
+
+
+class TimedCursorWrapper(QueryTimer, utils.CursorWrapper):
+    """ The cursor wrapper used when DEBUG is off """
+    log_queries = True
+
+
+class TimedCursorDebugWrapper(QueryTimer, utils.CursorDebugWrapper):
+    """ The cursor wrapper used when DEBUG is on, which logs the statements
+    itself
+    """
+
+
+def instrument(connection):
+    """ Makes a database connection hand out timed cursors """
+    if not getattr(connection, 'timed', False):
+        connection.make_cursor = \
+            lambda cursor: TimedCursorWrapper(cursor, connection)
+        connection.make_debug_cursor = \
+            lambda cursor: TimedCursorDebugWrapper(cursor, connection)
+        connection.timed = True
+
+
+class Histogram(object):
+    """ A Prometheus-style cumulative histogram, with a series per label value
+
+    Attributes:
+        name       The metric name
+        help       The description of the metric
+        label      The name of the label that distinguishes series
+        buckets    The upper bounds of each bucket, in ascending order
+    """
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        """ Records a single observation in the series for `label_value` """
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # One count per bucket, plus +Inf, then the sum
+                series = self._series[label_value] = \
+                    [0] * (len(self.buckets) + 1) + [0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def reset(self):
+        """ Drops every observation """
+        with self._lock:
+            self._series.clear()
+
+    def exposition(self):
+        """ The histogram in the Prometheus text exposition format """
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((key, list(value))
+                            for key, value in self._series.items())
+        for label_value, counts in series:
+            label = '%s="%s"' % (self.label, label_value)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %s'
+                             % (self.name, label, bound, cumulative))
+            lines.append('%s_sum{%s} %s' % (self.name, label, counts[-1]))
+            lines.append('%s_count{%s} %s' % (self.name, label, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+REQUEST_DURATION = Histogram(
+    'pushkin_request_duration_seconds', 'Time taken to serve a request',
+    'view', LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    'pushkin_request_queries', 'SQL queries made while serving a request',
+    'view', QUERY_COUNT_BUCKETS)
+REQUEST_SQL_DURATION = Histogram(
+    'pushkin_request_sql_duration_seconds',
+    'Time spent in SQL queries while serving a request',
+    'view', LATENCY_BUCKETS)
+
+HISTOGRAMS = (REQUEST_DURATION, REQUEST_QUERIES, REQUEST_SQL_DURATION)
+
+
+class Gauge(object):
+    """ A Prometheus gauge whose value is read when the metrics are scraped
+
+    Attributes:
+        name    The metric name
+        help    The description of the metric
+        read    A callable returning the current value, or None if there is
+                nothing to report
+    """
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def exposition(self):
+        """ The gauge in the Prometheus text exposition format """
+        value = self.read()
+        if value is None:
+            return ''
+        return '# HELP %s %s\n# TYPE %s gauge\n%s %s\n' % (
+            self.name, self.help, self.name, self.name, value)
+
+
+GAUGES = []
+"""
+Gauges served alongside the request histograms. Apps add their own here.
+"""
+
+
+class MetricsMiddleware(object):
+    """ Times each request and the SQL queries it makes, records them in the
+    per-view histograms and reports them in a `Server-Timing` header.
+
+    This should be the first middleware listed so that the time spent in all
+    of the others is included. The time to stream the body of a
+    `StreamingHttpResponse` is not.
+    """
+
+    # pylint: disable=no-self-use
+    def process_request(self, request):
+        """ Starts the clock and the query totals for the request """
+        for connection in connections.all():
+            instrument(connection)
+        _local.totals = [0, 0.0]
+        request.metrics_start = time.perf_counter()
+
+    # pylint: disable=unused-argument
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """ Notes which view is serving the request """
+        request.metrics_view = view_func.__name__
+
+    def process_response(self, request, response):
+        """ Records the request's metrics and adds the Server-Timing header """
+        start = getattr(request, 'metrics_start', None)
+        totals = getattr(_local, 'totals', None)
+        if start is None or totals is None:
+            return response
+        duration = time.perf_counter() - start
+        query_count, sql_duration = totals
+        _local.totals = None
+
+        view = getattr(request, 'metrics_view', 'unresolved')
+        REQUEST_DURATION.observe(view, duration)
+        REQUEST_QUERIES.observe(view, query_count)
+        REQUEST_SQL_DURATION.observe(view, sql_duration)
+
+        response['Server-Timing'] = (
+            'total;dur=%.1f, sql;dur=%.1f;desc="%s queries"'
+            % (duration * 1000, sql_duration * 1000, query_count))
+        return response
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    """ Renders metrics text as it is, and error details as plain lines """
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = ''.join('%s: %s\n' % item for item in data.items())
+        return data.encode(self.charset)
+
+
+class MetricsView(APIView):
+    """ Serves the request histograms and any gauges in the Prometheus text
+    format. Only staff users can read them.
+
+    Attributes:
+        permission_classes    The required permissions to access this view
+        renderer_classes      The renderers for the view's responses
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+    renderer_classes = (PrometheusRenderer,)
+
+    # pylint: disable=unused-argument
+    def get(self, request, *args, **kwargs):
+        """ Returns every histogram and gauge """
+        return Response(''.join(metric.exposition()
+                                for metric in HISTOGRAMS + tuple(GAUGES)),
+                        content_type='text/plain; version=0.0.4')
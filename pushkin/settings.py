@@ -43,6 +43,8 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'pushkin.metrics.MetricsMiddleware',
+    'pushkin.db.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,6 +57,31 @@ MIDDLEWARE_CLASSES = (
 
 ROOT_URLCONF = 'pushkin.urls'
 
+# Users and the owners of API tokens are cached per process for up to
+# AUTH_CACHE_TTL seconds, see surveys/authentication.py. Saving or deleting a
+# user, or deleting a token, takes effect at once in the process that does
+# it; other processes, and changes made without saving the user, can take
+# up to AUTH_CACHE_TTL seconds to be seen. Groups and permissions are not
+# cached. ModelBackend stays listed so that sessions started before the cache
+# was added remain valid.
+
+AUTHENTICATION_BACKENDS = (
+    'surveys.authentication.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+)
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+        'surveys.authentication.CachedTokenAuthentication',
+    ),
+}
+
+AUTH_CACHE_SIZE = 10000
+
+AUTH_CACHE_TTL = 60
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -87,9 +114,61 @@ DATABASES = {
         'PASSWORD': os.environ['DB_PASSWORD'],
         'HOST':'localhost',
         'PORT':'',
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# A read replica of the database, at DB_REPLICA_HOST. The safe GETs of the
+# owner API's heavy read-only views are read from it when it is set (see
+# pushkin.db); otherwise it is the primary again and isn't routed to. The test
+# runner creates it as a second, separate database.
+
+DATABASES['replica'] = dict(
+    DATABASES['default'],
+    HOST=os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+    PORT=os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+    TEST={'NAME': 'test_pushkin_replica'})
+
+DATABASE_ROUTERS = ['pushkin.db.ReplicaRouter']
+
+SURVEYS_READ_REPLICA = 'replica' if os.environ.get('DB_REPLICA_HOST') else None
+
+# How many seconds a client's reads stay on the primary after it writes, to
+# cover the replica's lag
+
+SURVEYS_REPLICA_PIN_SECONDS = 10
+
+# How many seconds a kept-open database connection can sit idle before it is
+# checked with a round trip at the start of the next request that reuses it
+
+SURVEYS_CONNECTION_IDLE_SECONDS = 30
+
+
+# Pagination of the lists under /surveys/<id>/ - the default page size, and the
+# largest page size a client may ask for with ?page_size=
+
+SURVEYS_PAGE_SIZE = 100
+
+SURVEYS_MAX_PAGE_SIZE = 1000
+
+
+# The per-process cache of published survey definitions read by the respondent
+# pages - the most surveys held, and how many seconds each is kept. Name one of
+# CACHES in SURVEYS_SNAPSHOT_CACHE to share them between processes too.
+
+SURVEYS_SNAPSHOT_CACHE_SIZE = 1000
+
+SURVEYS_SNAPSHOT_TTL = 60
+
+SURVEYS_SNAPSHOT_CACHE = None
+
+
+# Set to a file path to take responses submitted through the respond page in
+# the async ingest mode: they are appended to a durable SQLite spool at that
+# path, and `manage.py ingest_worker` writes them to the database in batches.
+
+SURVEYS_INGEST_SPOOL = None
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
@@ -110,21 +189,48 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Logging - records are written to a size-rotated debug.log by a background
+# thread. SQL statements that take at least LOG_SLOW_QUERY_SECONDS are logged,
+# along with a LOG_QUERY_SAMPLE_RATE fraction of the quicker ones.
+
+LOG_SLOW_QUERY_SECONDS = 0.1
+
+LOG_QUERY_SAMPLE_RATE = 0.001
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'slow_queries': {
+            '()': 'pushkin.logs.SlowQueryFilter',
+            'threshold': LOG_SLOW_QUERY_SECONDS,
+            'sample_rate': LOG_QUERY_SAMPLE_RATE,
+        },
+    },
+    'formatters': {
+        'verbose': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
     'handlers': {
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            'class': 'pushkin.logs.QueuedRotatingFileHandler',
             'filename': os.path.join(BASE_DIR, 'debug.log'),
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'formatter': 'verbose',
         },
     },
     'loggers': {
         'django': {
             'handlers': ['file'],
-            'level': 'DEBUG',
+            'level': 'INFO',
             'propagate': True,
         },
+        'django.db.backends': {
+            'filters': ['slow_queries'],
+            'level': 'DEBUG',
+        },
     },
 }
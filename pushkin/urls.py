@@ -16,7 +16,10 @@ Including another URLconf
 from django.conf.urls import include, url
 from django.contrib import admin
 
+from .metrics import MetricsView
+
 urlpatterns = [
     url(r'^admin/', include(admin.site.urls)),
+    url(r'^metrics$', MetricsView.as_view(), name='metrics'),
     url(r'^', include('surveys.urls'))
 ]
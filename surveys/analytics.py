@@ -0,0 +1,60 @@
+""" Tag analytics for a survey, read from the tag counts kept up to date on
+every change to the tags on its answers
+"""
+
+from .models import TagCount, TagPair
+
+
+def tag_analytics(survey):
+    """ Returns the number of answers to each question of the survey carrying
+    each of its tags, and the number of answers carrying each pair of tags:
+        {
+            'questions' : [<question_text>, ...],
+            'tags' : [
+                {
+                    'tag_text' : <tag_text>,
+                    'answer_count' : <answers with the tag>,
+                    'by_question' : [<answers to each question>, ...],
+                    'co_occurrence' : [<answers also with each tag>, ...]
+                },
+                ...
+            ]
+        }
+
+    Questions and tags are listed in order, and `by_question` and
+    `co_occurrence` hold a count for each of them in the same order. The
+    count of a tag against itself in `co_occurrence` is its `answer_count`.
+    This reads the survey's `TagCount`s and `TagPair`s, so it costs the same
+    however many answers the survey has.
+    """
+    questions = list(survey.questions.values_list('id', 'question_text'))
+    tags = list(survey.tag_options.values_list('id', 'tag_text'))
+    question_columns = {question_id : column
+                        for column, (question_id, _) in enumerate(questions)}
+    tag_columns = {tag_id : column
+                   for column, (tag_id, _) in enumerate(tags)}
+    by_question = [[0] * len(questions) for _ in tags]
+    co_occurrence = [[0] * len(tags) for _ in tags]
+
+    # pylint: disable=no-member
+    for tag_id, question_id, answer_count in TagCount.objects.filter(
+            survey=survey, answer_count__gt=0).values_list(
+                'tag_id', 'question_id', 'answer_count'):
+        by_question[tag_columns[tag_id]][question_columns[question_id]] = (
+            answer_count)
+    for tag_id, other_id, answer_count in TagPair.objects.filter(
+            survey=survey, answer_count__gt=0).values_list(
+                'tag_id', 'other_id', 'answer_count'):
+        co_occurrence[tag_columns[tag_id]][tag_columns[other_id]] = (
+            answer_count)
+
+    analytics = []
+    for column, (_, tag_text) in enumerate(tags):
+        answer_count = sum(by_question[column])
+        co_occurrence[column][column] = answer_count
+        analytics.append({'tag_text' : tag_text,
+                          'answer_count' : answer_count,
+                          'by_question' : by_question[column],
+                          'co_occurrence' : co_occurrence[column]})
+    return {'questions' : [question_text for _, question_text in questions],
+            'tags' : analytics}
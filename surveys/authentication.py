@@ -0,0 +1,103 @@
+""" Authentication that remembers users between requests.
+
+DRF's `TokenAuthentication` and Django's `ModelBackend` look the user up in
+the database on every request. The classes here keep the users, and which
+user each token key belongs to, in bounded per-process LRU caches that expire
+after `AUTH_CACHE_TTL` seconds.
+
+Only the user's field values are cached, and each lookup builds a new user
+from them, so that nothing a request stores on its user, such as Django's
+permission caches, is seen by another request. Groups and permissions are
+not cached and are read afresh by the requests that check them.
+
+An entry is dropped as soon as the user is saved (e.g. deactivated, or their
+password changed) or deleted, or the token is deleted. Other processes see
+the change once their copy expires, as does this one for changes made
+without saving the user, e.g. through `QuerySet.update`.
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache import LRUCache
+
+
+USERS = LRUCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+"""
+The database and field values of recently authenticated users, by id
+"""
+
+TOKEN_USERS = LRUCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+"""
+The user id of each recently used token key
+"""
+
+
+def cached_user(user_id):
+    """ Returns a new copy of the user with the given id, or None if there
+    isn't one
+    """
+    model = get_user_model()
+    # pylint: disable=protected-access
+    field_names = [field.attname for field in model._meta.concrete_fields]
+    entry = USERS.get(user_id)
+    if entry is None:
+        try:
+            user = model.objects.get(pk=user_id)
+        except model.DoesNotExist:
+            return None
+        USERS.set(user_id, (user._state.db,
+                            [getattr(user, name) for name in field_names]))
+        return user
+    database, values = entry
+    return model.from_db(database, field_names, values)
+
+
+class CachedModelBackend(ModelBackend):
+    """ The model backend, reading session users through the user cache """
+
+    def get_user(self, user_id):
+        return cached_user(user_id)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ Token authentication that reads token keys and their users through
+    the caches
+    """
+
+    def authenticate_credentials(self, key):
+        user_id = TOKEN_USERS.get(key)
+        if user_id is None:
+            try:
+                # pylint: disable=no-member
+                user_id = self.model.objects.values_list(
+                    'user_id', flat=True).get(key=key)
+            except self.model.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            TOKEN_USERS.set(key, user_id)
+
+        user = cached_user(user_id)
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, self.model(key=key, user=user)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+# pylint: disable=unused-argument
+def invalidate_user(sender, instance, **kwargs):
+    """ Drops a user from the cache when they change """
+    USERS.delete(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+# pylint: disable=unused-argument
+def invalidate_token(sender, instance, **kwargs):
+    """ Drops a token from the cache when it is deleted """
+    TOKEN_USERS.delete(instance.key)
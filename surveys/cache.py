@@ -0,0 +1,142 @@
+""" In-process caches for data read on every request of a hot path """
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUCache(object):
+    """ A thread-safe mapping that holds at most `max_size` entries, evicting
+    the least recently used first. Entries also expire `ttl` seconds after
+    they are set, unless `ttl` is None.
+
+    Attributes:
+        max_size    The most entries held at once
+        ttl         The lifetime of each entry in seconds, or None
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Returns the live entry for `key`, or `default` """
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """ Stores `value` under `key`, evicting the oldest entry if full """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """ Drops the entry for `key`, if there is one """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """ Drops every entry """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+SurveySnapshot = namedtuple('SurveySnapshot', ('id', 'name', 'owner_name',
+                                               'published', 'questions'))
+"""
+A read-only copy of what the respondent pages need of a survey. `questions`
+holds an `(id, question_text)` pair for each question, in order.
+"""
+
+
+class SnapshotCache(object):
+    """ Holds a `SurveySnapshot` of each recently used published survey.
+
+    Snapshots are kept in a per-process `LRUCache` and, if `cache_alias` names
+    one of the `CACHES`, in that cache too so that processes can share them.
+    Invalidating a survey drops it from this process and the shared cache;
+    other processes see the change once their copy reaches `ttl` seconds old.
+
+    Attributes:
+        local    The per-process LRUCache
+        ttl      The lifetime of each snapshot in seconds
+    """
+
+    def __init__(self, max_size, ttl, cache_alias=None):
+        self.local = LRUCache(max_size, ttl)
+        self.ttl = ttl
+        self._cache_alias = cache_alias
+
+    @property
+    def shared(self):
+        """ The shared Django cache, or None """
+        return caches[self._cache_alias] if self._cache_alias else None
+
+    @staticmethod
+    def key(survey_id):
+        """ The shared cache key for a survey """
+        return 'surveys:snapshot:%s' % survey_id
+
+    def get(self, survey_id, load):
+        """ Returns the snapshot of a survey, calling `load(survey_id)` to
+        build it if it isn't cached. Snapshots of unpublished surveys, which
+        can still change, are returned but not kept.
+        """
+        snapshot = self.local.get(survey_id)
+        if snapshot is not None:
+            return snapshot
+        shared = self.shared
+        if shared is not None:
+            snapshot = shared.get(self.key(survey_id))
+        if snapshot is None:
+            snapshot = load(survey_id)
+            if not snapshot.published:
+                return snapshot
+            if shared is not None:
+                shared.set(self.key(survey_id), snapshot, self.ttl)
+        self.local.set(survey_id, snapshot)
+        return snapshot
+
+    def invalidate(self, survey_id):
+        """ Drops the snapshot of a survey """
+        self.local.delete(survey_id)
+        shared = self.shared
+        if shared is not None:
+            shared.delete(self.key(survey_id))
+
+    def clear(self):
+        """ Drops every snapshot held by this process """
+        self.local.clear()
+
+
+SNAPSHOTS = SnapshotCache(settings.SURVEYS_SNAPSHOT_CACHE_SIZE,
+                          settings.SURVEYS_SNAPSHOT_TTL,
+                          settings.SURVEYS_SNAPSHOT_CACHE)
+"""
+The survey snapshots of this process
+"""
+
+TAG_IDS = LRUCache(settings.SURVEYS_SNAPSHOT_CACHE_SIZE)
+"""
+A `(tag_version, {normalized tag text : tag id})` pair for each recently used
+survey, see `Tag.resolve()`
+"""
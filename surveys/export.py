@@ -0,0 +1,232 @@
+""" Streaming exports of every response to a survey, one row per response """
+
+import csv
+import json
+import uuid
+
+from django.db import connections, transaction
+
+from .models import Answer, AnswerTag, ArchivedResponse
+
+
+TAG_SEPARATOR = '; '
+"""
+The separator between the tags of an answer in a single CSV cell
+"""
+
+CHUNK_SIZE = 2000
+"""
+The number of rows fetched from the database cursor at a time
+"""
+
+
+def _stream_rows(queryset):
+    """ Yields the rows of a `values_list` queryset without holding the whole
+    result in memory.
+
+    On PostgreSQL the rows are read from a named (server-side) cursor in
+    chunks of `CHUNK_SIZE`, as psycopg2 otherwise fetches the entire result of
+    a query into the client before the first row is returned. Named cursors
+    only live as long as their transaction, so this must be iterated inside
+    one. Elsewhere this falls back to `iterator()`.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        for row in queryset.iterator():
+            yield row
+        return
+
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.connection.cursor(name='export_%s' % uuid.uuid4().hex)
+    cursor.itersize = CHUNK_SIZE
+    try:
+        cursor.execute(sql, params)
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def survey_export(survey):
+    """ Returns the question texts of the survey, in order, along with a
+    generator of the `(response_ordinal, answers)` rows for every response,
+    where `answers` holds an `(answer_text, [tag_text, ...])` pair per
+    question.
+    """
+    questions = list(survey.questions.values_list('id', 'question_text'))
+    question_ids = [question_id for question_id, _ in questions]
+    tag_texts = dict(survey.tag_options.values_list('id', 'tag_text'))
+    return ([question_text for _, question_text in questions],
+            _response_rows(survey, question_ids, tag_texts))
+
+
+def _response_rows(survey, question_ids, tag_texts):
+    """ Yields the rows of `survey_export()`.
+
+    The answers and the tags on them are read as two streams in the same
+    (response, answer) order and merged, so memory use doesn't grow with the
+    number of responses. They are read from the database the survey was, as
+    the rows are streamed after the request's routing has ended. On
+    PostgreSQL both are read from one REPEATABLE READ snapshot, so that an
+    answer deleted or re-tagged meanwhile can't leave them out of step; tag
+    rows that still sort before the current answer are stepped past. Tags on
+    the answers that aren't in `tag_texts`, i.e. that were added after it was
+    read, are skipped.
+    """
+    database = survey._state.db # pylint: disable=protected-access
+    connection = connections[database]
+    outermost = not connection.in_atomic_block
+    question_columns = {question_id : column
+                        for column, question_id in enumerate(question_ids)}
+    if survey.archived:
+        for row in _archived_rows(survey, database, question_columns,
+                                  tag_texts):
+            yield row
+        return
+    with transaction.atomic(using=database):
+        if connection.vendor == 'postgresql' and outermost:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        # pylint: disable=no-member
+        answers = _stream_rows(
+            Answer.objects.using(database).filter(survey=survey).order_by(
+                'response__ordinal', 'ordinal', 'id').values_list(
+                    'response__ordinal', 'ordinal', 'id', 'question_id',
+                    'answer_text'))
+        answer_tags = _stream_rows(
+            AnswerTag.objects.using(database).filter(survey=survey).order_by(
+                'answer__response__ordinal', 'answer__ordinal', 'answer_id',
+                'id').values_list('answer__response__ordinal',
+                                  'answer__ordinal', 'answer_id', 'tag_id'))
+        try:
+            next_tag = next(answer_tags, None)
+            row_ordinal, row = None, None
+            for response_ordinal, answer_ordinal, answer_id, question_id, \
+                    answer_text in answers:
+                if response_ordinal != row_ordinal:
+                    if row is not None:
+                        yield row_ordinal, row
+                    row_ordinal = response_ordinal
+                    row = [('', [])] * len(question_ids)
+                key = (response_ordinal, answer_ordinal, answer_id)
+                # Tags on answers missing from the answer stream would
+                # otherwise hold back every tag after them
+                while next_tag is not None and next_tag[:3] < key:
+                    next_tag = next(answer_tags, None)
+                tags = []
+                while next_tag is not None and next_tag[:3] == key:
+                    # Tags added since the tag texts were read are left out,
+                    # rather than cutting the download short
+                    if next_tag[3] in tag_texts:
+                        tags.append(tag_texts[next_tag[3]])
+                    next_tag = next(answer_tags, None)
+                row[question_columns[question_id]] = (answer_text, tags)
+            if row is not None:
+                yield row_ordinal, row
+        finally:
+            # Release the cursors before their transaction ends
+            answers.close()
+            answer_tags.close()
+
+
+def _archived_rows(survey, database, question_columns, tag_texts):
+    """ Yields the rows of `survey_export()` for an archived survey, one
+    `ArchivedResponse` at a time
+    """
+    with transaction.atomic(using=database):
+        # pylint: disable=no-member
+        archives = _stream_rows(
+            ArchivedResponse.objects.using(database).filter(
+                survey=survey).order_by('response__ordinal').values_list(
+                    'response__ordinal', 'data'))
+        try:
+            for response_ordinal, data in archives:
+                row = [('', [])] * len(question_columns)
+                for question_id, answer_text, tag_ids in \
+                        ArchivedResponse.unpack(data):
+                    # Answers to questions deleted since are left out, as
+                    # deleting a question deletes its live answers
+                    if question_id not in question_columns:
+                        continue
+                    row[question_columns[question_id]] = (
+                        answer_text, [tag_texts[tag_id] for tag_id in tag_ids
+                                      if tag_id in tag_texts])
+                yield response_ordinal, row
+        finally:
+            archives.close()
+
+
+def stream_tag_answers(answers):
+    """ Streams the answers of a `TagAnswerList` queryset as newline-delimited
+    JSON, one object per answer in the order they were written:
+        {
+            'response' : <ordinal of the response>,
+            'question' : <ordinal of the question>,
+            'answer_text' : <answer_text>
+        }
+
+    The queryset must name its database with `using()`, as the lines are
+    streamed after the request's routing has ended.
+    """
+    with transaction.atomic(using=answers.db):
+        rows = _stream_rows(answers.order_by('id').values_list(
+            'response__ordinal', 'question__ordinal', 'answer_text'))
+        try:
+            for response_ordinal, question_ordinal, answer_text in rows:
+                yield json.dumps({'response' : response_ordinal,
+                                  'question' : question_ordinal,
+                                  'answer_text' : answer_text}) + '\n'
+        finally:
+            rows.close()
+
+
+class _Echo(object):
+    """ A file-like object whose `write()` hands back what it's given, so a
+    `csv.writer` can produce one formatted line at a time
+    """
+    # pylint: disable=no-self-use
+    def write(self, value):
+        """ Returns `value` rather than storing it """
+        return value
+
+
+def stream_csv(question_texts, rows):
+    """ Formats the output of `survey_export()` as CSV: a response column
+    followed by an answer column and a tags column per question
+    """
+    writer = csv.writer(_Echo())
+    header = ['response']
+    for question_text in question_texts:
+        header += [question_text, question_text + ' (tags)']
+    yield writer.writerow(header)
+    for ordinal, answers in rows:
+        line = [ordinal]
+        for answer_text, tags in answers:
+            line += [answer_text, TAG_SEPARATOR.join(tags)]
+        yield writer.writerow(line)
+
+
+# pylint: disable=unused-argument
+def stream_ndjson(question_texts, rows):
+    """ Formats the output of `survey_export()` as newline-delimited JSON, one
+    object per response:
+        {
+            'response' : <ordinal>,
+            'answers' : [<answer_text>, <answer_text>, ...],
+            'tags' : [[<tag_text>, ...], [<tag_text>, ...], ...]
+        }
+    """
+    for ordinal, answers in rows:
+        yield json.dumps({'response' : ordinal,
+                          'answers' : [answer for answer, _ in answers],
+                          'tags' : [tags for _, tags in answers]}) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv' : ('text/csv', stream_csv),
+    'ndjson' : ('application/x-ndjson', stream_ndjson),
+}
+"""
+The content type and formatter for each export file extension
+"""
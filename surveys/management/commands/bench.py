@@ -0,0 +1,370 @@
+""" Management command to benchmark every endpoint against a large survey """
+
+import csv
+import io
+import json
+import random
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from ...models import (ANSWER_TAGS_TABLE, Answer, Question, Response, Survey,
+                       Tag, count_answers, normalize_tag)
+from ...partitions import drop_partitions
+
+
+BENCH_USERNAME = 'pushkin_bench'
+"""
+The owner of the generated survey. Any existing user with this name, and all of
+their surveys, is dropped before a run.
+"""
+
+WORDS = ('service', 'refund', 'slow', 'friendly', 'staff', 'price', 'late',
+         'great', 'terrible', 'delivery', 'quality', 'support', 'order',
+         'again', 'never', 'always', 'helpful', 'broken', 'cheap', 'easy')
+"""
+The vocabulary generated answers are made from
+"""
+
+
+def percentile(samples, fraction):
+    """ The nearest-rank percentile of a sorted list of samples """
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class Command(BaseCommand):
+    """ Loads a synthetic survey of a configurable size, times a scenario for
+    every endpoint in `surveys/urls.py` against it, and reports the latency
+    percentiles, queries per request and peak memory of each as JSON.
+
+    The data is written to, and the requests are served from, the configured
+    database, so run this against a scratch database with the same settings as
+    production rather than a live one.
+    """
+    help = 'Benchmarks every endpoint against a large synthetic survey'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--responses', type=int, default=18000,
+                            help='Responses in the generated survey')
+        parser.add_argument('--questions', type=int, default=40,
+                            help='Questions in the generated survey')
+        parser.add_argument('--tags', type=int, default=80,
+                            help='Tags in the generated survey')
+        parser.add_argument('--tagged-every', type=int, default=3,
+                            help='Tag one answer in every N')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Timed requests per scenario')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the generated answer text')
+        parser.add_argument('--output', default=None,
+                            help='File to write the JSON report to '
+                                 '(default: stdout)')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the generated survey afterwards')
+
+    def handle(self, *args, **options):
+        drop_bench_data()
+        start = time.perf_counter()
+        survey = generate_survey(options)
+        report = {
+            'database' : connection.vendor,
+            'dataset' : {
+                'responses' : options['responses'],
+                'questions' : options['questions'],
+                'tags' : options['tags'],
+                'tagged_every' : options['tagged_every'],
+                'seed' : options['seed'],
+                'load_seconds' : round(time.perf_counter() - start, 3),
+            },
+            'scenarios' : {},
+        }
+
+        client = bench_client()
+        for name, method, uri, body in scenarios(survey, client):
+            report['scenarios'][name] = run_scenario(
+                client, method, uri, body, options['requests'])
+            self.stderr.write('%s: p50 %sms' % (
+                name, report['scenarios'][name]['p50_ms']))
+
+        # Archiving can only be done once, and changes how the survey is read,
+        # so it comes last and the reads are timed again after it
+        report['scenarios']['survey_archive'] = run_once(
+            client.post, '/surveys/%s/archive/' % survey.id)
+        self.stderr.write('survey_archive: %sms' % (
+            report['scenarios']['survey_archive']['p50_ms']))
+        for name, method, uri, body in archived_scenarios(survey, client):
+            report['scenarios'][name] = run_scenario(
+                client, method, uri, body, options['requests'])
+            self.stderr.write('%s: p50 %sms' % (
+                name, report['scenarios'][name]['p50_ms']))
+
+        if not options['keep']:
+            drop_bench_data()
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+
+def generate_survey(options):
+    """ Creates the bench user and a published survey of the requested size,
+    writing the responses, answers and tags in bulk. On PostgreSQL the answers
+    are streamed in with COPY.
+    """
+    rng = random.Random(options['seed'])
+    user = User.objects.create(username=BENCH_USERNAME)
+    user.set_password(BENCH_USERNAME)
+    user.save()
+    survey = user.surveys.create(name='Bench survey', published=True)
+
+    # pylint: disable=no-member
+    Question.objects.bulk_create(
+        Question(survey=survey, ordinal=ix + 1,
+                 question_text='Question %s?' % (ix + 1))
+        for ix in range(options['questions']))
+    tag_texts = ['Tag %s' % (ix + 1) for ix in range(options['tags'])]
+    Tag.objects.bulk_create(
+        Tag(survey=survey, ordinal=ix + 1, tag_text=tag_text,
+            tag_key=normalize_tag(tag_text))
+        for ix, tag_text in enumerate(tag_texts))
+    question_ids = list(survey.questions.values_list('id', flat=True))
+
+    chunk = 1000
+    for first in range(0, options['responses'], chunk):
+        count = min(chunk, options['responses'] - first)
+        with transaction.atomic():
+            Response.objects.bulk_create(
+                Response(survey=survey, ordinal=first + ix + 1)
+                for ix in range(count))
+            response_ids = survey.responses.filter(
+                ordinal__gt=first).values_list('id', flat=True)
+            _insert_answers(
+                (response_id, survey.id, question_id, ix + 1,
+                 ' '.join(rng.choice(WORDS)
+                          for _ in range(rng.randint(3, 30))))
+                for response_id in response_ids
+                for ix, question_id in enumerate(question_ids))
+
+    if options['tags']:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {tags} (answer_id, tag_id, survey_id) '
+                'SELECT surveys_answer.id, surveys_tag.id, '
+                '       surveys_answer.survey_id '
+                'FROM surveys_answer '
+                'JOIN surveys_tag '
+                '     ON surveys_tag.survey_id = surveys_answer.survey_id '
+                '     AND surveys_tag.ordinal = 1 + surveys_answer.id %% %s '
+                'WHERE surveys_answer.survey_id = %s '
+                'AND surveys_answer.id %% %s = 0'.format(
+                    tags=ANSWER_TAGS_TABLE),
+                (options['tags'], survey.id, options['tagged_every']))
+            count_answers(cursor, survey.id,
+                          'SELECT id FROM surveys_answer WHERE survey_id = %s',
+                          [survey.id], 1)
+    Survey.objects.filter(pk=survey.pk).update(
+        response_count=options['responses'])
+    survey.refresh_from_db()
+    return survey
+
+
+def _insert_answers(rows):
+    """ Writes `(response_id, survey_id, question_id, ordinal, answer_text)`
+    rows to the answer table, with COPY where the database supports it
+    """
+    if connection.vendor != 'postgresql':
+        # pylint: disable=no-member
+        Answer.objects.bulk_create(
+            Answer(response_id=response_id, survey_id=survey_id,
+                   question_id=question_id, ordinal=ordinal,
+                   answer_text=answer_text)
+            for response_id, survey_id, question_id, ordinal, answer_text
+            in rows)
+        return
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            'COPY surveys_answer (response_id, survey_id, question_id, '
+            'ordinal, answer_text) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def drop_bench_data():
+    """ Deletes the bench user and everything under their surveys, with a
+    DELETE per table rather than through the ORM's cascade, which would load
+    every row first. The surveys' answer partitions are dropped if there are
+    any.
+    """
+    survey_ids = '(SELECT surveys_survey.id FROM surveys_survey JOIN auth_user ' \
+                 'ON surveys_survey.owner_id = auth_user.id ' \
+                 'WHERE auth_user.username = %s)'
+    with transaction.atomic(), connection.cursor() as cursor:
+        # pylint: disable=no-member
+        for survey_id in Survey.objects.filter(
+                owner__username=BENCH_USERNAME).values_list('id', flat=True):
+            drop_partitions(connection, survey_id)
+        for table in ('surveys_tagcount', 'surveys_tagpair', ANSWER_TAGS_TABLE,
+                      'surveys_answer', 'surveys_response',
+                      'surveys_tag', 'surveys_question'):
+            cursor.execute('DELETE FROM %s WHERE survey_id IN %s'
+                           % (table, survey_ids), (BENCH_USERNAME,))
+        User.objects.filter(username=BENCH_USERNAME).delete()
+
+
+def bench_client():
+    """ A test client logged in as the bench user, addressing a host the
+    settings allow
+    """
+    host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS
+                 if host != '*'), 'localhost')
+    client = Client(HTTP_HOST=host)
+    client.login(username=BENCH_USERNAME, password=BENCH_USERNAME)
+    return client
+
+
+def scenarios(survey, client):
+    """ Yields a `(name, method, uri, body)` scenario for each endpoint. Detail
+    scenarios address the last object of each kind, the worst case for any
+    lookup that scans.
+    """
+    survey_uri = '/surveys/%s/' % survey.id
+    last_response = '%sresponses/%s/' % (survey_uri, survey.response_count)
+    last_question = survey.questions.count()
+    last_tag = survey.tag_options.count()
+    answer_strings = ['bench answer'] * last_question
+
+    yield 'root', client.get, '/', None
+    yield 'survey_list', client.get, '/surveys/', None
+    yield 'survey_detail', client.get, survey_uri, None
+    yield 'survey_update', client.patch, survey_uri, {'name' : 'Bench survey'}
+    yield 'export_csv', client.get, survey_uri + 'export.csv', None
+    yield 'export_ndjson', client.get, survey_uri + 'export.ndjson', None
+    yield 'question_list', client.get, survey_uri + 'questions/', None
+    yield ('question_detail', client.get,
+           '%squestions/%s/' % (survey_uri, last_question), None)
+    yield 'response_list', client.get, survey_uri + 'responses/', None
+    yield ('response_bulk', client.post, survey_uri + 'responses/bulk/',
+           [{'answers' : answer_strings}] * 100)
+    yield 'response_detail', client.get, last_response, None
+    yield 'answer_list', client.get, last_response + 'answers/', None
+    yield ('answer_detail', client.get,
+           '%sanswers/%s/' % (last_response, last_question), None)
+    yield ('answer_tag', client.patch,
+           '%sanswers/%s/' % (last_response, last_question),
+           {'tag_strings' : ['Tag 1']})
+    yield ('answer_search', client.get,
+           survey_uri + 'answers/search/?q=terrible+"slow+delivery"', None)
+    yield 'tag_list', client.get, survey_uri + 'tags/', None
+    yield ('tag_analytics', client.get, survey_uri + 'analytics/tags', None)
+    yield 'tag_create', client.post, survey_uri + 'tags/', {'tag_text' : 'x'}
+    yield ('tag_detail', client.get,
+           '%stags/%s/' % (survey_uri, last_tag), None)
+    yield ('tag_answers', client.get, survey_uri + 'tags/1/answers/', None)
+    yield ('tag_apply', client.post, survey_uri + 'tags/1/apply/',
+           {'question' : 1, 'q' : 'refund'})
+    yield ('tag_remove', client.post, survey_uri + 'tags/1/remove/',
+           {'question' : 1, 'q' : 'refund'})
+    # Merging a tag into itself exercises the lookups without losing data
+    yield ('tag_merge', client.post, survey_uri + 'tags/merge/',
+           {'source' : [1], 'target' : 1})
+    yield 'register_form', client.get, '/register/', None
+    yield 'respond', client.get, '/respond/%s/' % survey.id, None
+    yield ('submit', client.post, '/submit/%s/' % survey.id,
+           {str(ix) : answer for ix, answer in enumerate(answer_strings)})
+    yield 'thankyou', client.get, '/thankyou/', None
+
+
+def archived_scenarios(survey, client):
+    """ Yields a `(name, method, uri, body)` scenario for each endpoint that
+    reads the responses of a survey differently once it is archived
+    """
+    survey_uri = '/surveys/%s/' % survey.id
+    last_response = '%sresponses/%s/' % (survey_uri, survey.response_count)
+
+    yield ('archived_export_csv', client.get, survey_uri + 'export.csv',
+           None)
+    yield ('archived_response_list', client.get, survey_uri + 'responses/',
+           None)
+    yield 'archived_answer_list', client.get, last_response + 'answers/', None
+
+
+def run_once(method, uri):
+    """ Times a single request of a scenario that can only be made once. Its
+    peak memory isn't measured, as that would take a second request.
+    """
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = method(uri)
+        timing = (time.perf_counter() - start) * 1000
+    return {
+        'method' : method.__name__.upper(),
+        'uri' : uri,
+        'status' : response.status_code,
+        'requests' : 1,
+        'p50_ms' : round(timing, 3),
+        'p95_ms' : round(timing, 3),
+        'p99_ms' : round(timing, 3),
+        'queries_per_request' : len(queries),
+        'max_queries' : len(queries),
+        'peak_memory_kb' : None,
+    }
+
+
+def run_scenario(client, method, uri, body, requests):
+    """ Times `requests` calls of a scenario, after a warm-up call, then
+    repeats it once more under `tracemalloc` to find its peak memory
+    """
+    kwargs = {}
+    if body is not None and method != client.get:
+        if uri.startswith('/submit/'):
+            kwargs = {'data' : body}
+        else:
+            kwargs = {'data' : json.dumps(body),
+                      'content_type' : 'application/json'}
+
+    def request():
+        """ Makes the request, reading the whole of any streamed body """
+        response = method(uri, **kwargs)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    status_code = request().status_code
+    timings, query_counts = [], []
+    for _ in range(requests):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            request()
+            timings.append((time.perf_counter() - start) * 1000)
+        query_counts.append(len(queries))
+
+    tracemalloc.start()
+    request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'method' : method.__name__.upper(),
+        'uri' : uri,
+        'status' : status_code,
+        'requests' : requests,
+        'p50_ms' : round(percentile(timings, 0.50), 3),
+        'p95_ms' : round(percentile(timings, 0.95), 3),
+        'p99_ms' : round(percentile(timings, 0.99), 3),
+        'queries_per_request' : round(sum(query_counts) / requests, 2),
+        'max_queries' : max(query_counts),
+        'peak_memory_kb' : round(peak / 1024, 1),
+    }
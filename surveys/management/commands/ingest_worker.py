@@ -0,0 +1,110 @@
+""" Management command to drain the response spool into the database """
+
+import time
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from ...cache import SNAPSHOTS
+from ...models import DBError, IngestCursor, Survey
+from ...spool import get_spool
+
+
+class Command(BaseCommand):
+    """ Writes the responses queued in the spool configured by
+    `SURVEYS_INGEST_SPOOL` to the database, a batch per transaction, then
+    waits for more. Run one worker per spool, on the host that holds it.
+
+    Responses that no longer fit their survey, e.g. because it was deleted,
+    are counted as rejected and dropped. If the database is unavailable the
+    batch is retried after `--interval` seconds.
+    """
+    help = 'Writes the responses in the ingest spool to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Responses written per transaction')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the spool is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the spool is empty')
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        if spool is None:
+            raise CommandError('SURVEYS_INGEST_SPOOL is not set')
+
+        while True:
+            try:
+                ingested, rejected = ingest_batch(spool,
+                                                  options['batch_size'])
+            except DatabaseError as error:
+                # Snapshots may be stale if a write failed on a constraint
+                SNAPSHOTS.clear()
+                connection.close()
+                self.stderr.write('Ingest failed, retrying: %s' % error)
+                time.sleep(options['interval'])
+                continue
+
+            if ingested or rejected:
+                count, age = spool.backlog()
+                self.stdout.write(
+                    'Ingested %s response(s), rejected %s; %s waiting, the '
+                    'oldest for %.1fs' % (ingested, rejected, count, age))
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['interval'])
+
+
+def ingest_batch(spool, batch_size):
+    """ Writes the oldest `batch_size` entries of the spool to the database in
+    a single transaction, and returns the number of responses ingested and
+    rejected.
+
+    The spool's `IngestCursor` is locked for the transaction and advanced
+    within it, and the entries are only cleared from the spool once it has
+    committed. Entries the cursor has already passed are never written again.
+    """
+    with transaction.atomic():
+        # pylint: disable=no-member
+        cursor, _ = IngestCursor.objects.select_for_update().get_or_create(
+            spool=spool.id)
+        entries = spool.read(cursor.last_entry, batch_size)
+        if not entries:
+            spool.clear_through(cursor.last_entry)
+            return 0, 0
+
+        answer_sets = OrderedDict()
+        for _, survey_id, answers in entries:
+            answer_sets.setdefault(survey_id, []).append(answers)
+        ingested, rejected = 0, 0
+        for survey_id, survey_answers in answer_sets.items():
+            try:
+                snapshot = Survey.snapshot(survey_id)
+            except Survey.DoesNotExist:
+                rejected += len(survey_answers)
+                continue
+            valid = [answers for answers in survey_answers
+                     if len(answers) == len(snapshot.questions)]
+            rejected += len(survey_answers) - len(valid)
+            if valid and snapshot.published:
+                try:
+                    # The snapshot may predate the survey's archiving
+                    with transaction.atomic():
+                        Survey(id=snapshot.id, published=True).add_responses(
+                            valid, [question_id for question_id, _
+                                    in snapshot.questions])
+                except DBError:
+                    SNAPSHOTS.invalidate(snapshot.id)
+                    rejected += len(valid)
+                    continue
+                ingested += len(valid)
+            else:
+                rejected += len(valid)
+
+        cursor.last_entry = entries[-1][0]
+        cursor.save()
+    spool.clear_through(cursor.last_entry)
+    return ingested, rejected
@@ -0,0 +1,94 @@
+""" Management command to partition the answer tables by survey """
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ...models import Survey
+from ...partitions import (ANSWER_TABLES, create_partitions,
+                           forget_partitioning, is_partitioned)
+from ...search import SEARCH_CONFIG
+
+
+# Run once the data is in the partitioned tables, so the indexes are built in
+# one go. Rows tagging an answer are kept with it by dropping a survey's
+# partitions together, as PostgreSQL can't drop a partition that a foreign key
+# references.
+CONSTRAINTS_SQL = [
+    'ALTER TABLE surveys_answer ADD PRIMARY KEY (survey_id, id)',
+    'CREATE INDEX surveys_answer_response_ordinal '
+    'ON surveys_answer (response_id, ordinal)',
+    'CREATE INDEX surveys_answer_question ON surveys_answer (question_id)',
+    "CREATE INDEX surveys_answer_text_search ON surveys_answer "
+    "USING gin (to_tsvector('%s', answer_text))" % SEARCH_CONFIG,
+    'ALTER TABLE surveys_answer ADD FOREIGN KEY (response_id) '
+    'REFERENCES surveys_response (id) DEFERRABLE INITIALLY DEFERRED',
+    'ALTER TABLE surveys_answer ADD FOREIGN KEY (question_id) '
+    'REFERENCES surveys_question (id) DEFERRABLE INITIALLY DEFERRED',
+    'ALTER TABLE surveys_answer ADD FOREIGN KEY (survey_id) '
+    'REFERENCES surveys_survey (id) DEFERRABLE INITIALLY DEFERRED',
+    'ALTER TABLE surveys_answer_tags ADD PRIMARY KEY (survey_id, id)',
+    'ALTER TABLE surveys_answer_tags '
+    'ADD UNIQUE (survey_id, answer_id, tag_id)',
+    'CREATE INDEX surveys_answer_tags_tag '
+    'ON surveys_answer_tags (tag_id, answer_id)',
+    'ALTER TABLE surveys_answer_tags ADD FOREIGN KEY (tag_id) '
+    'REFERENCES surveys_tag (id) DEFERRABLE INITIALLY DEFERRED',
+    'ALTER TABLE surveys_answer_tags ADD FOREIGN KEY (survey_id) '
+    'REFERENCES surveys_survey (id) DEFERRABLE INITIALLY DEFERRED',
+]
+
+
+class Command(BaseCommand):
+    """ Rebuilds the answer table and its tags through table as tables
+    partitioned by LIST on `survey_id`, with a partition of each per survey
+    and a default partition, and copies every row across. Surveys created or
+    deleted from then on create or drop their own partitions.
+
+    The tables are locked for the whole rebuild, which runs in a single
+    transaction, so take the site down for it. It can't be undone other than
+    by restoring a backup. Restart the web and ingest processes afterwards so
+    that they notice the new layout.
+    """
+    help = 'Partitions the answer tables by survey (PostgreSQL 11+)'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql' or connection.pg_version < 110000:
+            raise CommandError('Partitioning needs PostgreSQL 11 or later')
+        if is_partitioned(connection):
+            raise CommandError('The answer tables are already partitioned')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE'
+                           % ', '.join(ANSWER_TABLES))
+            for table in ANSWER_TABLES:
+                old = table + '_unpartitioned'
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')",
+                               (table,))
+                sequence = cursor.fetchone()[0]
+                cursor.execute('ALTER TABLE %s RENAME TO %s' % (table, old))
+                cursor.execute(
+                    'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) '
+                    'PARTITION BY LIST (survey_id)'.format(table=table,
+                                                           old=old))
+                cursor.execute('ALTER SEQUENCE %s OWNED BY %s.id'
+                               % (sequence, table))
+                cursor.execute('CREATE TABLE {table}_default PARTITION OF '
+                               '{table} DEFAULT'.format(table=table))
+
+            forget_partitioning()
+            # pylint: disable=no-member
+            survey_ids = list(Survey.objects.values_list('id', flat=True))
+            for survey_id in survey_ids:
+                create_partitions(connection, survey_id)
+
+            for table in ANSWER_TABLES:
+                cursor.execute('INSERT INTO {table} '
+                               'SELECT * FROM {table}_unpartitioned'.format(
+                                   table=table))
+            for table in reversed(ANSWER_TABLES):
+                cursor.execute('DROP TABLE %s_unpartitioned' % table)
+            for sql in CONSTRAINTS_SQL:
+                cursor.execute(sql)
+
+        self.stdout.write('Partitioned the answer tables for %s survey(s)'
+                          % len(survey_ids))
@@ -0,0 +1,53 @@
+""" Management command to correct any drift in the stored response counts """
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ...models import Survey
+
+
+RECONCILE_SQL = '''
+    UPDATE surveys_survey SET response_count = counted.response_count,
+                              version = surveys_survey.version + 1,
+                              modified = CURRENT_TIMESTAMP
+    FROM (SELECT surveys_survey.id, COUNT(surveys_response.id)
+                 AS response_count
+          FROM surveys_survey LEFT JOIN surveys_response
+               ON surveys_response.survey_id = surveys_survey.id
+          {where}
+          GROUP BY surveys_survey.id) AS counted
+    WHERE surveys_survey.id = counted.id
+    AND surveys_survey.response_count <> counted.response_count
+'''
+
+
+class Command(BaseCommand):
+    """ Recounts the responses to each survey and corrects the stored
+    `Survey.response_count` wherever it has drifted, e.g. after responses were
+    deleted outside of the ORM
+    """
+    help = 'Corrects the stored response count of surveys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_ids', nargs='*', type=int,
+                            help='The surveys to reconcile (default: all)')
+
+    def handle(self, *args, **options):
+        survey_ids = options['survey_ids']
+        surveys = Survey.objects.select_for_update() # pylint: disable=no-member
+        where, params = '', []
+        if survey_ids:
+            surveys = surveys.filter(id__in=survey_ids)
+            where = 'WHERE surveys_survey.id IN (%s)' % ', '.join(
+                ['%s'] * len(survey_ids))
+            params = survey_ids
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Hold off new responses while counting so the count can't go
+            # stale between the COUNT and the UPDATE
+            list(surveys.values_list('id', flat=True))
+            cursor.execute(RECONCILE_SQL.format(where=where), params)
+            corrected = cursor.rowcount
+
+        self.stdout.write('Corrected the response count of %s survey(s)'
+                          % corrected)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Number the existing rows of each table within their parent, in insertion
+# order, before the ordinal columns are made NOT NULL
+BACKFILL_ORDINALS_SQL = '''
+    UPDATE {table} SET ordinal = numbered.ordinal
+    FROM (SELECT id, row_number() OVER (PARTITION BY {parent}
+                                        ORDER BY id) AS ordinal
+          FROM {table}) AS numbered
+    WHERE {table}.id = numbered.id
+'''
+
+ORDINAL_TABLES = (
+    ('surveys_question', 'survey_id'),
+    ('surveys_tag', 'survey_id'),
+    ('surveys_response', 'survey_id'),
+    ('surveys_answer', 'response_id'),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='survey',
+            old_name='_published',
+            new_name='published',
+        ),
+    ] + [
+        migrations.AddField(
+            model_name=model_name,
+            name='ordinal',
+            field=models.PositiveIntegerField(null=True, editable=False),
+        )
+        for model_name in ('answer', 'question', 'response', 'tag')
+    ] + [
+        migrations.RunSQL([BACKFILL_ORDINALS_SQL.format(table=table,
+                                                        parent=parent)],
+                          migrations.RunSQL.noop)
+        for table, parent in ORDINAL_TABLES
+    ] + [
+        migrations.AlterField(
+            model_name=model_name,
+            name='ordinal',
+            field=models.PositiveIntegerField(editable=False),
+        )
+        for model_name in ('answer', 'question', 'response', 'tag')
+    ] + [
+        migrations.AlterModelOptions(
+            name=model_name,
+            options={'ordering': ('ordinal',)},
+        )
+        for model_name in ('answer', 'question', 'response', 'tag')
+    ] + [
+        migrations.AlterIndexTogether(
+            name='answer',
+            index_together=set([('response', 'ordinal')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='question',
+            index_together=set([('survey', 'ordinal')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='response',
+            index_together=set([('survey', 'ordinal')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='tag',
+            index_together=set([('survey', 'ordinal')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# The expression must match the one searched on in surveys.search, including
+# the text search configuration, for the index to be used
+CREATE_INDEX_SQL = '''
+    CREATE INDEX surveys_answer_text_search ON surveys_answer
+    USING gin (to_tsvector('english', answer_text))
+'''
+
+DROP_INDEX_SQL = 'DROP INDEX surveys_answer_text_search'
+
+
+def create_search_index(apps, schema_editor):
+    """ Adds the full-text index on PostgreSQL; other databases search without
+    one
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_INDEX_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    """ Reverses `create_search_index()` """
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_INDEX_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0002_ordinals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+COUNT_RESPONSES_SQL = '''
+    UPDATE surveys_survey SET response_count = (
+        SELECT COUNT(*) FROM surveys_response
+        WHERE surveys_response.survey_id = surveys_survey.id)
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0003_answer_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='response_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL([COUNT_RESPONSES_SQL], migrations.RunSQL.noop),
+    ]
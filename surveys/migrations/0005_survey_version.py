@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0004_survey_response_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='survey',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now,
+                                       editable=False),
+        ),
+        migrations.RunSQL(['UPDATE surveys_survey SET modified = created'],
+                          migrations.RunSQL.noop),
+    ]
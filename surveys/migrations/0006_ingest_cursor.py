@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0005_survey_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestCursor',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('spool', models.CharField(max_length=32, unique=True)),
+                ('last_entry', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0006_ingest_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='tag_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
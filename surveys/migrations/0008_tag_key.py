@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+
+# A copy of surveys.models.normalize_tag() as of this migration, so that the
+# keys it writes don't change if that function does
+_DASHES = re.compile('[\u2010-\u2015\u2212\ufe58\ufe63\uff0d]')
+
+
+def normalize_tag(tag_text):
+    """ Folds case, whitespace and Unicode dashes in a tag text into its key
+    """
+    return ' '.join(_DASHES.sub('-', tag_text).casefold().split())
+
+
+def fill_tag_keys(apps, schema_editor):
+    """ Normalizes the text of every tag into its key. Tags that normalize the
+    same as an earlier tag in their survey are merged into it, as with
+    `Tag.merge()`, and the survey's ordinals are closed up after them.
+    """
+    Tag = apps.get_model('surveys', 'Tag')
+    Through = apps.get_model('surveys', 'Answer').tags.through
+    keepers = {}
+    merged_surveys = set()
+    for tag in Tag.objects.order_by('survey_id', 'ordinal'):
+        tag_key = normalize_tag(tag.tag_text)
+        keeper = keepers.setdefault((tag.survey_id, tag_key), tag)
+        if keeper is tag:
+            tag.tag_key = tag_key
+            tag.save(update_fields=['tag_key'])
+            continue
+        tagged = Through.objects.filter(tag_id=keeper.id).values('answer_id')
+        Through.objects.bulk_create(
+            Through(answer_id=answer_id, tag_id=keeper.id)
+            for answer_id in Through.objects.filter(tag_id=tag.id).exclude(
+                answer_id__in=tagged).values_list('answer_id', flat=True))
+        tag.delete()
+        merged_surveys.add(tag.survey_id)
+
+    for survey_id in merged_surveys:
+        for ordinal, tag in enumerate(
+                Tag.objects.filter(survey_id=survey_id).order_by('ordinal'),
+                start=1):
+            if tag.ordinal != ordinal:
+                tag.ordinal = ordinal
+                tag.save(update_fields=['ordinal'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0007_survey_tag_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='tag_key',
+            field=models.CharField(default='', max_length=300, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_tag_keys, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='tag',
+            unique_together=set([('survey', 'tag_key')]),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+FILL_ANSWER_SURVEYS_SQL = '''
+    UPDATE surveys_answer SET survey_id = (
+        SELECT survey_id FROM surveys_response
+        WHERE surveys_response.id = surveys_answer.response_id)
+'''
+
+FILL_ANSWER_TAG_SURVEYS_SQL = '''
+    UPDATE surveys_answer_tags SET survey_id = (
+        SELECT survey_id FROM surveys_answer
+        WHERE surveys_answer.id = surveys_answer_tags.answer_id)
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0008_tag_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='survey',
+            field=models.ForeignKey(related_name='answers',
+                                    to='surveys.Survey', null=True,
+                                    editable=False),
+        ),
+        migrations.RunSQL([FILL_ANSWER_SURVEYS_SQL], migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='answer',
+            name='survey',
+            field=models.ForeignKey(related_name='answers',
+                                    to='surveys.Survey', editable=False),
+        ),
+        # The implicit through table of Answer.tags becomes the AnswerTag
+        # model, without touching the table
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='AnswerTag',
+                fields=[
+                    ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                            auto_created=True,
+                                            primary_key=True)),
+                    ('answer', models.ForeignKey(to='surveys.Answer')),
+                    ('tag', models.ForeignKey(to='surveys.Tag')),
+                ],
+                options={
+                    'db_table': 'surveys_answer_tags',
+                },
+            ),
+            migrations.AlterUniqueTogether(
+                name='answertag',
+                unique_together=set([('answer', 'tag')]),
+            ),
+            migrations.AlterField(
+                model_name='answer',
+                name='tags',
+                field=models.ManyToManyField(to='surveys.Tag', blank=True,
+                                             through='surveys.AnswerTag'),
+            ),
+        ]),
+        migrations.AddField(
+            model_name='answertag',
+            name='survey',
+            field=models.ForeignKey(related_name='+', to='surveys.Survey',
+                                    null=True),
+        ),
+        migrations.RunSQL([FILL_ANSWER_TAG_SURVEYS_SQL],
+                          migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='answertag',
+            name='survey',
+            field=models.ForeignKey(related_name='+', to='surveys.Survey'),
+        ),
+    ]
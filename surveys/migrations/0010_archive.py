@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0009_answer_survey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedResponse',
+            fields=[
+                ('response', models.OneToOneField(primary_key=True,
+                                                  serialize=False,
+                                                  related_name='archive',
+                                                  to='surveys.Response')),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='survey',
+            name='archived',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='archivedresponse',
+            name='survey',
+            field=models.ForeignKey(related_name='+', to='surveys.Survey'),
+        ),
+    ]
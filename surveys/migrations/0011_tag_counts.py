@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import zlib
+from collections import Counter
+
+from django.db import migrations, models
+
+
+FILL_TAG_COUNTS_SQL = '''
+    INSERT INTO surveys_tagcount (survey_id, tag_id, question_id, answer_count)
+    SELECT tagging.survey_id, tagging.tag_id, answer.question_id, COUNT(*)
+    FROM surveys_answer_tags AS tagging JOIN surveys_answer AS answer
+         ON answer.id = tagging.answer_id
+    GROUP BY tagging.survey_id, tagging.tag_id, answer.question_id
+'''
+
+FILL_TAG_PAIRS_SQL = '''
+    INSERT INTO surveys_tagpair (survey_id, tag_id, other_id, answer_count)
+    SELECT tagging.survey_id, tagging.tag_id, other.tag_id, COUNT(*)
+    FROM surveys_answer_tags AS tagging JOIN surveys_answer_tags AS other
+         ON other.answer_id = tagging.answer_id
+         AND other.tag_id <> tagging.tag_id
+    GROUP BY tagging.survey_id, tagging.tag_id, other.tag_id
+'''
+
+
+def count_archived_tags(apps, schema_editor):
+    """ Counts the tags on the answers of archived surveys, which are only
+    held packed in `ArchivedResponse.data`. Questions and tags deleted since
+    archiving are left out.
+    """
+    ArchivedResponse = apps.get_model('surveys', 'ArchivedResponse')
+    Question = apps.get_model('surveys', 'Question')
+    Tag = apps.get_model('surveys', 'Tag')
+    TagCount = apps.get_model('surveys', 'TagCount')
+    TagPair = apps.get_model('surveys', 'TagPair')
+    counts, pairs = Counter(), Counter()
+    question_ids = set(Question.objects.values_list('id', flat=True))
+    tag_ids = set(Tag.objects.values_list('id', flat=True))
+    for survey_id, data in ArchivedResponse.objects.values_list(
+            'survey_id', 'data').iterator():
+        for question_id, _, answer_tags in json.loads(
+                zlib.decompress(bytes(data)).decode()):
+            if question_id not in question_ids:
+                continue
+            answer_tags = [tag_id for tag_id in answer_tags
+                           if tag_id in tag_ids]
+            for tag_id in answer_tags:
+                counts[survey_id, tag_id, question_id] += 1
+                for other_id in answer_tags:
+                    if other_id != tag_id:
+                        pairs[survey_id, tag_id, other_id] += 1
+    TagCount.objects.bulk_create(
+        TagCount(survey_id=survey_id, tag_id=tag_id, question_id=question_id,
+                 answer_count=count)
+        for (survey_id, tag_id, question_id), count in counts.items())
+    TagPair.objects.bulk_create(
+        TagPair(survey_id=survey_id, tag_id=tag_id, other_id=other_id,
+                answer_count=count)
+        for (survey_id, tag_id, other_id), count in pairs.items())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0010_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True,
+                                        serialize=False, auto_created=True)),
+                ('answer_count', models.IntegerField(default=0)),
+                ('question', models.ForeignKey(related_name='+',
+                                               to='surveys.Question')),
+                ('survey', models.ForeignKey(related_name='+',
+                                             to='surveys.Survey')),
+                ('tag', models.ForeignKey(related_name='+',
+                                          to='surveys.Tag')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TagPair',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True,
+                                        serialize=False, auto_created=True)),
+                ('answer_count', models.IntegerField(default=0)),
+                ('other', models.ForeignKey(related_name='+',
+                                            to='surveys.Tag')),
+                ('survey', models.ForeignKey(related_name='+',
+                                             to='surveys.Survey')),
+                ('tag', models.ForeignKey(related_name='+',
+                                          to='surveys.Tag')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagpair',
+            unique_together=set([('tag', 'other')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagcount',
+            unique_together=set([('tag', 'question')]),
+        ),
+        migrations.RunSQL([FILL_TAG_COUNTS_SQL, FILL_TAG_PAIRS_SQL],
+                          migrations.RunSQL.noop),
+        migrations.RunPython(count_archived_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys', '0011_tag_counts'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='answertag',
+            index_together=set([('tag', 'answer')]),
+        ),
+    ]
@@ -1,18 +1,34 @@
 
 """ The DB/model definitions for this application """
 
+import json
+import re
+import zlib
+from collections import defaultdict, namedtuple
+
 from django.conf import settings
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import connections, models, transaction
+from django.db.models import F, Max
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
+from .cache import SNAPSHOTS, TAG_IDS, SurveySnapshot
+from .partitions import (create_partitions, drop_partitions,
+                         truncate_partitions)
+
 
 MAX_TAG_LENGTH = 100
 """
 The maximum length of each tag text
 """
 
+ARCHIVE_CHUNK_SIZE = 1000
+"""
+The number of responses packed into the archive at a time
+"""
+
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 # pylint: disable=unused-argument
@@ -22,12 +38,128 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
+_DASHES = re.compile('[\u2010-\u2015\u2212\ufe58\ufe63\uff0d]')
+
+
+def normalize_tag(tag_text):
+    """ Folds the variants of a tag text that taggers type for the same tag
+    into one key: case, leading, trailing and repeated whitespace, and the
+    various Unicode dashes and hyphens
+
+    Example:- '  Late–delivery ' and 'late-DELIVERY' both become
+              'late-delivery'
+    """
+    return ' '.join(_DASHES.sub('-', tag_text).casefold().split())
+
+
 class DBError(Exception):
     """ Exception thrown to indicate an attempted action has been rejected at
     the DB layer, i.e. responding to an unpublished survey or editing a
     question after publication
     """
 
+
+class OrdinalModel(models.Model):
+    """ Abstract base for objects that are addressed in URIs by their ordinal
+    number within a parent object, e.g. /surveys/1/responses/3/ is the
+    response with ordinal 3 under survey 1.
+
+    Ordinals are dense and one-based. They are assigned on insert while holding
+    a lock on the parent row, so concurrent inserts can't be handed the same
+    ordinal, and the ordinals of later siblings are shifted down on delete.
+    Subclasses index `(<ordinal_parent>, ordinal)` so that a lookup by ordinal
+    costs the same no matter how many siblings there are.
+
+    Saving or deleting an object bumps the version of the survey it belongs
+    to, see `Survey.touch()`.
+
+    Attributes:
+        ordinal           The one-based position of this object in its parent
+        ordinal_parent    The name of the foreign key the ordinal is scoped to
+        survey_lookup     The `Survey` field that matches the parent's id, to
+                          find the survey this object belongs to
+    """
+    ordinal_parent = None
+    survey_lookup = 'pk'
+
+    ordinal = models.PositiveIntegerField(editable=False)
+
+    class Meta:
+        """ Meta details to order objects by their ordinal """
+        abstract = True
+        ordering = ('ordinal',)
+
+    @classmethod
+    def lock_parent(cls, parent_id):
+        """ Locks the parent row against concurrent ordinal changes until the
+        end of the current transaction
+        """
+        parent_model = cls._meta.get_field(cls.ordinal_parent).related_model
+        list(parent_model.objects.select_for_update().filter(
+            pk=parent_id).values_list('pk', flat=True))
+
+    @classmethod
+    def next_ordinal(cls, parent_id):
+        """ Locks the parent row and returns the next free ordinal under it.
+        Must be called inside a transaction.
+        """
+        cls.lock_parent(parent_id)
+        # pylint: disable=no-member
+        last = cls.objects.filter(
+            **{cls.ordinal_parent + '_id' : parent_id}).aggregate(
+                last=Max('ordinal'))['last']
+        return (last or 0) + 1
+
+    @classmethod
+    def renumber(cls, parent_id):
+        """ Closes any gaps in the ordinals under a parent in one UPDATE, e.g.
+        after a set of siblings has been deleted in bulk. Must be called inside
+        a transaction holding the parent lock.
+        """
+        table = cls._meta.db_table
+        with connections[cls.objects.db].cursor() as cursor:
+            cursor.execute(
+                'UPDATE {table} SET ordinal = numbered.ordinal '
+                'FROM (SELECT id, row_number() OVER (ORDER BY ordinal) '
+                '      AS ordinal FROM {table} WHERE {parent}_id = %s) '
+                'AS numbered '
+                'WHERE {table}.id = numbered.id '
+                'AND {table}.ordinal <> numbered.ordinal'.format(
+                    table=table, parent=cls.ordinal_parent),
+                (parent_id,))
+
+    @property
+    def parent_id(self):
+        """ The primary key of the object this ordinal is scoped to """
+        return getattr(self, self.ordinal_parent + '_id')
+
+    def touch_survey(self, **updates):
+        """ Bumps the version of the survey this object belongs to, see
+        `Survey.touch()`
+        """
+        Survey.touch({self.survey_lookup : self.parent_id}, **updates)
+
+    def save(self, *args, **kwargs):
+        """ Saves the object, assigning the next ordinal if it has none """
+        with transaction.atomic():
+            if self.ordinal is None:
+                self.ordinal = self.next_ordinal(self.parent_id)
+            super(OrdinalModel, self).save(*args, **kwargs)
+            self.touch_survey()
+
+    def delete(self, *args, **kwargs):
+        """ Deletes the object and closes the gap it leaves in the ordinals """
+        with transaction.atomic():
+            self.lock_parent(self.parent_id)
+            super(OrdinalModel, self).delete(*args, **kwargs)
+            # pylint: disable=no-member
+            type(self).objects.filter(
+                ordinal__gt=self.ordinal,
+                **{self.ordinal_parent + '_id' : self.parent_id}).update(
+                    ordinal=F('ordinal') - 1)
+            self.touch_survey()
+
+
 class Survey(models.Model):
     """ The root object of each survey
 
@@ -36,11 +168,24 @@ class Survey(models.Model):
         create       A `DateTimeField` specifying when the survey was created
         owner        A `User` instance representing the creator of the survey
         published    Flags if the survey is open and accepting responses
+        response_count    The number of responses to the survey, kept up to
+                          date as responses are added and deleted
+        version      A counter bumped on every change to the survey or to
+                     anything under it, for conditional GETs of its views
+        modified     When the version was last bumped
+        tag_version  A counter bumped on every change to the survey's tags
+        archived     Flags if the answers have been packed into the archive,
+                     see `archive()`
     """
     name = models.CharField(max_length=100, default='My Survey')
     created = models.DateTimeField(auto_now_add=True)
     owner = models.ForeignKey('auth.User', related_name='surveys')
     published = models.BooleanField(default=False)
+    response_count = models.IntegerField(default=0, editable=False)
+    version = models.PositiveIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(default=timezone.now, editable=False)
+    tag_version = models.PositiveIntegerField(default=0, editable=False)
+    archived = models.BooleanField(default=False, editable=False)
 
     class Meta:
         """ Meta details to specify that the Surveys should be ordered
@@ -48,74 +193,564 @@ class Survey(models.Model):
         """
         ordering = ('created',)
 
+    ATOMIC_FIELDS = ('response_count', 'version', 'modified', 'tag_version',
+                     'archived')
+    """
+    The fields that are only ever changed with a single UPDATE in the database
+    """
+
+    def save(self, *args, **kwargs):
+        """ Saves the survey and bumps its version. Updates leave the fields
+        in `ATOMIC_FIELDS` alone, as they are only ever changed atomically in
+        the database and the copies on this instance may be stale.
+        """
+        adding = self._state.adding
+        if not adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.ATOMIC_FIELDS]
+        with transaction.atomic():
+            super(Survey, self).save(*args, **kwargs)
+            if adding:
+                create_partitions(connections[self._state.db], self.pk)
+            else:
+                Survey.touch({'pk' : self.pk})
+
+    def delete(self, *args, **kwargs):
+        """ Deletes the survey and everything under it. If the answer tables
+        are partitioned, the survey's partitions are dropped first, so that
+        its answers aren't collected for deletion one by one. Surveys deleted
+        in other ways have theirs dropped by `drop_survey_partitions()`.
+        """
+        # pylint: disable=no-member
+        database = kwargs.get('using') or self._state.db or Survey.objects.db
+        with transaction.atomic(using=database):
+            drop_partitions(connections[database], self.pk)
+            super(Survey, self).delete(*args, **kwargs)
+
+    @classmethod
+    def touch(cls, lookup, **updates):
+        """ Marks the surveys matching the filter `lookup` as changed, bumping
+        their `version` and `modified` time along with any other `updates` in
+        a single UPDATE. Anything that changes a survey or the objects under
+        it must call this so that clients holding its old version refetch.
+        """
+        # pylint: disable=no-member
+        return cls.objects.filter(**lookup).update(
+            version=F('version') + 1, modified=timezone.now(), **updates)
+
     def publish(self):
         """ Alters a survey's state to published """
         self.published = True
         self.save()# pylint: disable=no-member
 
     @property
-    def response_count(self):
-        """ A `property` to export the number of responses, user when
-        serializing a Survey
+    def accepting_responses(self):
+        """ Whether the survey is published and not yet archived """
+        return self.published and not self.archived
+
+    def tag_texts(self):
+        """ Returns the text of each of the survey's tags, by id """
+        # pylint: disable=no-member
+        return dict(self.tag_options.values_list('id', 'tag_text'))
+
+    def archive(self):
+        """ Closes the survey and moves its answers into the archive: the
+        answers to each response, with the ids of their tags, are packed into
+        one compressed `ArchivedResponse` row, and the answers and the rows
+        tagging them are deleted. The views of responses and answers go on
+        serving them from the archive, read-only.
+
+        Runs in one transaction, reading `ARCHIVE_CHUNK_SIZE` responses at a
+        time. The survey row is locked first, so responses can't be added, nor
+        the survey archived again, while the answers are being packed. Returns
+        the number of responses archived, or None if the survey already was.
         """
-        return self.responses.count()
+        with transaction.atomic():
+            # pylint: disable=no-member
+            if Survey.objects.select_for_update().get(pk=self.pk).archived:
+                return None
+            response_ids = list(self.responses.values_list('id', flat=True))
+            for first in range(0, len(response_ids), ARCHIVE_CHUNK_SIZE):
+                chunk = response_ids[first:first + ARCHIVE_CHUNK_SIZE]
+                tag_ids = defaultdict(list)
+                for answer_id, tag_id in AnswerTag.objects.filter(
+                        survey=self, answer__response__in=chunk).order_by(
+                            'tag_id').values_list('answer_id', 'tag_id'):
+                    tag_ids[answer_id].append(tag_id)
+                answers = defaultdict(list)
+                for response_id, answer_id, question_id, answer_text in \
+                        Answer.objects.filter(
+                            survey=self, response__in=chunk).order_by(
+                                'response_id', 'ordinal').values_list(
+                                    'response_id', 'id', 'question_id',
+                                    'answer_text'):
+                    answers[response_id].append(
+                        (question_id, answer_text, tag_ids[answer_id]))
+                ArchivedResponse.objects.bulk_create(
+                    ArchivedResponse(response_id=response_id, survey=self,
+                                     data=ArchivedResponse.pack(
+                                         answers[response_id]))
+                    for response_id in chunk)
+
+            connection = connections[Answer.objects.db]
+            if not truncate_partitions(connection, self.pk):
+                with connection.cursor() as cursor:
+                    for table in (ANSWER_TAGS_TABLE,
+                                  Answer._meta.db_table):
+                        cursor.execute('DELETE FROM %s WHERE survey_id = %%s'
+                                       % table, (self.pk,))
+            Survey.touch({'pk' : self.pk}, archived=True)
+        self.archived = True
+        SNAPSHOTS.invalidate(self.pk)
+        return len(response_ids)
 
+    @classmethod
+    def snapshot(cls, survey_id):
+        """ Returns a `SurveySnapshot` of the survey with the given id, from
+        the cache if it's published and has been read before. Raises
+        Survey.DoesNotExist if there is no such survey.
+        """
+        return SNAPSHOTS.get(int(survey_id), cls._load_snapshot)
 
-class Question(models.Model):
+    @classmethod
+    def _load_snapshot(cls, survey_id):
+        """ Reads a `SurveySnapshot` from the database """
+        # pylint: disable=no-member
+        survey = cls.objects.select_related('owner').get(id=survey_id)
+        return SurveySnapshot(
+            survey.id, survey.name, survey.owner.username,
+            survey.accepting_responses,
+            tuple(survey.questions.values_list('id', 'question_text')))
+
+    @staticmethod
+    def check_answer_sets(published, question_count, answer_sets):
+        """ Raises a DBError unless `answer_sets` could be added as responses
+        to a survey with the given published state and number of questions
+        """
+        if not published:
+            raise DBError('This survey has not been published')
+        for answer_strings in answer_sets:
+            if len(answer_strings) != question_count:
+                raise DBError('Expected %s answers, got %s'
+                              % (question_count, len(answer_strings)))
+
+    def add_responses(self, answer_sets, question_ids=None):
+        """ Creates a `Response` for each sequence of answer strings in
+        `answer_sets`, the Nth string of each answering the Nth question.
+        `question_ids` are the ids of the survey's questions in order, if the
+        caller already has them, e.g. from a snapshot.
+
+        The published state is checked once for the whole batch, the responses
+        and their answers are each written with a single `bulk_create` and the
+        response count is bumped once, all inside the one transaction. Raises a
+        DBError if the survey is not published or has been archived, or if any
+        answer set does not match the number of questions, in which case
+        nothing is written.
+        """
+        if question_ids is None and self.published:
+            # pylint: disable=no-member
+            question_ids = list(self.questions.values_list('id', flat=True))
+        self.check_answer_sets(self.published, len(question_ids or ()),
+                               answer_sets)
+
+        # pylint: disable=no-member
+        with transaction.atomic():
+            first_ordinal = Response.next_ordinal(self.id)
+            Response.objects.bulk_create(
+                Response(survey=self, ordinal=first_ordinal + ix)
+                for ix in range(len(answer_sets)))
+            # bulk_create doesn't hand back primary keys, but the ordinals
+            # reserved under the survey lock identify the new rows
+            responses = list(self.responses.filter(
+                ordinal__gte=first_ordinal))
+            Answer.objects.bulk_create(
+                Answer(response=response, survey=self, question_id=question_id,
+                       answer_text=answer_text, ordinal=question_ix + 1)
+                for response, answer_strings in zip(responses, answer_sets)
+                for question_ix, (question_id, answer_text)
+                in enumerate(zip(question_ids, answer_strings)))
+            # Checked here rather than up front as the caller's copy of the
+            # survey, e.g. a snapshot, may predate its archiving
+            if not Survey.touch({'pk' : self.pk, 'archived' : False},
+                                response_count=F('response_count') +
+                                len(responses)):
+                raise DBError('This survey has been archived')
+        return responses
+
+
+class Question(OrdinalModel):
     """ An individual question belonging to a survey
 
     Attributes:
         survey           The `Survey` object to which this question belongs
         question_text    The question string to display
     """
+    ordinal_parent = 'survey'
+
     survey = models.ForeignKey(Survey, related_name='questions')
     question_text = models.TextField()
 
+    class Meta(OrdinalModel.Meta):
+        """ Meta details to index questions by their ordinal in the survey """
+        index_together = (('survey', 'ordinal'),)
+
+    def delete(self, *args, **kwargs):
+        """ Deletes the question along with its answers, closing the gap the
+        answers leave in the ordinals of each response
+        """
+        with transaction.atomic():
+            self.lock_parent(self.survey_id)
+            with connections[Answer.objects.db].cursor() as cursor:
+                count_answers(cursor, self.survey_id,
+                              'SELECT id FROM %s WHERE question_id = %%s'
+                              % Answer._meta.db_table, [self.id], -1)
+            # pylint: disable=no-member
+            answer_ordinals = set(
+                self.answers.values_list('ordinal', flat=True))
+            for ordinal in answer_ordinals:
+                Answer.objects.filter(
+                    response__in=Response.objects.filter(
+                        answers__question=self, answers__ordinal=ordinal),
+                    ordinal__gt=ordinal).update(ordinal=F('ordinal') - 1)
+            super(Question, self).delete(*args, **kwargs)
+
 
-class Tag(models.Model):
+class Tag(OrdinalModel):
     """ A tag that the survey owner can use to tag responses in the survey
 
+    Tags are unique within a survey by their normalized text (see
+    `normalize_tag()`), which is stored alongside the text so that the
+    database enforces it.
+
     Attributes:
         survey      The `Survey` object to which this tag belongs
         tag_text    The tag string to display
+        tag_key     The normalized tag string, set from `tag_text` on save
     """
+    ordinal_parent = 'survey'
+
     tag_text = models.CharField(max_length=MAX_TAG_LENGTH)
+    # Case folding can lengthen a string up to threefold, e.g. 'ΐ'
+    tag_key = models.CharField(max_length=3 * MAX_TAG_LENGTH, editable=False)
     survey = models.ForeignKey(Survey, related_name='tag_options')
 
+    class Meta(OrdinalModel.Meta):
+        """ Meta details to index tags by their ordinal in the survey, and
+        keep their normalized text unique within it
+        """
+        index_together = (('survey', 'ordinal'),)
+        unique_together = (('survey', 'tag_key'),)
+
+    def save(self, *args, **kwargs):
+        """ Saves the tag, normalizing its text into `tag_key` """
+        self.tag_key = normalize_tag(self.tag_text)
+        super(Tag, self).save(*args, **kwargs)
+
+    def touch_survey(self, **updates):
+        """ Bumps the version and the tag version of the survey """
+        super(Tag, self).touch_survey(tag_version=F('tag_version') + 1,
+                                      **updates)
+
+    @classmethod
+    def add(cls, survey, tag_text):
+        """ Returns the tag of `survey` whose normalized text matches that of
+        `tag_text`, adding it with the next ordinal if there is none, and
+        whether it was added.
+
+        The tag is inserted with a single INSERT ... ON CONFLICT DO NOTHING
+        RETURNING, so concurrent adds of the same tag can't both succeed or
+        fail on the unique index. The survey's version is bumped first, which
+        also locks the survey row so that concurrent adds of different tags
+        are handed different ordinals; the bump is rolled back if the tag
+        already existed.
+        """
+        tag_key = normalize_tag(tag_text)
+        with transaction.atomic():
+            Survey.touch({'pk' : survey.id},
+                         tag_version=F('tag_version') + 1)
+            with connections[cls.objects.db].cursor() as cursor:
+                cursor.execute(
+                    'INSERT INTO {table} (survey_id, tag_text, tag_key, '
+                    '                     ordinal) '
+                    'SELECT %s, %s, %s, COALESCE(MAX(ordinal), 0) + 1 '
+                    'FROM {table} WHERE survey_id = %s '
+                    'ON CONFLICT DO NOTHING '
+                    'RETURNING id, ordinal'.format(table=cls._meta.db_table),
+                    (survey.id, tag_text, tag_key, survey.id))
+                row = cursor.fetchone()
+            if row is None:
+                transaction.set_rollback(True)
+        if row is None:
+            # pylint: disable=no-member
+            return cls.objects.get(survey_id=survey.id, tag_key=tag_key), False
+        return cls(id=row[0], ordinal=row[1], survey=survey,
+                   tag_text=tag_text, tag_key=tag_key), True
+
+    @classmethod
+    def resolve(cls, survey, tag_strings):
+        """ Returns the set of ids of the tags of `survey` whose text matches
+        any of `tag_strings` once normalized (see `normalize_tag()`). Strings
+        that match no tag are ignored.
+
+        The map from normalized text to id is cached per survey against its
+        `tag_version`, so this makes no queries while the tags are unchanged.
+        """
+        cached = TAG_IDS.get(survey.id)
+        if cached is None or cached[0] != survey.tag_version:
+            tag_ids = {tag_key : tag_id for tag_id, tag_key
+                       in survey.tag_options.values_list('id', 'tag_key')}
+            cached = (survey.tag_version, tag_ids)
+            TAG_IDS.set(survey.id, cached)
+        tag_ids = cached[1]
+        return {tag_ids[key] for key in map(normalize_tag, tag_strings)
+                if key in tag_ids}
+
+    def apply_to(self, answers):
+        """ Tags every answer in the `answers` queryset with this tag, with a
+        single INSERT ... SELECT into the `Answer.tags` through table. Answers
+        already carrying the tag are skipped.
+
+        The survey's version is bumped first, which locks the survey so that
+        the answers counted into its tag counts (see `count_tagging()`) are
+        exactly those then tagged; the bump is rolled back if none were.
+        Returns the number of answers newly tagged.
+        """
+        sql, params = answers.order_by().values(
+            'id', 'survey_id').query.sql_with_params()
+        untagged = ('SELECT answer.id FROM ({answers}) AS answer '
+                    'WHERE NOT EXISTS (SELECT 1 FROM {tags} '
+                    '                  WHERE answer_id = answer.id '
+                    '                  AND tag_id = %s '
+                    '                  AND survey_id = answer.survey_id)'
+                    .format(tags=ANSWER_TAGS_TABLE, answers=sql))
+        untagged_params = tuple(params) + (self.id,)
+        with transaction.atomic(using=answers.db):
+            Survey.touch({'pk' : self.survey_id})
+            with connections[answers.db].cursor() as cursor:
+                count_tagging(cursor, self.survey_id, self.id, untagged,
+                              untagged_params, 1)
+                cursor.execute(
+                    'INSERT INTO {tags} (answer_id, tag_id, survey_id) '
+                    'SELECT answer.id, %s, answer.survey_id '
+                    'FROM ({answers}) AS answer '
+                    'WHERE NOT EXISTS (SELECT 1 FROM {tags} '
+                    '                  WHERE answer_id = answer.id '
+                    '                  AND tag_id = %s '
+                    '                  AND survey_id = answer.survey_id) '
+                    'ON CONFLICT DO NOTHING'.format(tags=ANSWER_TAGS_TABLE,
+                                                    answers=sql),
+                    (self.id,) + untagged_params)
+                count = cursor.rowcount
+            if not count:
+                transaction.set_rollback(True, using=answers.db)
+        return count
+
+    def merge(self, sources):
+        """ Folds the `sources` tags into this one: every answer tagged with
+        any of them is tagged with this tag instead, and the sources are
+        deleted. Answers carrying several of the tags end up tagged once.
+
+        The answers are re-pointed with a single INSERT ... SELECT on the
+        `Answer.tags` through table, all in one transaction. Returns the number
+        of answers newly tagged with this tag.
+        """
+        source_ids = tuple(tag.id for tag in sources if tag.id != self.id)
+        if not source_ids:
+            return 0
+        id_list = ', '.join(['%s'] * len(source_ids))
+        with transaction.atomic():
+            self.lock_parent(self.survey_id)
+            with connections[Tag.objects.db].cursor() as cursor:
+                # The counts of the sources go with them when they're deleted
+                count_tagging(
+                    cursor, self.survey_id, self.id,
+                    'SELECT answer_id FROM {tags} '
+                    'WHERE survey_id = %s AND tag_id IN ({ids}) '
+                    'AND answer_id NOT IN (SELECT answer_id FROM {tags} '
+                    '                      WHERE survey_id = %s '
+                    '                      AND tag_id = %s)'.format(
+                        tags=ANSWER_TAGS_TABLE, ids=id_list),
+                    (self.survey_id,) + source_ids + (self.survey_id,
+                                                      self.id), 1)
+                cursor.execute(
+                    'INSERT INTO {tags} (answer_id, tag_id, survey_id) '
+                    'SELECT DISTINCT answer_id, %s, survey_id FROM {tags} '
+                    'WHERE survey_id = %s AND tag_id IN ({ids}) '
+                    'ON CONFLICT DO NOTHING'.format(tags=ANSWER_TAGS_TABLE,
+                                                    ids=id_list),
+                    (self.id, self.survey_id) + source_ids)
+                count = cursor.rowcount
+                cursor.execute(
+                    'DELETE FROM {tags} '
+                    'WHERE survey_id = %s AND tag_id IN ({ids})'.format(
+                        tags=ANSWER_TAGS_TABLE, ids=id_list),
+                    (self.survey_id,) + source_ids)
+            Tag.objects.filter(id__in=source_ids).delete()
+            Tag.renumber(self.survey_id)
+            self.touch_survey()
+        self.refresh_from_db(fields=['ordinal'])
+        return count
+
+    def remove_from(self, answers):
+        """ Removes this tag from every answer in the `answers` queryset, with
+        a single DELETE from the `Answer.tags` through table.
+
+        Locks the survey first, as `apply_to()` does. Returns the number of
+        answers untagged.
+        """
+        sql, params = answers.order_by().values('id').query.sql_with_params()
+        with transaction.atomic(using=answers.db):
+            Survey.touch({'pk' : self.survey_id})
+            with connections[answers.db].cursor() as cursor:
+                count_tagging(
+                    cursor, self.survey_id, self.id,
+                    'SELECT answer_id FROM {tags} '
+                    'WHERE survey_id = %s AND tag_id = %s '
+                    'AND answer_id IN ({answers})'.format(
+                        tags=ANSWER_TAGS_TABLE, answers=sql),
+                    (self.survey_id, self.id) + tuple(params), -1)
+                cursor.execute(
+                    'DELETE FROM {tags} '
+                    'WHERE survey_id = %s AND tag_id = %s '
+                    'AND answer_id IN ({answers})'.format(
+                        tags=ANSWER_TAGS_TABLE, answers=sql),
+                    (self.survey_id, self.id) + tuple(params))
+                count = cursor.rowcount
+            if not count:
+                transaction.set_rollback(True, using=answers.db)
+        return count
+
 
-class Response(models.Model):
+class Response(OrdinalModel):
     """ A series of answers representing a response to the survey
 
     Attributes:
         survey       The `Survey` object to which this response belongs
     """
+    ordinal_parent = 'survey'
+
     survey = models.ForeignKey(Survey, related_name='responses')
 
+    class Meta(OrdinalModel.Meta):
+        """ Meta details to index responses by their ordinal in the survey """
+        index_together = (('survey', 'ordinal'),)
+
     def save(self, *args, **kwargs):
-        """ Saves the response if the survey is published, otherwise raises
-        a DBError
+        """ Saves the response if the survey is accepting responses,
+        otherwise raises a DBError
          """
-        if self.survey.published:
-            # pylint: disable=no-member
-            super(Response, self).save(*args, **kwargs)
+        if self.survey.accepting_responses:
+            with transaction.atomic():
+                adding = self._state.adding
+                # pylint: disable=no-member
+                super(Response, self).save(*args, **kwargs)
+                if adding:
+                    Survey.objects.filter(pk=self.survey_id).update(
+                        response_count=F('response_count') + 1)
         else:
             raise DBError('This survey has not been published')
 
+    def delete(self, *args, **kwargs):
+        """ Deletes the response and takes it off the survey's count, and its
+        answers' tags off the tag counts, under the survey's lock
+        """
+        with transaction.atomic():
+            self.lock_parent(self.survey_id)
+            with connections[Answer.objects.db].cursor() as cursor:
+                count_answers(cursor, self.survey_id,
+                              'SELECT id FROM %s WHERE response_id = %%s'
+                              % Answer._meta.db_table, [self.id], -1)
+            super(Response, self).delete(*args, **kwargs)
+            Survey.objects.filter(pk=self.survey_id).update(
+                response_count=F('response_count') - 1)
+
+
+class Answer(OrdinalModel):
+    """ A single answer to a question that composes the survey. The ordinal of
+    an answer is its position within the response.
 
-class Answer(models.Model):
-    """ A single answer to a question that composes the survey
+    Answers, and the rows tagging them, carry the survey they belong to so
+    that the tables can be partitioned by it, see `surveys.partitions`.
 
     Attributes:
         response       The `Response` object that contains this answer
+        survey         The `Survey` the response belongs to, set from it on
+                       save
         question       The `Question` to which this is the answer for
         answer_text    The answer text, to be populated by a survey respondent
         tags           A series of tags associated with this answer, added by
                        the survey owner after completion
     """
+    ordinal_parent = 'response'
+    survey_lookup = 'responses'
+
     response = models.ForeignKey(Response, related_name='answers')
+    survey = models.ForeignKey(Survey, related_name='answers', editable=False)
     question = models.ForeignKey(Question, related_name='answers')
     answer_text = models.TextField()
-    tags = models.ManyToManyField(Tag, blank=True)
+    tags = models.ManyToManyField(Tag, blank=True, through='AnswerTag')
+
+    class Meta(OrdinalModel.Meta):
+        """ Meta details to index answers by their ordinal in the response """
+        index_together = (('response', 'ordinal'),)
+
+    def save(self, *args, **kwargs):
+        """ Saves the answer, taking its survey from its response """
+        if self.survey_id is None:
+            self.survey_id = self.response.survey_id
+        super(Answer, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """ Deletes the answer, taking its tags off the survey's tag counts
+        under the survey's lock
+        """
+        with transaction.atomic():
+            Response.lock_parent(self.survey_id)
+            with connections[Answer.objects.db].cursor() as cursor:
+                count_answers(cursor, self.survey_id, '%s', [self.id], -1)
+            super(Answer, self).delete(*args, **kwargs)
+
+    def set_tags(self, tag_ids):
+        """ Makes `tag_ids` the exact set of tags on this answer, deleting the
+        through rows of the tags that are no longer wanted and inserting those
+        of the new ones, with one statement each. Tags already on the answer
+        are left alone. Returns True if anything changed.
+
+        The answer's tags are taken off the survey's tag counts before the
+        change and put back after it, see `count_answers()`. As in
+        `Tag.apply_to()`, the survey's version is bumped first to lock it
+        while they are, and the bump is rolled back if nothing changed.
+        """
+        tag_ids = sorted(tag_ids)
+        with transaction.atomic():
+            Survey.touch({'pk' : self.survey_id})
+            with connections[Answer.objects.db].cursor() as cursor:
+                count_answers(cursor, self.survey_id, '%s', [self.id], -1)
+                not_wanted = ''
+                if tag_ids:
+                    not_wanted = 'AND tag_id NOT IN (%s)' % ', '.join(
+                        ['%s'] * len(tag_ids))
+                cursor.execute(
+                    'DELETE FROM {tags} WHERE survey_id = %s '
+                    'AND answer_id = %s {not_wanted}'.format(
+                        tags=ANSWER_TAGS_TABLE, not_wanted=not_wanted),
+                    [self.survey_id, self.id] + tag_ids)
+                changed = cursor.rowcount
+                if tag_ids:
+                    cursor.execute(
+                        'INSERT INTO {tags} (answer_id, tag_id, survey_id) '
+                        'VALUES {rows} ON CONFLICT DO NOTHING'.format(
+                            tags=ANSWER_TAGS_TABLE,
+                            rows=', '.join(['(%s, %s, %s)'] * len(tag_ids))),
+                        [value for tag_id in tag_ids
+                         for value in (self.id, tag_id, self.survey_id)])
+                    changed += cursor.rowcount
+                count_answers(cursor, self.survey_id, '%s', [self.id], 1)
+            if not changed:
+                transaction.set_rollback(True)
+        return bool(changed)
 
     @property
     def tag_strings(self):
@@ -123,3 +758,247 @@ class Answer(models.Model):
         with this answer
         """
         return [tag.tag_text for tag in self.tags.all()]
+
+
+class AnswerTag(models.Model):
+    """ The tagging of an answer with a tag, i.e. the through table of
+    `Answer.tags`
+
+    Attributes:
+        answer    The `Answer` tagged
+        tag       The `Tag` it is tagged with
+        survey    The `Survey` of the answer, by which the table can be
+                  partitioned
+    """
+    answer = models.ForeignKey(Answer)
+    tag = models.ForeignKey(Tag)
+    survey = models.ForeignKey(Survey, related_name='+')
+
+    class Meta:
+        """ Meta details to keep the table of the implicit through model this
+        replaced, tag an answer with a tag at most once, and find the answers
+        with a tag from the index alone
+        """
+        db_table = 'surveys_answer_tags'
+        unique_together = (('answer', 'tag'),)
+        index_together = (('tag', 'answer'),)
+
+
+class TagCount(models.Model):
+    """ The number of answers to a question that carry a tag, kept up to date
+    by every change to the tags on answers, see `count_tagging()` and
+    `count_answers()`
+
+    Attributes:
+        survey          The `Survey` of the tag and question
+        tag             The `Tag` counted
+        question        The `Question` whose answers are counted
+        answer_count    The number of answers to the question with the tag
+    """
+    survey = models.ForeignKey(Survey, related_name='+')
+    tag = models.ForeignKey(Tag, related_name='+')
+    question = models.ForeignKey(Question, related_name='+')
+    answer_count = models.IntegerField(default=0)
+
+    class Meta:
+        """ Meta details to keep one count per tag and question """
+        unique_together = (('tag', 'question'),)
+
+
+class TagPair(models.Model):
+    """ The number of answers that carry both of a pair of tags, kept up to
+    date as `TagCount` is. Each pair is held both ways round.
+
+    Attributes:
+        survey          The `Survey` of the tags
+        tag             One `Tag` of the pair
+        other           The other `Tag` of the pair
+        answer_count    The number of answers with both tags
+    """
+    survey = models.ForeignKey(Survey, related_name='+')
+    tag = models.ForeignKey(Tag, related_name='+')
+    other = models.ForeignKey(Tag, related_name='+')
+    answer_count = models.IntegerField(default=0)
+
+    class Meta:
+        """ Meta details to keep one count per pair of tags """
+        unique_together = (('tag', 'other'),)
+
+
+ArchivedAnswer = namedtuple('ArchivedAnswer', ('ordinal', 'question_id',
+                                               'answer_text', 'tag_strings'))
+"""
+An answer read back from the archive, with the attributes of an `Answer` that
+`AnswerSerializer` reads
+"""
+
+
+class ArchivedResponse(models.Model):
+    """ The answers to a response to an archived survey, see
+    `Survey.archive()`
+
+    Attributes:
+        response    The `Response` whose answers these are
+        survey      The `Survey` of the response
+        data        The zlib-compressed JSON list of the answers in order,
+                    each as `[question_id, answer_text, [tag_id, ...]]`
+    """
+    response = models.OneToOneField(Response, primary_key=True,
+                                    related_name='archive')
+    survey = models.ForeignKey(Survey, related_name='+')
+    data = models.BinaryField()
+
+    @staticmethod
+    def pack(answers):
+        """ Packs a sequence of `(question_id, answer_text, tag_ids)` """
+        return zlib.compress(json.dumps(answers).encode())
+
+    @staticmethod
+    def unpack(data):
+        """ Reverses `pack()` """
+        return json.loads(zlib.decompress(bytes(data)).decode())
+
+    def answers(self, tag_texts):
+        """ Returns the `ArchivedAnswer`s of the response, given the text of
+        the survey's tags by id. Tags that have since been deleted are left
+        out.
+        """
+        return [ArchivedAnswer(ordinal, question_id, answer_text,
+                               [tag_texts[tag_id] for tag_id in tag_ids
+                                if tag_id in tag_texts])
+                for ordinal, (question_id, answer_text, tag_ids)
+                in enumerate(self.unpack(self.data), start=1)]
+
+
+class IngestCursor(models.Model):
+    """ How far the ingest worker has got through a response spool. It is
+    advanced in the same transaction as the responses it covers, so entries
+    the spool still holds after a crash are recognised and not written again.
+
+    Attributes:
+        spool         The id of the spool
+        last_entry    The id of the last spool entry ingested
+    """
+    spool = models.CharField(max_length=32, unique=True)
+    last_entry = models.BigIntegerField(default=0)
+
+
+@receiver(post_save, sender=Survey)
+@receiver(post_delete, sender=Survey)
+# pylint: disable=unused-argument
+def invalidate_survey_snapshot(sender, instance, **kwargs):
+    """ Drops the cached snapshot of a survey when it changes """
+    SNAPSHOTS.invalidate(instance.id)
+
+
+@receiver(pre_delete, sender=Survey)
+# pylint: disable=unused-argument
+def drop_survey_partitions(sender, instance, using, **kwargs):
+    """ Drops the partitions of a survey however it is deleted, e.g. in a
+    queryset or along with its owner, so that none are left behind
+    """
+    drop_partitions(connections[using], instance.pk)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+# pylint: disable=unused-argument
+def invalidate_question_snapshot(sender, instance, **kwargs):
+    """ Drops the cached snapshot of a survey when its questions change """
+    SNAPSHOTS.invalidate(instance.survey_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+# pylint: disable=unused-argument
+def invalidate_owner_snapshots(sender, instance, created=False,
+                               update_fields=None, **kwargs):
+    """ Drops the cached snapshots of a user's surveys, which hold their
+    username, unless the save can't have changed it
+    """
+    if created or (update_fields is not None and
+                   'username' not in update_fields):
+        return
+    for survey_id in instance.surveys.values_list('id', flat=True):
+        SNAPSHOTS.invalidate(survey_id)
+
+
+ANSWER_TAGS_TABLE = Answer.tags.through._meta.db_table # pylint: disable=no-member
+"""
+The through table of the `Answer.tags` many-to-many relation, which set-based
+tagging operations write to directly
+"""
+
+
+def count_tagging(cursor, survey_id, tag_id, answers, params, sign):
+    """ Adds the answers selected by the SQL `answers` to the counts of a tag,
+    with `sign` 1, or takes them off with `sign` -1. Call this before tagging
+    the answers with the tag or untagging them: it counts the answers
+    towards the tag's `TagCount` of each of their questions, and towards the
+    `TagPair`s of the tag with every other tag already on them. `answers`
+    must select the ids of the answers whose tagging changes, each once.
+    """
+    cursor.execute(
+        'INSERT INTO {counts} (survey_id, tag_id, question_id, answer_count) '
+        'SELECT %s, %s, question_id, %s * COUNT(*) FROM {answer} '
+        'WHERE survey_id = %s AND id IN ({answers}) '
+        'GROUP BY question_id '
+        'ON CONFLICT (tag_id, question_id) DO UPDATE '
+        'SET answer_count = {counts}.answer_count '
+        '                   + excluded.answer_count'.format(
+            counts=TagCount._meta.db_table, answer=Answer._meta.db_table,
+            answers=answers),
+        (survey_id, tag_id, sign, survey_id) + tuple(params))
+    other_tags = ('SELECT tag_id FROM {tags} WHERE survey_id = %s '
+                  'AND tag_id <> %s AND answer_id IN ({answers})'.format(
+                      tags=ANSWER_TAGS_TABLE, answers=answers))
+    cursor.execute(
+        'INSERT INTO {pairs} (survey_id, tag_id, other_id, answer_count) '
+        'SELECT %s, pair.tag_id, pair.other_id, %s * COUNT(*) '
+        'FROM (SELECT %s AS tag_id, tag_id AS other_id FROM ({others}) AS one '
+        '      UNION ALL '
+        '      SELECT tag_id, %s FROM ({others}) AS two) AS pair '
+        'WHERE true GROUP BY pair.tag_id, pair.other_id '
+        'ON CONFLICT (tag_id, other_id) DO UPDATE '
+        'SET answer_count = {pairs}.answer_count '
+        '                   + excluded.answer_count'.format(
+            pairs=TagPair._meta.db_table, others=other_tags),
+        (survey_id, sign, tag_id) + (survey_id, tag_id) + tuple(params)
+        + (tag_id,) + (survey_id, tag_id) + tuple(params))
+
+
+def count_answers(cursor, survey_id, answers, params, sign):
+    """ Adds every tag on the answers selected by the SQL `answers` to the
+    survey's `TagCount`s and `TagPair`s, with `sign` 1, or takes them off
+    with `sign` -1. Changes to several tags at once, or deletions, are
+    counted by taking the answers off before the change and putting them back
+    after it.
+    """
+    cursor.execute(
+        'INSERT INTO {counts} (survey_id, tag_id, question_id, answer_count) '
+        'SELECT %s, tagging.tag_id, answer.question_id, %s * COUNT(*) '
+        'FROM {tags} AS tagging JOIN {answer} AS answer '
+        '     ON answer.id = tagging.answer_id '
+        '     AND answer.survey_id = tagging.survey_id '
+        'WHERE tagging.survey_id = %s AND tagging.answer_id IN ({answers}) '
+        'GROUP BY tagging.tag_id, answer.question_id '
+        'ON CONFLICT (tag_id, question_id) DO UPDATE '
+        'SET answer_count = {counts}.answer_count '
+        '                   + excluded.answer_count'.format(
+            counts=TagCount._meta.db_table, tags=ANSWER_TAGS_TABLE,
+            answer=Answer._meta.db_table, answers=answers),
+        (survey_id, sign, survey_id) + tuple(params))
+    cursor.execute(
+        'INSERT INTO {pairs} (survey_id, tag_id, other_id, answer_count) '
+        'SELECT %s, tagging.tag_id, other.tag_id, %s * COUNT(*) '
+        'FROM {tags} AS tagging JOIN {tags} AS other '
+        '     ON other.answer_id = tagging.answer_id '
+        '     AND other.survey_id = tagging.survey_id '
+        '     AND other.tag_id <> tagging.tag_id '
+        'WHERE tagging.survey_id = %s AND tagging.answer_id IN ({answers}) '
+        'GROUP BY tagging.tag_id, other.tag_id '
+        'ON CONFLICT (tag_id, other_id) DO UPDATE '
+        'SET answer_count = {pairs}.answer_count '
+        '                   + excluded.answer_count'.format(
+            pairs=TagPair._meta.db_table, tags=ANSWER_TAGS_TABLE,
+            answers=answers),
+        (survey_id, sign, survey_id) + tuple(params))
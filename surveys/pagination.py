@@ -0,0 +1,91 @@
+""" Pagination definitions for the lists under a survey """
+
+from django.conf import settings
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+
+
+class OrdinalCursorPagination(pagination.CursorPagination):
+    """ Keyset pagination over the `ordinal` of the listed objects.
+
+    Each page is fetched as `ordinal > <last ordinal of previous page>` using
+    the `(<parent>, ordinal)` index, so deep pages cost the same as the first.
+    The cursors handed out in the `next`/`previous` links are opaque.
+
+    A cursor's offset only counts the objects sharing its position, and the
+    keys paged on here are unique, so the links never carry one. Cursors
+    with a larger offset than `max_offset` are refused, as the offset comes
+    from the client and would make each page an OFFSET scan.
+
+    Attributes:
+        ordering                 The indexed key the pages are ordered on
+        page_size                The default number of objects per page
+        page_size_query_param    The query parameter to request a page size
+        max_page_size            The hard upper limit on requested page sizes
+        max_offset               The largest offset accepted in a cursor
+    """
+    ordering = 'ordinal'
+    page_size = settings.SURVEYS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.SURVEYS_MAX_PAGE_SIZE
+    max_offset = 0
+
+    def decode_cursor(self, request):
+        cursor = super(OrdinalCursorPagination, self).decode_cursor(request)
+        if cursor is not None and cursor.offset > self.max_offset:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+
+class AnswerCursorPagination(OrdinalCursorPagination):
+    """ Keyset pagination over the ids of answers drawn from across a survey,
+    whose ordinals are only unique within their response. Each page is a
+    single range scan of an index ending in the answer id, such as that of
+    the tags on answers on `(tag_id, answer_id)`.
+
+    Attributes:
+        ordering    The indexed key the pages are ordered on
+    """
+    ordering = 'id'
+
+
+class OrdinalList(list):
+    """ A list of objects with an `ordinal`, e.g. answers read from the
+    archive, that `OrdinalCursorPagination` can page as it would a queryset
+    """
+
+    def order_by(self, ordering):
+        """ Returns the objects sorted on `ordinal`, or `-ordinal` """
+        return OrdinalList(sorted(self, key=lambda item: item.ordinal,
+                                  reverse=ordering.startswith('-')))
+
+    def filter(self, ordinal__gt=None, ordinal__lt=None):
+        """ Returns the objects after or before the ordinal of a cursor """
+        if ordinal__gt is not None:
+            return OrdinalList(item for item in self
+                               if item.ordinal > int(ordinal__gt))
+        return OrdinalList(item for item in self
+                           if item.ordinal < int(ordinal__lt))
+
+
+class RankedPagination(pagination.PageNumberPagination):
+    """ Page-numbered pagination for lists ordered on a computed key, such as
+    search results ordered by relevance, which can't be paged with a cursor.
+
+    Attributes:
+        page_size                The default number of objects per page
+        page_size_query_param    The query parameter to request a page size
+        max_page_size            The hard upper limit on requested page sizes
+    """
+    page_size = settings.SURVEYS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.SURVEYS_MAX_PAGE_SIZE
@@ -0,0 +1,90 @@
+""" Opt-in partitioning of the answer tables by survey, on PostgreSQL 11+.
+
+`manage.py partition_answers` turns `surveys_answer` and its tags through
+table into tables partitioned by LIST on their `survey_id`, with a partition
+of each per survey and a default partition. Queries that filter on the survey
+then only touch that survey's partitions, and deleting a survey drops them
+rather than deleting its rows one by one.
+
+Once the tables are partitioned, creating or deleting a survey creates or
+drops its partitions. Whether they are is read from the catalog once per
+process and database.
+"""
+
+import threading
+
+
+ANSWER_TABLES = ('surveys_answer', 'surveys_answer_tags')
+"""
+The tables partitioned by survey. A survey's partition of each is dropped in
+reverse order.
+"""
+
+_PARTITIONED = {}
+_PARTITIONED_LOCK = threading.Lock()
+
+
+def is_partitioned(connection):
+    """ Returns whether the answer tables are partitioned on the database of
+    `connection`
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with _PARTITIONED_LOCK:
+        if connection.alias not in _PARTITIONED:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table '
+                    "WHERE partrelid = to_regclass('surveys_answer'))")
+                _PARTITIONED[connection.alias] = cursor.fetchone()[0]
+        return _PARTITIONED[connection.alias]
+
+
+def forget_partitioning():
+    """ Drops what is known of which databases are partitioned, e.g. after
+    partitioning one
+    """
+    with _PARTITIONED_LOCK:
+        _PARTITIONED.clear()
+
+
+def partition_name(table, survey_id):
+    """ The name of a survey's partition of one of the `ANSWER_TABLES` """
+    return '%s_s%d' % (table, survey_id)
+
+
+def create_partitions(connection, survey_id):
+    """ Creates the partitions of a survey, if the tables are partitioned """
+    if not is_partitioned(connection):
+        return
+    with connection.cursor() as cursor:
+        for table in ANSWER_TABLES:
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} '
+                'FOR VALUES IN ({survey_id})'.format(
+                    partition=partition_name(table, survey_id), table=table,
+                    survey_id=int(survey_id)))
+
+
+def drop_partitions(connection, survey_id):
+    """ Drops the partitions of a survey, and everything in them, if the
+    tables are partitioned
+    """
+    if not is_partitioned(connection):
+        return
+    with connection.cursor() as cursor:
+        for table in reversed(ANSWER_TABLES):
+            cursor.execute('DROP TABLE IF EXISTS %s'
+                           % partition_name(table, survey_id))
+
+
+def truncate_partitions(connection, survey_id):
+    """ Empties the partitions of a survey, and returns True, if the tables
+    are partitioned
+    """
+    if not is_partitioned(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('TRUNCATE %s' % ', '.join(
+            partition_name(table, survey_id) for table in ANSWER_TABLES))
+    return True
@@ -0,0 +1,98 @@
+""" Full-text search over the answers to a survey """
+
+import re
+
+from django.db import connections
+from django.utils.html import escape
+
+from .models import Answer
+
+
+SEARCH_CONFIG = 'english'
+"""
+The PostgreSQL text search configuration answers are indexed and searched with.
+This has to match the expression index created in migration 0003.
+"""
+
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+"""
+The markers `ts_headline` puts around matching words in a snippet, which
+`format_snippet()` swaps for <b></b> once the respondent's text is escaped
+"""
+
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+_WORD = re.compile(r'\w+')
+
+
+def to_tsquery(query):
+    """ Converts a search string into PostgreSQL `tsquery` syntax, or returns
+    None if it contains nothing to search for.
+
+    All terms must match. A term in double quotes matches as a phrase, i.e.
+    the words must appear next to each other and in order, and a term ending
+    in `*` matches any word starting with it.
+
+    Example:- 'bad "customer service" refund*' becomes
+              "bad & (customer <-> service) & refund:*"
+    """
+    clauses = []
+    for phrase, term in _TERM.findall(query):
+        words = _WORD.findall(phrase or term)
+        if not words:
+            continue
+        if term.endswith('*'):
+            words[-1] += ':*'
+        if len(words) == 1:
+            clauses.append(words[0])
+        else:
+            clauses.append('(%s)' % ' <-> '.join(words))
+    return ' & '.join(clauses) or None
+
+
+def search_answers(survey, query):
+    """ Returns a queryset of the answers to `survey` that match the search
+    string `query` (see `to_tsquery()`), best matches first. Each answer is
+    annotated with its `rank` and a `snippet` of its text with the matching
+    words between `HIGHLIGHT_START` and `HIGHLIGHT_STOP`; see
+    `format_snippet()`.
+
+    On PostgreSQL the match runs against a GIN index on the answer text's
+    `tsvector`. Other databases fall back to an unranked, case-insensitive
+    substring match on each word.
+    """
+    tsquery = to_tsquery(query)
+    # pylint: disable=no-member
+    answers = Answer.objects.filter(survey=survey).select_related(
+        'response', 'question')
+    if tsquery is None:
+        return answers.none()
+
+    if connections[answers.db].vendor != 'postgresql':
+        for word in _WORD.findall(query):
+            answers = answers.filter(answer_text__icontains=word)
+        return answers.extra(
+            select={'rank' : '0', 'snippet' : 'surveys_answer.answer_text'}
+        ).order_by('id')
+
+    vector = "to_tsvector('%s', surveys_answer.answer_text)" % SEARCH_CONFIG
+    ts_query = "to_tsquery('%s', %%s)" % SEARCH_CONFIG
+    return answers.extra(
+        select={
+            'rank' : 'ts_rank(%s, %s)' % (vector, ts_query),
+            'snippet' : "ts_headline('%s', surveys_answer.answer_text, %s, "
+                        "%%s)" % (SEARCH_CONFIG, ts_query),
+        },
+        select_params=(tsquery, tsquery,
+                       'StartSel=%s, StopSel=%s' % (HIGHLIGHT_START,
+                                                    HIGHLIGHT_STOP)),
+        where=['%s @@ %s' % (vector, ts_query)],
+        params=(tsquery,)).order_by('-rank', 'id')
+
+
+def format_snippet(snippet):
+    """ Returns a snippet from `search_answers()` as HTML: the respondent's
+    text escaped, and the matching words wrapped in <b></b> tags
+    """
+    return escape(snippet).replace(HIGHLIGHT_START, '<b>').replace(
+        HIGHLIGHT_STOP, '</b>')
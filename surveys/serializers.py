@@ -3,7 +3,9 @@
 
 from rest_framework import serializers
 
-from .models import Survey, Response, Question, Answer, Tag
+from .models import (Survey, Response, Question, Answer, Tag,
+                     ArchivedResponse)
+from .search import format_snippet
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -34,6 +36,54 @@ class AnswerSerializer(serializers.ModelSerializer):
         read_only_fields = ('answer_text',)
         fields = ('answer_text', 'tag_strings',)
 
+class AnswerSearchSerializer(serializers.ModelSerializer):
+    """ Serialization definition for `Answer` objects found by a search.
+
+    Search results are serialized as:
+        {
+            'response' : <ordinal of the response>,
+            'question' : <ordinal of the question>,
+            'answer_text' : <answer_text>,
+            'snippet' : <excerpt of answer_text as HTML, matches wrapped in
+                         <b></b>>,
+            'rank' : <relevance to the search>
+        }
+    """
+    response = serializers.IntegerField(source='response.ordinal',
+                                        read_only=True)
+    question = serializers.IntegerField(source='question.ordinal',
+                                        read_only=True)
+    snippet = serializers.SerializerMethodField()
+    rank = serializers.FloatField(read_only=True)
+
+    # pylint: disable=no-self-use
+    def get_snippet(self, answer):
+        """ The snippet, escaped, with its matches highlighted """
+        return format_snippet(answer.snippet)
+
+    class Meta:
+        model = Answer
+        fields = ('response', 'question', 'answer_text', 'snippet', 'rank')
+
+class TaggedAnswerSerializer(serializers.ModelSerializer):
+    """ Serialization definition for `Answer` objects listed by their tag.
+
+    Tagged answers are serialized as:
+        {
+            'response' : <ordinal of the response>,
+            'question' : <ordinal of the question>,
+            'answer_text' : <answer_text>
+        }
+    """
+    response = serializers.IntegerField(source='response.ordinal',
+                                        read_only=True)
+    question = serializers.IntegerField(source='question.ordinal',
+                                        read_only=True)
+
+    class Meta:
+        model = Answer
+        fields = ('response', 'question', 'answer_text')
+
 class ResponseSerializer(serializers.ModelSerializer):
     """ Serialization definition for the the `Response` objects
 
@@ -50,6 +100,87 @@ class ResponseSerializer(serializers.ModelSerializer):
         model = Response
         fields = ('answers',)
 
+class ArchivedResponseSerializer(serializers.ModelSerializer):
+    """ Serialization definition for `Response` objects of an archived survey,
+    whose answers are read from the archive, laid out as by
+    `ResponseSerializer`
+    """
+
+    answers = serializers.SerializerMethodField()
+
+    # pylint: disable=no-self-use
+    def get_answers(self, response):
+        """ The answer texts, in order, unpacked from the archive """
+        return [answer_text for _, answer_text, _
+                in ArchivedResponse.unpack(response.archive.data)]
+
+    class Meta:
+        model = Response
+        fields = ('answers',)
+
+# pylint: disable=abstract-method
+class ResponseSubmissionSerializer(serializers.Serializer):
+    """ Serialization definition for responses posted to a survey in bulk,
+    each matching the answer layout of `ResponseSerializer`
+
+    Submitted responses are deserialized from:
+        {
+            'answers' : [<answer_text>, <answer_text>, ...]
+        }
+    """
+    answers = serializers.ListField(
+        child=serializers.CharField(allow_blank=True))
+
+# pylint: disable=abstract-method
+class AnswerSelectionSerializer(serializers.Serializer):
+    """ Deserialization definition for a selection of answers in a survey that
+    an operation, e.g. applying a tag, should act on.
+
+    Every field is optional, but at least one must be given. An answer is
+    selected if it matches all of the given fields:
+        {
+            'answers' : [[<response ordinal>, <answer ordinal>], ...],
+            'responses' : [<response ordinal>, ...],
+            'question' : <question ordinal>,
+            'q' : <search string, as for answers/search/>
+        }
+    """
+    answers = serializers.ListField(
+        child=serializers.ListField(child=serializers.IntegerField()),
+        required=False)
+    responses = serializers.ListField(child=serializers.IntegerField(),
+                                      required=False)
+    question = serializers.IntegerField(required=False)
+    q = serializers.CharField(required=False)
+
+    # pylint: disable=no-self-use
+    def validate_answers(self, value):
+        """ Make sure each answer is given as a pair of ordinals """
+        if any(len(pair) != 2 for pair in value):
+            raise serializers.ValidationError(
+                'Answers must be given as [<response>, <answer>] pairs')
+        return value
+
+    def validate(self, data):
+        """ Refuse an empty selection rather than selecting everything """
+        if not data:
+            raise serializers.ValidationError(
+                'Give at least one of answers, responses, question or q')
+        return data
+
+# pylint: disable=abstract-method
+class TagMergeSerializer(serializers.Serializer):
+    """ Deserialization definition for merging tags of a survey into one.
+
+    Merges are deserialized from:
+        {
+            'source' : [<tag ordinal>, <tag ordinal>, ...],
+            'target' : <tag ordinal>
+        }
+    """
+    source = serializers.ListField(child=serializers.IntegerField())
+    target = serializers.IntegerField()
+
 class QuestionSerializer(serializers.ModelSerializer):
     """ Serialization definition for the the `Question` objects
 
@@ -72,7 +203,8 @@ class SurveySerializer(serializers.ModelSerializer):
             'id' : <id>,
             'name' : <name>,
             'response_count' : <number of associated `Response` objects>,
-            'published' : <True|False>
+            'published' : <True|False>,
+            'archived' : <True|False>
         }
 
     """
@@ -94,5 +226,5 @@ class SurveySerializer(serializers.ModelSerializer):
     class Meta:
         model = Survey
         fields = ('id', 'name', 'questions', 'tag_options', 'response_count',
-                  'published')
+                  'published', 'archived')
 
@@ -0,0 +1,137 @@
+""" A durable local spool of response submissions, for the async ingest mode.
+
+With `SURVEYS_INGEST_SPOOL` set to a file path, `submit()` checks each
+response against the survey's snapshot and appends it to a SQLite journal at
+that path instead of writing it to the database, so a slow or briefly
+unavailable database doesn't hold up respondents. `manage.py ingest_worker`
+drains the journal into the database in batches.
+
+Every spool has an id of its own, and the worker records the last entry of it
+ingested in the same transaction as the responses (see `IngestCursor`), so an
+entry is written exactly once even if the worker stops between committing a
+batch and clearing it from the spool.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from pushkin.metrics import GAUGES, Gauge
+
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS spool_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS submissions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        survey_id INTEGER NOT NULL,
+        answers TEXT NOT NULL,
+        received REAL NOT NULL
+    );
+'''
+
+
+class Spool(object):
+    """ An append-only journal of response submissions in a SQLite file.
+
+    Appends are committed with `synchronous=FULL` before they return, so an
+    acknowledged submission survives a crash. Entry ids only ever increase,
+    as the table is AUTOINCREMENT. Each thread uses its own connection.
+
+    Attributes:
+        path    The path of the SQLite file
+        id      The unique id of this spool, generated when it is created
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        connection = self.connection
+        with connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO spool_meta (key, value) '
+                "VALUES ('id', ?)", (uuid.uuid4().hex,))
+        self.id = connection.execute(
+            "SELECT value FROM spool_meta WHERE key = 'id'").fetchone()[0]
+
+    @property
+    def connection(self):
+        """ This thread's connection to the spool """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=FULL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def append(self, survey_id, answers):
+        """ Durably records a response of `answers` strings to a survey """
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO submissions (survey_id, answers, received) '
+                'VALUES (?, ?, ?)', (survey_id, json.dumps(answers),
+                                     time.time()))
+
+    def read(self, after, limit):
+        """ Returns up to `limit` of the oldest `(id, survey_id, answers)`
+        entries with ids above `after`
+        """
+        rows = self.connection.execute(
+            'SELECT id, survey_id, answers FROM submissions WHERE id > ? '
+            'ORDER BY id LIMIT ?', (after, limit)).fetchall()
+        return [(entry_id, survey_id, json.loads(answers))
+                for entry_id, survey_id, answers in rows]
+
+    def clear_through(self, entry_id):
+        """ Deletes every entry up to and including `entry_id` """
+        with self.connection:
+            self.connection.execute('DELETE FROM submissions WHERE id <= ?',
+                                    (entry_id,))
+
+    def backlog(self):
+        """ Returns the number of entries waiting and the age in seconds of
+        the oldest of them, or 0 if there are none
+        """
+        count, oldest = self.connection.execute(
+            'SELECT COUNT(*), MIN(received) FROM submissions').fetchone()
+        return count, (time.time() - oldest if oldest is not None else 0)
+
+
+_SPOOLS = {}
+_SPOOLS_LOCK = threading.Lock()
+
+
+def get_spool():
+    """ Returns the spool configured by `SURVEYS_INGEST_SPOOL`, or None if
+    responses are written to the database directly
+    """
+    path = settings.SURVEYS_INGEST_SPOOL
+    if not path:
+        return None
+    with _SPOOLS_LOCK:
+        if path not in _SPOOLS:
+            _SPOOLS[path] = Spool(path)
+        return _SPOOLS[path]
+
+
+def _backlog(index):
+    """ Reads one figure of the configured spool's backlog for a gauge """
+    spool = get_spool()
+    return spool.backlog()[index] if spool is not None else None
+
+GAUGES.extend([
+    Gauge('pushkin_ingest_backlog_entries',
+          'Response submissions waiting in the ingest spool',
+          lambda: _backlog(0)),
+    Gauge('pushkin_ingest_backlog_age_seconds',
+          'Age of the oldest response submission in the ingest spool',
+          lambda: _backlog(1)),
+])
@@ -1,12 +1,20 @@
 
 """ Tests the API itself; http codes and response bodies """
 
+import base64
+import csv
+import json
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.six import BytesIO
 from rest_framework.parsers import JSONParser
 from rest_framework import status
 
 from .test_utils import TestBase
-from ..models import Survey
+from ..export import survey_export
+from ..models import Survey, Tag
+from ..search import format_snippet, to_tsquery
 from ..serializers import SurveySerializer
 
 class APITests(TestBase):
@@ -49,6 +57,490 @@ class APITests(TestBase):
                                  {'tag_text' : 'tagtagtag'})
         self.assertEqual(tag_count, survey.tag_options.count())
 
+    def test_normalized_tag_creation(self):
+        """ Tags are unique within a survey by their normalized text, and are
+        added or found in one statement
+        """
+        survey, other = self.users[0].surveys.all()[:2]
+        uri = '/surveys/%s/tags/' % survey.id
+        response = self.client.post(uri, {'tag_text' : 'Late-delivery'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        version = Survey.objects.get(id=survey.id).version
+
+        # Variants of the tag find it, and leave the survey's version alone
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(uri, {'tag_text' : ' LATE\u2013delivery'},
+                                        format='json')
+        self.assertEqual(response.data, {'tag_text' : 'Late-delivery'})
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'INSERT INTO' in query['sql']]),
+                         1)
+        self.assertEqual(survey.tag_options.filter(
+            tag_key='late-delivery').count(), 1)
+        self.assertEqual(Survey.objects.get(id=survey.id).version, version)
+
+        # Other surveys can have the same tag, but other users' can't be
+        # tagged
+        self.check_response_code('/surveys/%s/tags/' % other.id,
+                                 self.client.post, [status.HTTP_201_CREATED],
+                                 {'tag_text' : 'late-delivery'})
+        self.assertEqual(other.tag_options.get(tag_key='late-delivery').ordinal,
+                         other.tag_options.count())
+        self.check_response_code(
+            '/surveys/%s/tags/' % self.users[1].surveys.first().id,
+            self.client.post, [status.HTTP_403_FORBIDDEN],
+            {'tag_text' : 'late-delivery'})
+
+        # Renaming a tag onto another is refused
+        survey.tag_options.create(tag_text='Damaged')
+        response = self.client.patch(
+            uri + '%s/' % survey.tag_options.get(tag_text='Damaged').ordinal,
+            {'tag_text' : 'LATE-DELIVERY'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_response_creation(self):
+        """ Many responses can be added in one post on responses/bulk/ """
+        survey = self.users[0].surveys.first()
+        response_count = survey.responses.count()
+        body = [{'answers' : ['answer %s.%s' % (i, j) for j in range(2)]}
+                for i in range(3)]
+        response = self.client.post('/surveys/%s/responses/bulk/' % survey.id,
+                                    body, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created' : 3})
+        self.assertEqual(survey.responses.count(), response_count + 3)
+        self.assertEqual(
+            survey.questions.first().answers.filter(
+                answer_text__startswith='answer ').count(), 3)
+
+    def test_bulk_response_creation_is_atomic(self):
+        """ A bulk post with any malformed response creates nothing """
+        survey = self.users[0].surveys.first()
+        response_count = survey.responses.count()
+        body = [{'answers' : ['foo', 'bar']}, {'answers' : ['foo']}]
+        response = self.client.post('/surveys/%s/responses/bulk/' % survey.id,
+                                    body, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(survey.responses.count(), response_count)
+
+    def test_cursor_pagination(self):
+        """ Lists under a survey are paged, and following the `next` links
+        visits every object once, in ordinal order
+        """
+        survey = self.users[0].surveys.first()
+        for i in range(5):
+            survey.tag_options.create(tag_text='page_tag_%s' % i)
+        expected = list(survey.tag_options.values_list('tag_text', flat=True))
+
+        tag_texts = []
+        uri = '/surveys/%s/tags/?page_size=2' % survey.id
+        while uri:
+            response = self.client.get(uri)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            tag_texts += [tag['tag_text'] for tag in response.data['results']]
+            last_uri, uri = uri, response.data['next']
+        self.assertEqual(tag_texts, expected)
+
+        # Following the `previous` links back from the last page visits
+        # every object again
+        tag_texts = []
+        uri = last_uri
+        while uri:
+            response = self.client.get(uri)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            tag_texts = [tag['tag_text']
+                         for tag in response.data['results']] + tag_texts
+            uri = response.data['previous']
+        self.assertEqual(tag_texts, expected)
+
+        # A cursor with an offset, which the links never carry, is refused
+        cursor = base64.b64encode(b'o=500&p=1').decode('ascii')
+        response = self.client.get('/surveys/%s/tags/?cursor=%s'
+                                   % (survey.id, cursor))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export(self):
+        """ A survey's responses and their tags can be downloaded as CSV and
+        as newline-delimited JSON
+        """
+        survey = self.users[0].surveys.create(name='foo')
+        for question_text in ['foo?', 'bar?']:
+            survey.questions.create(question_text=question_text)
+        survey.publish()
+        tags = [survey.tag_options.create(tag_text=text)
+                for text in ['baz', 'qux']]
+        first, _ = survey.add_responses([['a', 'b'], ['c', 'd']])
+        for tag in tags:
+            tag.apply_to(first.answers.filter(ordinal=2))
+
+        response = self.client.get('/surveys/%s/export.csv' % survey.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(list(csv.reader(content.splitlines())),
+                         [['response', 'foo?', 'foo? (tags)',
+                           'bar?', 'bar? (tags)'],
+                          ['1', 'a', '', 'b', 'baz; qux'],
+                          ['2', 'c', '', 'd', '']])
+
+        response = self.client.get('/surveys/%s/export.ndjson' % survey.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual([json.loads(line) for line in content.splitlines()],
+                         [{'response' : 1, 'answers' : ['a', 'b'],
+                           'tags' : [[], ['baz', 'qux']]},
+                          {'response' : 2, 'answers' : ['c', 'd'],
+                           'tags' : [[], []]}])
+
+        # A tag added while the export streams is left out of it
+        rows = survey_export(survey)[1]
+        tag, _ = Tag.add(survey, 'new')
+        tag.apply_to(survey.answers.all())
+        self.assertEqual([tags for _, answers in rows for _, tags in answers],
+                         [[], ['baz', 'qux'], [], []])
+
+    def test_answer_search(self):
+        """ Answers can be searched for, optionally within one question """
+        survey = self.users[0].surveys.create(name='foo')
+        for question_text in ['foo?', 'bar?']:
+            survey.questions.create(question_text=question_text)
+        survey.publish()
+        survey.add_responses([['Terrible service', 'Refunded'],
+                              ['Lovely food', 'Terrible music']])
+
+        uri = '/surveys/%s/answers/search/' % survey.id
+        response = self.client.get(uri, {'q' : 'terrible'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            {(r['response'], r['question'], r['answer_text'])
+             for r in response.data['results']},
+            {(1, 1, 'Terrible service'), (2, 2, 'Terrible music')})
+
+        response = self.client.get(uri, {'q' : 'terrible', 'question' : 2})
+        self.assertEqual([r['answer_text'] for r in response.data['results']],
+                         ['Terrible music'])
+
+        self.check_response_code(uri, self.client.get,
+                                 [status.HTTP_400_BAD_REQUEST])
+
+    def test_search_snippet_escaping(self):
+        """ Snippets are HTML with the respondent's text escaped, so only the
+        highlighting is markup
+        """
+        survey = self.users[0].surveys.create(name='foo')
+        survey.questions.create(question_text='foo?')
+        survey.publish()
+        survey.add_responses([['<script>alert(1)</script> terrible']])
+        response = self.client.get('/surveys/%s/answers/search/' % survey.id,
+                                   {'q' : 'terrible'})
+        snippet = response.data['results'][0]['snippet']
+        self.assertNotIn('<script>', snippet)
+        self.assertIn('&lt;script&gt;', snippet)
+        self.assertEqual(format_snippet('a \x02b\x03 <i>'),
+                         'a <b>b</b> &lt;i&gt;')
+
+    def test_search_query_parsing(self):
+        """ Search strings are translated into tsquery syntax with phrase and
+        prefix matching, dropping anything that isn't a word
+        """
+        self.assertEqual(to_tsquery('bad "customer service" refund*'),
+                         'bad & (customer <-> service) & refund:*')
+        self.assertEqual(to_tsquery("it's & | !"), '(it <-> s)')
+        self.assertIsNone(to_tsquery('" & "'))
+
+    def test_bulk_tagging(self):
+        """ A tag can be applied to and removed from a selection of answers in
+        one request each
+        """
+        survey = self.users[0].surveys.create(name='foo')
+        for question_text in ['foo?', 'bar?']:
+            survey.questions.create(question_text=question_text)
+        survey.publish()
+        survey.add_responses([['Terrible service', 'Refunded'],
+                              ['Lovely food', 'Terrible music'],
+                              ['Lovely service', 'Nothing']])
+        tag = survey.tag_options.create(tag_text='baz')
+
+        def tagged():
+            """ The (response, answer) ordinals of the tagged answers """
+            return set(tag.answer_set.values_list('response__ordinal',
+                                                  'ordinal'))
+
+        uri = '/surveys/%s/tags/%s/' % (survey.id, tag.ordinal)
+
+        response = self.client.post(uri + 'apply/',
+                                    {'answers' : [[1, 2], [3, 1]]},
+                                    format='json')
+        self.assertEqual(response.data, {'count' : 2})
+        self.assertEqual(tagged(), {(1, 2), (3, 1)})
+
+        # Answers that already have the tag aren't counted again
+        response = self.client.post(uri + 'apply/',
+                                    {'q' : 'service', 'question' : 1},
+                                    format='json')
+        self.assertEqual(response.data, {'count' : 1})
+        self.assertEqual(tagged(), {(1, 1), (1, 2), (3, 1)})
+
+        response = self.client.post(uri + 'remove/',
+                                    {'responses' : [1, 2]}, format='json')
+        self.assertEqual(response.data, {'count' : 2})
+        self.assertEqual(tagged(), {(3, 1)})
+
+        # An empty selection is refused rather than tagging everything
+        response = self.client.post(uri + 'apply/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tag_merge(self):
+        """ Merging tags re-points every answer at the target tag, once, and
+        deletes the source tags
+        """
+        survey = self.users[0].surveys.create(name='foo')
+        survey.questions.create(question_text='foo?')
+        survey.publish()
+        first, second, third = [response.answers.get() for response in
+                                survey.add_responses([['a'], ['b'], ['c']])]
+        late, other, delayed, slow = [
+            survey.tag_options.create(tag_text=text)
+            for text in ['Late', 'bar', 'Delayed', 'Slow']]
+        for answer, tags in [(first, [late, slow]), (second, [delayed, late]),
+                             (third, [other])]:
+            answer.set_tags(tag.id for tag in tags)
+
+        response = self.client.post('/surveys/%s/tags/merge/' % survey.id,
+                                    {'source' : [1, 4], 'target' : 3},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'target' : 2, 'count' : 1})
+        self.assertEqual(
+            list(survey.tag_options.values_list('ordinal', 'tag_text')),
+            [(1, 'bar'), (2, 'Delayed')])
+        self.assertEqual(set(delayed.answer_set.all()), {first, second})
+        self.assertEqual(first.tags.count(), 1)
+
+        response = self.client.post('/surveys/%s/tags/merge/' % survey.id,
+                                    {'source' : [9], 'target' : 2},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_archived_survey(self):
+        """ An archived survey's responses and answers read the same as before
+        from the archive, but can no longer change
+        """
+        survey = self.users[0].surveys.first()
+        survey.tag_options.first().apply_to(survey.answers.all())
+        survey_uri = '/surveys/%s/' % survey.id
+        uris = [survey_uri + 'export.csv', survey_uri + 'responses/',
+                survey_uri + 'responses/1/', survey_uri + 'responses/2/',
+                survey_uri + 'responses/1/answers/',
+                survey_uri + 'responses/2/answers/1/']
+
+        def read(uri):
+            """ The body of a GET of the URI """
+            response = self.client.get(uri)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            if response.streaming:
+                return b''.join(response.streaming_content)
+            return response.data
+        before = [read(uri) for uri in uris]
+
+        response = self.client.post(survey_uri + 'archive/')
+        self.assertEqual(response.data, {'archived' : 2})
+        response = self.client.post(survey_uri + 'archive/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(self.client.get(survey_uri).data['archived'])
+        self.assertEqual([read(uri) for uri in uris], before)
+        self.check_query_budget(uris[1:], lambda: survey.tag_options.create(
+            tag_text='new'))
+
+        answer_uri = survey_uri + 'responses/1/answers/1/'
+        for method in [self.client.patch, self.client.delete]:
+            response = method(answer_uri, {'tag_strings' : []}, format='json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.client.get(survey_uri + 'responses/1/answers/9/').status_code,
+            status.HTTP_404_NOT_FOUND)
+        response = self.client.post(survey_uri + 'tags/1/apply/',
+                                    {'question' : 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(survey_uri + 'responses/bulk/',
+                                    [{'answers' : ['a', 'b']}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(survey_uri + 'questions/',
+                                    {'question_text' : 'foo?'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tag_answers(self):
+        """ The answers carrying a tag are listed with the ordinals of their
+        response and question, a page at a time, optionally for one question
+        """
+        survey = self.users[0].surveys.first()
+        survey.add_responses([['a', 'b'], ['c', 'd'], ['e', 'f']])
+        tag = survey.tag_options.get(ordinal=2)
+        tag.apply_to(survey.answers.filter(answer_text__in=['a', 'b', 'c', 'f']))
+        survey.tag_options.get(ordinal=1).apply_to(survey.answers.all())
+
+        answers = []
+        uri = '/surveys/%s/tags/2/answers/?page_size=3' % survey.id
+        while uri:
+            response = self.client.get(uri)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            answers += response.data['results']
+            uri = response.data['next']
+        self.assertEqual(
+            [(answer['response'], answer['question'], answer['answer_text'])
+             for answer in answers],
+            [(3, 1, 'a'), (3, 2, 'b'), (4, 1, 'c'), (5, 2, 'f')])
+
+        uri = '/surveys/%s/tags/2/answers/?question=' % survey.id
+        response = self.client.get(uri + '2')
+        self.assertEqual([answer['answer_text']
+                          for answer in response.data['results']], ['b', 'f'])
+        self.assertEqual(self.client.get(uri + 'x').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.client.get('/surveys/%s/tags/9/answers/'
+                            % survey.id).status_code,
+            status.HTTP_404_NOT_FOUND)
+
+        # The same answers can be downloaded in one streamed file
+        response = self.client.get('/surveys/%s/tags/2/answers.ndjson'
+                                   '?question=1' % survey.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [json.loads(line) for line in b''.join(
+                response.streaming_content).decode().splitlines()],
+            [{'response' : 3, 'question' : 1, 'answer_text' : 'a'},
+             {'response' : 4, 'question' : 1, 'answer_text' : 'c'}])
+
+    def test_tag_analytics(self):
+        """ The analytics count the answers to each question with each tag,
+        and the answers with each pair of tags
+        """
+        survey = self.users[0].surveys.first()
+        late, slow = survey.tag_options.all()
+        survey.add_responses([['a', 'b'], ['c', 'd']])
+        late.apply_to(survey.answers.all())
+        slow.apply_to(survey.answers.filter(question__ordinal=2))
+        response = self.client.get('/surveys/%s/analytics/tags' % survey.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'questions' : [question.question_text
+                           for question in survey.questions.all()],
+            'tags' : [{'tag_text' : late.tag_text, 'answer_count' : 6,
+                       'by_question' : [3, 3], 'co_occurrence' : [6, 3]},
+                      {'tag_text' : slow.tag_text, 'answer_count' : 3,
+                       'by_question' : [0, 3], 'co_occurrence' : [3, 3]}]})
+
+        survey.archive()
+        response = self.client.get('/surveys/%s/analytics/tags' % survey.id)
+        self.assertEqual(response.data['tags'][1]['co_occurrence'], [3, 3])
+        self.assertEqual(
+            self.client.get('/surveys/%s/analytics/tags'
+                            % self.users[1].surveys.first().id).status_code,
+            status.HTTP_403_FORBIDDEN)
+
+    def test_conditional_get(self):
+        """ Every view of a survey carries an ETag that changes whenever the
+        survey or anything under it does, and a request holding the current
+        ETag gets an empty 304
+        """
+        survey = self.users[0].surveys.first()
+        survey_uri = '/surveys/%s/' % survey.id
+        uris = ['/surveys/', survey_uri, survey_uri + 'export.csv',
+                survey_uri + 'questions/', survey_uri + 'questions/1/',
+                survey_uri + 'tags/', survey_uri + 'tags/1/',
+                survey_uri + 'responses/', survey_uri + 'responses/1/',
+                survey_uri + 'responses/1/answers/',
+                survey_uri + 'responses/1/answers/1/',
+                survey_uri + 'answers/search/?q=answer']
+
+        def etags():
+            """ The current ETag of each view, checking each revalidates """
+            current = {}
+            for uri in uris:
+                response = self.client.get(uri)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn('Last-Modified', response)
+                with self.assertNumQueries(1):
+                    cached = self.client.get(
+                        uri, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(cached.status_code,
+                                 status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(cached.content, b'')
+                current[uri] = response['ETag']
+            return current
+
+        def changed(before):
+            """ Asserts that every ETag has changed, returning the new ones """
+            after = etags()
+            for uri in uris:
+                self.assertNotEqual(before[uri], after[uri], uri)
+            return after
+
+        current = etags()
+        self.assertEqual(current, etags())
+        survey.tag_options.create(tag_text='new tag')
+        current = changed(current)
+        self.client.post(survey_uri + 'tags/1/apply/', {'question' : 1},
+                         format='json')
+        current = changed(current)
+        self.client.post(survey_uri + 'questions/',
+                         {'question_text' : 'added'}, format='json')
+        current = changed(current)
+        survey.add_responses([['answer'] * survey.questions.count()])
+        current = changed(current)
+        self.client.patch(survey_uri, {'name' : 'renamed'}, format='json')
+        current = changed(current)
+
+        # Changes to another survey leave this one's views alone
+        other = self.users[0].surveys.last()
+        other.tag_options.create(tag_text='elsewhere')
+        after = etags()
+        self.assertNotEqual(current['/surveys/'], after['/surveys/'])
+        self.assertEqual(current[survey_uri], after[survey_uri])
+
+    def test_answer_tagging(self):
+        """ PATCHing an answer's tag strings sets its tags to the survey's
+        tags matching them, folding case, spacing and dashes
+        """
+        survey = self.users[0].surveys.first()
+        survey.tag_options.create(tag_text='Late delivery')
+        survey.tag_options.create(tag_text='re-order')
+        self.users[0].surveys.last().tag_options.create(tag_text='elsewhere')
+        uri = '/surveys/%s/responses/1/answers/1/' % survey.id
+
+        def patch(*tag_strings):
+            """ Sets the answer's tags, returning the tag texts it ends with """
+            response = self.client.patch(
+                uri, {'tag_strings' : list(tag_strings)}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(response.data['tag_strings'])
+
+        self.assertEqual(patch(' late  DELIVERY ', 'RE\u2013ORDER',
+                               'elsewhere', 'unknown'),
+                         ['Late delivery', 're-order'])
+        self.assertEqual(patch('re-order'), ['re-order'])
+        self.assertEqual(patch(), [])
+
+        # Once the survey's tags are cached, tags resolve without reading
+        # the tag table, and only the through rows that change are written
+        patch('re-order')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(patch('re-order', 'late delivery'),
+                             ['Late delivery', 're-order'])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'FROM "surveys_tag"' in query['sql']
+                          and 'INNER JOIN' not in query['sql']])
+
+        # Renaming a tag is picked up straight away
+        self.client.patch('/surveys/%s/tags/%s/' % (
+            survey.id, survey.tag_options.get(tag_text='re-order').ordinal),
+                          {'tag_text' : 'Reorder'}, format='json')
+        self.assertEqual(patch('reorder'), ['Reorder'])
+
     def test_survey_view_ownership(self):
         """ When a user lists surveys, they see only their own surveys """
         # Construct a set of all the survey names the user owns, and assert
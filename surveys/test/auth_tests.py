@@ -1,9 +1,12 @@
 
 """ Tests for authentication, permissions, and security """
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 
+from ..authentication import TOKEN_USERS, USERS, cached_user
 from .test_utils import TestBase
 
 class AuthTests(TestBase):
@@ -72,3 +75,75 @@ class RegistrationTests(TestBase):
         # The user should not exist
         with self.assertRaises(User.DoesNotExist):
             User.objects.get(username='humphrey')# pylint: disable=no-member
+
+
+class CachedAuthTests(TestBase):
+    """ Tests for the caching of users and token keys """
+
+    def setUp(self):
+        super(CachedAuthTests, self).setUp()
+        USERS.clear()
+        TOKEN_USERS.clear()
+        self.client.force_authenticate() # pylint: disable=no-member
+        self.user = self.users[0]
+        self.survey_uri = '/surveys/%s/' % self.user.surveys.first().id
+
+    def get(self, **headers):
+        """ Gets the survey, returning the status and the tables read """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.survey_uri, **headers)
+        tables = {table for query in queries.captured_queries
+                  for table in ('authtoken_token', 'auth_user',
+                                'django_session')
+                  if 'FROM "%s"' % table in query['sql']}
+        return response.status_code, tables
+
+    def test_token_cache(self):
+        """ A token is only looked up on its first use, and stops working as
+        soon as it is deleted or its user is deactivated
+        """
+        header = {'HTTP_AUTHORIZATION' : 'Token %s' % self.user.auth_token.key}
+        self.assertEqual(self.get(**header), (status.HTTP_200_OK,
+                                              {'authtoken_token',
+                                               'auth_user'}))
+        self.assertEqual(self.get(**header), (status.HTTP_200_OK, set()))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(**header)[0], status.HTTP_403_FORBIDDEN)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.get(**header)[0], status.HTTP_200_OK)
+
+        self.user.auth_token.delete()
+        self.assertEqual(self.get(**header)[0], status.HTTP_403_FORBIDDEN)
+
+    def test_session_cache(self):
+        """ A session's user is only read on the first request """
+        self.user.set_password('password')
+        self.user.save()
+        self.assertTrue(self.client.login(username=self.user.username,
+                                          password='password'))
+        self.assertEqual(self.get()[0], status.HTTP_200_OK)
+        self.assertEqual(self.get(), (status.HTTP_200_OK, {'django_session'}))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get()[0], status.HTTP_403_FORBIDDEN)
+
+    def test_cached_user_copies(self):
+        """ Each lookup of a cached user gets its own copy, so permission
+        caches on one are not seen through another, and permissions granted
+        are seen at once
+        """
+        self.assertIsNotNone(cached_user(self.user.id))
+        first, second = cached_user(self.user.id), cached_user(self.user.id)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.username, self.user.username)
+        self.assertFalse(first.has_perm('surveys.add_survey'))
+
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='add_survey'))
+        self.assertTrue(second.has_perm('surveys.add_survey'))
+        self.assertTrue(cached_user(self.user.id).has_perm(
+            'surveys.add_survey'))
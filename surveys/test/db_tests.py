@@ -1,8 +1,18 @@
 
 """ Tests for the database layer """
 
+from unittest import skipUnless
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.utils.six import StringIO
+
 from .test_utils import TestBase
-from ..models import DBError
+from ..analytics import tag_analytics
+from ..models import (Answer, AnswerTag, ArchivedAnswer, ArchivedResponse,
+                      DBError, Survey)
+from ..partitions import (ANSWER_TABLES, forget_partitioning, is_partitioned,
+                          partition_name)
 
 class DBLogicTests(TestBase):
     """
@@ -33,3 +43,234 @@ class DBLogicTests(TestBase):
         self.assertRaises(DBError, survey.responses.create)
         survey.publish()
         survey.responses.create()
+
+    def test_add_responses(self):
+        """ `add_responses()` creates a response per answer set, with answers
+        in question order, and rejects unpublished surveys
+        """
+        survey = self.users[0].surveys.create()
+        for question_text in ['foo?', 'bar?']:
+            survey.questions.create(question_text=question_text)
+        self.assertRaises(DBError, survey.add_responses, [['foo', 'bar']])
+        survey.publish()
+        responses = survey.add_responses([['foo', 'bar'], ['baz', 'qux']])
+        self.assertEqual(survey.responses.count(), 2)
+        self.assertEqual([a.answer_text for a in responses[1].answers.all()],
+                         ['baz', 'qux'])
+
+    def test_ordinals(self):
+        """ Objects are numbered densely within their parent and the numbering
+        closes up when one is deleted
+        """
+        survey = self.users[0].surveys.create()
+        for question_text in ['foo?', 'bar?', 'baz?']:
+            survey.questions.create(question_text=question_text)
+        survey.publish()
+        survey.add_responses([['1', '2', '3']] * 3)
+        self.assertEqual(
+            list(survey.responses.values_list('ordinal', flat=True)),
+            [1, 2, 3])
+
+        last_response = survey.responses.get(ordinal=3)
+        survey.responses.get(ordinal=2).delete()
+        last_response.refresh_from_db()
+        self.assertEqual(last_response.ordinal, 2)
+        self.assertEqual(survey.add_responses([['1', '2', '3']])[0].ordinal, 3)
+
+        # Deleting a question removes its answers from every response
+        survey.questions.get(question_text='bar?').delete()
+        self.assertEqual(
+            list(survey.questions.values_list('ordinal', flat=True)), [1, 2])
+        for response in survey.responses.all():
+            self.assertEqual(
+                list(response.answers.values_list('ordinal', 'answer_text')),
+                [(1, '1'), (2, '3')])
+
+    def test_response_count(self):
+        """ The stored response count follows responses being added and
+        deleted, survives saving a stale survey, and can be reconciled
+        """
+        survey = self.users[0].surveys.create()
+        survey.questions.create(question_text='foo?')
+        survey.publish()
+        survey.add_responses([['foo'], ['bar']])
+        survey.responses.create()
+        survey.responses.first().delete()
+        survey.save()
+        survey.refresh_from_db()
+        self.assertEqual(survey.response_count, 2)
+
+        Survey.objects.filter(pk=survey.pk).update(response_count=99)
+        call_command('reconcile_response_counts', stdout=StringIO())
+        survey.refresh_from_db()
+        self.assertEqual(survey.response_count, 2)
+
+    def test_answer_surveys(self):
+        """ Answers and the rows tagging them carry their survey, however they
+        are written, and go with it when it is deleted
+        """
+        survey = self.users[0].surveys.first()
+        response = survey.add_responses([['foo', 'bar']])[0]
+        response.answers.create(question=survey.questions.first(),
+                                answer_text='baz')
+        tag, other = survey.tag_options.all()
+        tag.apply_to(response.answers.all())
+        response.answers.first().set_tags([tag.id, other.id])
+        self.assertEqual(
+            set(response.answers.values_list('survey_id', flat=True)),
+            {survey.id})
+        self.assertEqual(
+            set(AnswerTag.objects.filter(
+                answer__response=response).values_list('survey_id',
+                                                       flat=True)),
+            {survey.id})
+
+        survey.delete()
+        self.assertFalse(
+            AnswerTag.objects.filter(survey_id=survey.id).exists())
+        self.assertFalse(Answer.objects.filter(survey_id=survey.id).exists())
+
+    def test_archive(self):
+        """ Archiving a survey packs the answers to each response into one
+        row, deletes the answers and closes the survey to new responses
+        """
+        survey = self.users[0].surveys.first()
+        response = survey.add_responses([['foo', 'bar']])[0]
+        tag, other = survey.tag_options.all()
+        response.answers.get(ordinal=2).set_tags([tag.id, other.id])
+        question_ids = list(survey.questions.values_list('id', flat=True))
+
+        self.assertEqual(survey.archive(), 3)
+        self.assertIsNone(survey.archive())
+        self.assertFalse(Answer.objects.filter(survey=survey).exists())
+        self.assertFalse(AnswerTag.objects.filter(survey=survey).exists())
+        self.assertEqual(
+            ArchivedResponse.objects.filter(survey=survey).count(), 3)
+        other.delete()
+        self.assertEqual(
+            response.archive.answers(survey.tag_texts()),
+            [ArchivedAnswer(1, question_ids[0], 'foo', []),
+             ArchivedAnswer(2, question_ids[1], 'bar', [tag.tag_text])])
+
+        survey = Survey.objects.get(id=survey.id)
+        self.assertTrue(survey.archived)
+        self.assertFalse(Survey.snapshot(survey.id).published)
+        with self.assertRaises(DBError):
+            survey.add_responses([['foo', 'bar']], question_ids)
+        with self.assertRaises(DBError):
+            survey.responses.create()
+        self.assertEqual(survey.responses.count(), 3)
+
+    def test_tag_counts(self):
+        """ The tag counts follow every change to the tags on answers """
+        survey = self.users[0].surveys.first()
+        survey.add_responses([['a', 'b'], ['c', 'd'], ['e', 'f']])
+        late, slow = survey.tag_options.all()
+        rude = survey.tag_options.create(tag_text='Rude')
+
+        def check():
+            """ Compares the analytics with a count of the tags themselves """
+            tag_ids = list(survey.tag_options.values_list('id', flat=True))
+            question_ids = list(
+                survey.questions.values_list('id', flat=True))
+            answers = {}
+            for answer_id, tag_id in AnswerTag.objects.filter(
+                    survey=survey).values_list('answer_id', 'tag_id'):
+                answers.setdefault(answer_id, set()).add(tag_id)
+            questions = dict(Answer.objects.filter(survey=survey).values_list(
+                'id', 'question_id'))
+            expected = [
+                ([sum(1 for answer_id, tags in answers.items()
+                      if tag_id in tags and questions[answer_id] == question_id)
+                  for question_id in question_ids],
+                 [sum(1 for tags in answers.values()
+                      if tag_id in tags and other_id in tags)
+                  for other_id in tag_ids])
+                for tag_id in tag_ids]
+            self.assertEqual(
+                [(tag['by_question'], tag['co_occurrence'])
+                 for tag in tag_analytics(survey)['tags']], expected)
+
+        late.apply_to(survey.answers.all())
+        slow.apply_to(survey.answers.filter(question__ordinal=1))
+        self.assertEqual(slow.apply_to(survey.answers.all()), 4)
+        check()
+        late.remove_from(survey.answers.filter(response__ordinal__gt=3))
+        rude.apply_to(survey.answers.filter(response__ordinal=3))
+        check()
+        answer = survey.answers.get(response__ordinal=3, ordinal=1)
+        answer.set_tags([slow.id, rude.id])
+        check()
+        self.assertEqual(tag_analytics(survey)['tags'][2], {
+            'tag_text' : 'Rude', 'answer_count' : 2,
+            'by_question' : [1, 1], 'co_occurrence' : [1, 2, 2]})
+        rude.merge([late])
+        check()
+        answer.refresh_from_db()
+        answer.delete()
+        survey.responses.get(ordinal=2).delete()
+        survey.questions.first().delete()
+        check()
+        survey.tag_options.first().delete()
+        check()
+
+    def test_partitioning_needs_postgresql(self):
+        """ The answer tables are only partitioned on PostgreSQL """
+        if connection.vendor == 'postgresql':
+            return
+        self.assertFalse(is_partitioned(connection))
+        with self.assertRaises(CommandError):
+            call_command('partition_answers', stdout=StringIO())
+
+    @skipUnless(connection.vendor == 'postgresql'
+                and getattr(connection, 'pg_version', 0) >= 110000,
+                'Partitioning needs PostgreSQL 11 or later')
+    def test_partitioning(self):
+        """ Partitioning moves the answers of each survey into partitions of
+        their own, which surveys create, empty and drop as they go
+        """
+        def partitions(survey_id):
+            """ The names of the survey's partitions that exist """
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT relname FROM pg_class WHERE relname '
+                               'IN (%s, %s)', [partition_name(table, survey_id)
+                                               for table in ANSWER_TABLES])
+                return sorted(row[0] for row in cursor.fetchall())
+
+        # The partitioning is rolled back with the test's transaction
+        self.addCleanup(forget_partitioning)
+        survey = self.users[0].surveys.first()
+        answer_count = survey.answers.count()
+        call_command('partition_answers', stdout=StringIO())
+        self.assertTrue(is_partitioned(connection))
+        self.assertEqual(partitions(survey.id),
+                         sorted(partition_name(table, survey.id)
+                                for table in ANSWER_TABLES))
+        self.assertEqual(survey.answers.count(), answer_count)
+
+        new = self.users[0].surveys.create(name='partitioned')
+        self.assertEqual(len(partitions(new.id)), 2)
+        new.questions.create(question_text='foo?')
+        new.publish()
+        tag = new.tag_options.create(tag_text='foo')
+        new.add_responses([['a'], ['b']])
+        self.assertEqual(tag.apply_to(new.answers.all()), 2)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM %s'
+                           % partition_name('surveys_answer', new.id))
+            self.assertEqual(cursor.fetchone()[0], 2)
+        new.responses.first().delete()
+        self.assertEqual(new.answers.count(), 1)
+        self.assertEqual(tag.remove_from(new.answers.all()), 1)
+
+        new.archive()
+        self.assertFalse(new.answers.exists())
+        self.assertEqual(len(partitions(new.id)), 2)
+        new.delete()
+        self.assertEqual(partitions(new.id), [])
+
+        # Deleting the owner deletes their surveys by cascade
+        survey_ids = list(self.users[0].surveys.values_list('id', flat=True))
+        self.users[0].delete()
+        for survey_id in survey_ids:
+            self.assertEqual(partitions(survey_id), [])
@@ -0,0 +1,126 @@
+""" Tests for the async ingest mode of response submission """
+
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from ..cache import SNAPSHOTS
+from ..management.commands.ingest_worker import ingest_batch
+from ..models import IngestCursor, Survey
+from ..spool import get_spool
+from .test_utils import TestBase
+
+
+class IngestTests(TestBase):
+    """ Submissions are spooled without touching the database and written to
+    it exactly once by the ingest worker
+    """
+
+    def setUp(self):
+        super(IngestTests, self).setUp()
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        settings = override_settings(
+            SURVEYS_INGEST_SPOOL=os.path.join(spool_dir, 'spool.sqlite3'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_authenticate() # pylint: disable=no-member
+        self.survey = self.users[0].surveys.first()
+
+    def submit(self, *answers):
+        """ Submits a response through the respond page's form """
+        return self.client.post('/submit/%s/' % self.survey.id,
+                                dict(enumerate(answers)))
+
+    def ingest(self):
+        """ Runs the worker until the spool is empty """
+        call_command('ingest_worker', once=True, stdout=StringIO())
+
+    def test_spooled_submission(self):
+        """ A submission is spooled without any queries, and written by the
+        worker
+        """
+        self.client.get('/respond/%s/' % self.survey.id)
+        with self.assertNumQueries(0):
+            reply = self.submit('answer 1', 'answer 2')
+        self.assertEqual(reply.status_code, 302)
+        self.assertEqual(self.survey.responses.count(), 2)
+        self.assertEqual(get_spool().backlog()[0], 1)
+
+        self.ingest()
+        self.survey.refresh_from_db()
+        self.assertEqual(self.survey.response_count, 3)
+        self.assertEqual(
+            [answer.answer_text
+             for answer in self.survey.responses.last().answers.all()],
+            ['answer 1', 'answer 2'])
+        self.assertEqual(get_spool().backlog()[0], 0)
+
+    def test_invalid_submission(self):
+        """ Submissions that don't match the survey are refused up front """
+        self.assertEqual(self.submit('only one answer').status_code, 400)
+        draft = self.users[0].surveys.create(name='draft')
+        reply = self.client.post('/submit/%s/' % draft.id, {})
+        self.assertEqual(reply.status_code, 400)
+        self.assertEqual(get_spool().backlog()[0], 0)
+
+    def test_exactly_once(self):
+        """ Entries left in the spool by a worker that stopped after
+        committing a batch aren't written again
+        """
+        for i in range(5):
+            self.submit('answer %s' % i, 'answer')
+        spool = get_spool()
+        clear_through = spool.clear_through
+        spool.clear_through = lambda entry_id: None
+        try:
+            self.assertEqual(ingest_batch(spool, 3), (3, 0))
+        finally:
+            spool.clear_through = clear_through
+        self.assertEqual(spool.backlog()[0], 5)
+
+        self.ingest()
+        self.assertEqual(spool.backlog()[0], 0)
+        self.assertEqual(self.survey.responses.count(), 7)
+        self.assertEqual(IngestCursor.objects.get(spool=spool.id).last_entry,
+                         5)
+        self.ingest()
+        self.assertEqual(self.survey.responses.count(), 7)
+
+    def test_rejected_entries(self):
+        """ Entries for surveys that changed after they were spooled are
+        dropped without holding up the rest
+        """
+        self.submit('answer 1', 'answer 2')
+        other = self.users[0].surveys.last()
+        self.client.post('/submit/%s/' % other.id, {0 : 'a', 1 : 'b'})
+        other.delete()
+        self.assertEqual(ingest_batch(get_spool(), 10), (1, 1))
+        self.assertEqual(get_spool().backlog()[0], 0)
+
+    def test_archived_entries(self):
+        """ Entries for a survey archived after they were spooled are
+        rejected, even while the worker's snapshot still takes responses
+        """
+        self.submit('answer 1', 'answer 2')
+        snapshot = Survey.snapshot(self.survey.id)
+        self.survey.archive()
+        SNAPSHOTS.get(self.survey.id, lambda survey_id: snapshot)
+        self.assertEqual(ingest_batch(get_spool(), 10), (0, 1))
+        self.assertEqual(get_spool().backlog()[0], 0)
+        self.assertEqual(self.survey.responses.count(), 2)
+
+    def test_backlog_metrics(self):
+        """ The spool's backlog is served with the other metrics """
+        self.submit('answer 1', 'answer 2')
+        user = self.users[0]
+        user.is_staff = True
+        user.save()
+        self.client.force_authenticate(user=user)
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('pushkin_ingest_backlog_entries 1\n', body)
+        self.assertIn('pushkin_ingest_backlog_age_seconds ', body)
@@ -0,0 +1,94 @@
+""" Tests for the queued log file handler and the slow query filter """
+
+import logging
+import os
+import shutil
+import tempfile
+
+from django.db import connection
+from django.test import TestCase
+
+from pushkin import logs, metrics
+
+
+class LoggingTests(TestCase):
+    """ Records are written off the logging thread, and SQL statements are
+    logged by how long they took
+    """
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir)
+
+    def make_handler(self, **kwargs):
+        """ A queued handler writing to a file in the temporary directory """
+        handler = logs.QueuedRotatingFileHandler(
+            os.path.join(self.log_dir, 'test.log'), **kwargs)
+        self.addCleanup(handler.close)
+        return handler
+
+    def read_log(self):
+        """ The lines of the log file """
+        with open(os.path.join(self.log_dir, 'test.log')) as log_file:
+            return log_file.read().splitlines()
+
+    def test_queued_handler(self):
+        """ Records are written in order once the queue is drained """
+        logger = logging.getLogger('pushkin.test.queued')
+        handler = self.make_handler()
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        for i in range(100):
+            logger.warning('record %s', i)
+        handler.close()
+        self.assertEqual(self.read_log(),
+                         ['WARNING record %s' % i for i in range(100)])
+
+    def test_rotation(self):
+        """ The log file is rotated when it reaches its maximum size """
+        logger = logging.getLogger('pushkin.test.rotated')
+        handler = self.make_handler(maxBytes=1000, backupCount=2)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        for i in range(200):
+            logger.warning('record %s', i)
+        handler.close()
+        self.assertEqual(sorted(os.listdir(self.log_dir)),
+                         ['test.log', 'test.log.1', 'test.log.2'])
+        self.assertLessEqual(os.path.getsize(
+            os.path.join(self.log_dir, 'test.log')), 1000)
+
+    def test_slow_query_filter(self):
+        """ Slow statements pass, quick ones are sampled, and anything else
+        is left alone
+        """
+        def record(**extra):
+            """ A log record with the given extra attributes """
+            return logging.makeLogRecord(extra)
+
+        slow_only = logs.SlowQueryFilter(threshold=0.1, sample_rate=0)
+        self.assertTrue(slow_only.filter(record(duration=0.2)))
+        self.assertFalse(slow_only.filter(record(duration=0.01)))
+        self.assertTrue(slow_only.filter(record(msg='not a query')))
+        everything = logs.SlowQueryFilter(threshold=0.1, sample_rate=1)
+        self.assertTrue(everything.filter(record(duration=0.01)))
+
+    def test_timed_cursor_logs(self):
+        """ Statements run through the timed cursor are logged with their
+        duration when DEBUG is off
+        """
+        metrics.instrument(connection)
+        logger = logging.getLogger('django.db.backends')
+        handler = self.make_handler()
+        handler.setFormatter(logging.Formatter('%(duration).3f %(sql)s'))
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        level = logger.level
+        logger.setLevel(logging.DEBUG)
+        self.addCleanup(logger.setLevel, level)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        handler.close()
+        self.assertTrue(self.read_log()[-1].endswith(' SELECT 1'))
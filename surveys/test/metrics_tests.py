@@ -0,0 +1,61 @@
+""" Tests for the request metrics middleware and the /metrics endpoint """
+
+import re
+
+from rest_framework import status
+
+from pushkin import metrics
+
+from .test_utils import TestBase
+
+
+class MetricsTests(TestBase):
+    """ Request timings are reported per response and aggregated per view """
+
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        for histogram in metrics.HISTOGRAMS:
+            histogram.reset()
+
+    def test_server_timing(self):
+        """ Every response reports its total and SQL time and query count """
+        survey = self.users[0].surveys.first()
+        response = self.client.get('/surveys/%s/questions/' % survey.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        match = re.match(r'total;dur=[\d.]+, sql;dur=[\d.]+;desc="(\d+) '
+                         r'queries"$', response['Server-Timing'])
+        self.assertIsNotNone(match)
+        self.assertGreater(int(match.group(1)), 0)
+
+    def test_metrics_staff_only(self):
+        """ Only staff users can read the metrics """
+        self.assertEqual(self.client.get('/metrics').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_exposition(self):
+        """ The histograms are served in the Prometheus text format, with a
+        series per view
+        """
+        survey = self.users[0].surveys.first()
+        for _ in range(3):
+            self.client.get('/surveys/%s/tags/' % survey.id)
+        user = self.users[0]
+        user.is_staff = True
+        user.save()
+        self.client.force_authenticate(user=user)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE pushkin_request_duration_seconds histogram',
+                      body)
+        self.assertIn('pushkin_request_duration_seconds_count{view="TagList"}'
+                      ' 3', body)
+        self.assertIn('pushkin_request_queries_bucket{view="TagList",'
+                      'le="+Inf"} 3', body)
+        self.assertIn('pushkin_request_sql_duration_seconds_sum'
+                      '{view="TagList"}', body)
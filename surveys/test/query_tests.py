@@ -0,0 +1,120 @@
+""" Tests for the number of database queries each view makes """
+
+import json
+
+from django.core.management import call_command
+from django.core.urlresolvers import resolve
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+
+from .test_utils import TestBase
+
+
+class QueryBudgetTests(TestBase):
+    """ Every view must keep to the query budget it declares, and the number
+    of queries it makes must not grow with the amount of data in the survey
+    """
+
+    def setUp(self):
+        super(QueryBudgetTests, self).setUp()
+        self.survey = self.users[0].surveys.first()
+
+    def add_data(self):
+        """ Grows every survey of the authenticated user with more questions,
+        tags, responses, and tagged answers
+        """
+        for survey in self.users[0].surveys.all():
+            for i in range(3):
+                survey.questions.create(question_text='more_question_%s' % i)
+                survey.tag_options.create(tag_text='more_tag_%s' % i)
+            questions = list(survey.questions.all())
+            responses = survey.add_responses(
+                [['more_answer'] * len(questions)] * 3)
+            first_response = survey.responses.first()
+            for question in questions:
+                first_response.answers.create(question=question,
+                                              answer_text='more_answer')
+            for tag in survey.tag_options.all():
+                tag.apply_to(first_response.answers.all())
+                tag.apply_to(responses[0].answers.all())
+
+    def test_list_views(self):
+        """ The list views make a constant number of queries """
+        survey_uri = '/surveys/%s/' % self.survey.id
+        self.check_query_budget(
+            ['/surveys/',
+             survey_uri + 'questions/',
+             survey_uri + 'tags/',
+             survey_uri + 'responses/',
+             survey_uri + 'responses/1/answers/',
+             survey_uri + 'answers/search/?q=answer',
+             survey_uri + 'analytics/tags',
+             survey_uri + 'tags/1/answers/',
+             survey_uri + 'tags/1/answers.ndjson',
+             survey_uri + 'export.csv'],
+            self.add_data)
+
+    def test_detail_views(self):
+        """ The detail views make a constant number of queries """
+        survey_uri = '/surveys/%s/' % self.survey.id
+        self.check_query_budget(
+            [survey_uri,
+             survey_uri + 'questions/1/',
+             survey_uri + 'tags/1/',
+             survey_uri + 'responses/1/',
+             survey_uri + 'responses/1/answers/1/'],
+            self.add_data)
+
+    def test_write_views(self):
+        """ Posting a batch of responses and tagging a selection of answers
+        make a constant number of queries
+        """
+        survey_uri = '/surveys/%s/' % self.survey.id
+        self.check_query_budget(
+            [survey_uri + 'responses/bulk/'], lambda: None,
+            self.client.post,
+            [{'answers' : ['foo', 'bar']}] * 20)
+        self.check_query_budget(
+            [survey_uri + 'tags/1/apply/', survey_uri + 'tags/1/remove/'],
+            self.add_data, self.client.post, {'q' : 'answer'})
+
+    def test_archive_view(self):
+        """ Archiving a survey keeps to the budget of its view """
+        uri = '/surveys/%s/archive/' % self.survey.id
+        self.assertLessEqual(
+            self._count_queries(uri, self.client.post),
+            resolve(uri).func.cls.query_budget)
+
+    def test_survey_read_once(self):
+        """ A request reads its survey, and the survey's owner, once however
+        many lookups of the view need it
+        """
+        survey_uri = '/surveys/%s/' % self.survey.id
+        for uri in [survey_uri,
+                    survey_uri + 'responses/1/answers/1/',
+                    survey_uri + 'tags/1/',
+                    survey_uri + 'export.csv']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(uri)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200)
+            survey_queries = [query['sql'] for query in queries
+                              if 'FROM "surveys_survey"' in query['sql']]
+            self.assertEqual(len(survey_queries), 1, uri)
+            self.assertIn('"auth_user"', survey_queries[0])
+
+    def test_bench_command(self):
+        """ The bench command generates a survey, runs every scenario against
+        it without a server error, and cleans up after itself
+        """
+        output = StringIO()
+        call_command('bench', responses=20, questions=3, tags=4, requests=2,
+                     stdout=output, stderr=StringIO())
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['dataset']['responses'], 20)
+        for name, scenario in report['scenarios'].items():
+            self.assertLess(scenario['status'], 400, name)
+            self.assertLessEqual(scenario['p50_ms'], scenario['p99_ms'])
+        self.assertFalse(self.users.filter(username='pushkin_bench').exists())
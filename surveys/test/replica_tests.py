@@ -0,0 +1,92 @@
+""" Tests for routing reads to the read replica and checking connections """
+
+import time
+from unittest import mock
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework import status
+
+from pushkin.db import PIN_COOKIE
+from .test_utils import TestBase
+
+
+@override_settings(SURVEYS_READ_REPLICA='replica')
+class ReplicaTests(TestBase):
+    """ Safe GETs of the views marked `read_replica` read from the replica,
+    which in the tests is a second, empty database
+    """
+    multi_db = True
+
+    def get(self, uri):
+        """ GETs a URI, returning the response and the number of queries made
+        on the replica
+        """
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get(uri)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response, len(queries)
+
+    def test_replica_reads(self):
+        """ Only the marked views read from the replica """
+        survey = self.users[0].surveys.first()
+        response, replica_queries = self.get('/surveys/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [])
+        self.assertTrue(replica_queries)
+
+        # The survey isn't on the replica, so it can't be found there
+        for uri in ['/surveys/%s/responses/', '/surveys/%s/export.csv']:
+            response, replica_queries = self.get(uri % survey.id)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            self.assertTrue(replica_queries)
+
+        for uri in ['/surveys/%s/', '/surveys/%s/questions/']:
+            response, replica_queries = self.get(uri % survey.id)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(replica_queries)
+
+        with override_settings(SURVEYS_READ_REPLICA=None):
+            response, replica_queries = self.get('/surveys/')
+        self.assertEqual(len(response.data), 2)
+        self.assertFalse(replica_queries)
+
+    def test_read_your_writes(self):
+        """ A client that writes reads from the primary for a while after """
+        response = self.client.post('/surveys/', {'name' : 'new'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        response, replica_queries = self.get('/surveys/')
+        self.assertEqual(len(response.data), 3)
+        self.assertFalse(replica_queries)
+
+        del self.client.cookies[PIN_COOKIE]
+        response, replica_queries = self.get('/surveys/')
+        self.assertEqual(response.data, [])
+        self.assertTrue(replica_queries)
+
+
+class ConnectionCheckTests(TestBase):
+    """ Tests for checking reused connections at the start of a request. The
+    replica's connection is used, as the tests hold the default one in a
+    transaction, where it is never checked.
+    """
+
+    def test_idle_connections_checked(self):
+        """ Only a connection that has sat idle is checked before reuse """
+        connection = connections['replica']
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'is_usable',
+                               return_value=True) as is_usable:
+            self.client.get('/surveys/')
+            is_usable.reset_mock()
+            self.client.get('/surveys/')
+            self.assertEqual(is_usable.call_count, 0)
+
+            with mock.patch('pushkin.db.time.monotonic',
+                            return_value=time.monotonic() + 3600):
+                self.client.get('/surveys/')
+            self.assertEqual(is_usable.call_count, 1)
@@ -1,6 +1,10 @@
 
 """ Tests the UI/submitting of survey responses """
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ..cache import LRUCache, SNAPSHOTS
 from .test_utils import TestBase
 
 class ResponseTests(TestBase):
@@ -35,3 +39,108 @@ class ResponseTests(TestBase):
                          {i : a.answer_text
                           for i, a in
                              enumerate(survey.responses.first().answers.all())})
+
+    def test_respondent_queries(self):
+        """ Once a published survey has been read, the respond page makes no
+        queries and submitting a response doesn't read the survey or its
+        questions
+        """
+        self.client.force_authenticate() # pylint: disable=no-member
+        survey = self.users[0].surveys.first()
+        self.client.get('/respond/%s/' % survey.id)
+        with self.assertNumQueries(0):
+            page = self.client.get('/respond/%s/' % survey.id)
+        self.assertContains(page, survey.questions.first().question_text)
+
+        with CaptureQueriesContext(connection) as queries:
+            reply = self.client.post('/submit/%s/' % survey.id,
+                                     {0 : 'answer 1', 1 : 'answer 2'})
+        self.assertEqual(reply.status_code, 302)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'surveys_question' in query['sql']
+                          or 'surveys_survey"."name' in query['sql']])
+        survey.refresh_from_db()
+        self.assertEqual(survey.responses.count(), 3)
+        self.assertEqual(survey.response_count, 3)
+
+    def test_snapshot_invalidation(self):
+        """ Changes to a survey, its questions or its owner's name show on the
+        respond page straight away
+        """
+        self.client.force_authenticate() # pylint: disable=no-member
+        survey = self.users[0].surveys.first()
+        uri = '/respond/%s/' % survey.id
+        self.client.get(uri)
+
+        survey.name = 'renamed survey'
+        survey.save()
+        self.assertContains(self.client.get(uri), 'renamed survey')
+        question = survey.questions.create(question_text='added question')
+        self.assertContains(self.client.get(uri), 'added question')
+        question.delete()
+        self.assertNotContains(self.client.get(uri), 'added question')
+        owner = survey.owner
+        owner.username = 'renamed_user'
+        owner.save()
+        self.assertContains(self.client.get(uri), 'renamed_user')
+        survey.delete()
+        self.assertEqual(self.client.get(uri).status_code, 404)
+        self.assertEqual(self.client.post('/submit/%s/' % survey.id,
+                                          {0 : 'answer'}).status_code, 404)
+
+    def test_unpublished_not_cached(self):
+        """ Unpublished surveys are read afresh and can't be responded to """
+        self.client.force_authenticate() # pylint: disable=no-member
+        survey = self.users[0].surveys.create(name='draft')
+        survey.questions.create(question_text='question')
+        self.client.get('/respond/%s/' % survey.id)
+        self.assertNotIn(survey.id, SNAPSHOTS.local._entries) # pylint: disable=protected-access
+        reply = self.client.post('/submit/%s/' % survey.id, {0 : 'answer'})
+        self.assertEqual(reply.status_code, 400)
+        self.assertEqual(survey.responses.count(), 0)
+
+    def test_lru_cache(self):
+        """ The least recently used entries are evicted first, and entries
+        expire after their TTL
+        """
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')),
+                         (1, None, 3))
+        expiring = LRUCache(2, ttl=0)
+        expiring.set('a', 1)
+        self.assertIsNone(expiring.get('a'))
+
+    def test_respond_page_caching(self):
+        """ The cached respond page carries the respondent's CSRF token, and
+        revalidating it with its ETag gives a 304 without any queries
+        """
+        self.client.force_authenticate() # pylint: disable=no-member
+        survey = self.users[0].surveys.first()
+        uri = '/respond/%s/' % survey.id
+        page = self.client.get(uri)
+        token = page.cookies['csrftoken'].value
+        self.assertContains(page, "value='%s'" % token)
+        self.assertEqual(page['Cache-Control'], 'no-cache')
+
+        with self.assertNumQueries(0):
+            revalidated = self.client.get(uri, HTTP_IF_NONE_MATCH=page['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], page['ETag'])
+
+        # Another respondent gets their own token and ETag
+        self.client.cookies.clear()
+        other = self.client.get(uri, HTTP_IF_NONE_MATCH=page['ETag'])
+        self.assertEqual(other.status_code, 200)
+        self.assertNotEqual(other['ETag'], page['ETag'])
+        self.assertContains(other, "value='%s'"
+                            % other.cookies['csrftoken'].value)
+
+        # Changing the survey changes the page and its ETag
+        survey.questions.create(question_text='added question')
+        changed = self.client.get(uri, HTTP_IF_NONE_MATCH=other['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'added question')
@@ -2,9 +2,14 @@
 """ Utilities to help with testing this app """
 
 from django.contrib.auth.models import User
-
+from django.core.urlresolvers import resolve
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.six.moves.urllib.parse import urlparse
 from rest_framework.test import APITestCase
 
+from ..cache import SNAPSHOTS, TAG_IDS
+
 class TestBase(APITestCase):
     """ A base class that provides functionality of the `APITestCase` class
     as well as a few other utils specific to Pushkin
@@ -22,6 +27,10 @@ class TestBase(APITestCase):
         authenticated.
         """
 
+        # Cached surveys may share ids with those of earlier tests
+        SNAPSHOTS.clear()
+        TAG_IDS.clear()
+
         # Create a couple of users
         for i in range(2):
             # pylint: disable=no-member
@@ -55,8 +64,6 @@ class TestBase(APITestCase):
         self.requests = [self.client.get, self.client.post, self.client.put,
                          self.client.patch, self.client.delete]
 
-        from surveys.models import Survey
-
     def tearDown(self):
         """ Delete the database created for these tests """
         self.users.delete()
@@ -86,6 +93,39 @@ class TestBase(APITestCase):
                          "Did not expect %s for request '%s %s'"
                          % (response_code, method.__name__, uri))
 
+    def check_query_budget(self, uris, add_data, method=None, body=None):
+        """
+        Assert that a request on each URI makes no more queries than the
+        `query_budget` declared by its view, and that the number of queries
+        for each is unchanged after `add_data()` grows the database. Requests
+        are GETs unless another client method and a JSON body are given.
+        """
+        before = {uri : self._count_queries(uri, method, body) for uri in uris}
+        add_data()
+        for uri in uris:
+            budget = resolve(urlparse(uri).path).func.cls.query_budget
+            after = self._count_queries(uri, method, body)
+            self.assertLessEqual(
+                before[uri], budget,
+                "Expected at most %s queries for '%s', got %s"
+                % (budget, uri, before[uri]))
+            self.assertEqual(
+                before[uri], after,
+                "Queries for '%s' grew from %s to %s with more data"
+                % (uri, before[uri], after))
+
+    def _count_queries(self, uri, method=None, body=None):
+        """ The number of queries made by a successful request on a URI """
+        method = method or self.client.get
+        with CaptureQueriesContext(connection) as queries:
+            response = method(uri, body, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 300,
+                        "Request '%s %s' failed with %s"
+                        % (method.__name__, uri, response.status_code))
+        return len(queries)
+
 
 def _all_user_uris(user):
     """
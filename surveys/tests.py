@@ -4,8 +4,13 @@
 # Import any test suites to run here
 # pylint: disable=unused-import
 from .test.response_tests import ResponseTests
-from .test.auth_tests import AuthTests, RegistrationTests
+from .test.auth_tests import AuthTests, CachedAuthTests, RegistrationTests
 from .test.api_tests import APITests
 from .test.db_tests import DBLogicTests
+from .test.query_tests import QueryBudgetTests
+from .test.metrics_tests import MetricsTests
+from .test.log_tests import LoggingTests
+from .test.ingest_tests import IngestTests
+from .test.replica_tests import ReplicaTests
 from .test.ui_respondent import UIRespondentTests
 
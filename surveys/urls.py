@@ -13,20 +13,38 @@ urlpatterns = [
     url(r'^$', RedirectView.as_view(url='/surveys/', permanent=True)),
     url(r'^surveys/$', views.SurveyList.as_view()),
     url(r'^surveys/(?P<sid>[0-9]+)/$', views.SurveyDetail.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/export\.(?P<export_format>csv|ndjson)$',
+        views.SurveyExport.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/archive/$', views.SurveyArchive.as_view()),
     url(r'^surveys/(?P<sid>[0-9]+)/questions/$', views.QuestionList.as_view()),
     url(r'^surveys/(?P<sid>[0-9]+)/questions/(?P<qid>[0-9]+)/$',
         views.QuestionDetail.as_view()),
     url(r'^surveys/(?P<sid>[0-9]+)/responses/$',
         views.ResponseList.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/responses/bulk/$',
+        views.ResponseBulkCreate.as_view()),
     url(r'^surveys/(?P<sid>[0-9]+)/responses/(?P<rid>[0-9]+)/$',
         views.ResponseDetail.as_view()),
     url(r'^surveys/(?P<sid>[0-9]+)/responses/(?P<rid>[0-9]+)/answers/$',
         views.AnswerList.as_view()),
     url((r'^surveys/(?P<sid>[0-9]+)/responses/(?P<rid>[0-9]+)/answers/'
          r'(?P<aid>[0-9]+)/$'), views.AnswerDetail.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/answers/search/$',
+        views.AnswerSearch.as_view()),
     url(r'^surveys/(?P<sid>[0-9]+)/tags/$', views.TagList.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/analytics/tags/?$',
+        views.TagAnalytics.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/tags/merge/$', views.TagMerge.as_view()),
     url(r'^surveys/(?P<sid>[0-9]+)/tags/(?P<tid>[0-9]+)/$',
         views.TagDetail.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/tags/(?P<tid>[0-9]+)/answers\.ndjson$',
+        views.TagAnswerExport.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/tags/(?P<tid>[0-9]+)/answers/$',
+        views.TagAnswerList.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/tags/(?P<tid>[0-9]+)/apply/$',
+        views.TagApply.as_view()),
+    url(r'^surveys/(?P<sid>[0-9]+)/tags/(?P<tid>[0-9]+)/remove/$',
+        views.TagRemove.as_view()),
     url(r'^register/', views.Register.as_view(), name='register'),
     url(r'^api-auth/', include('rest_framework.urls',
                                namespace='rest_framework')),
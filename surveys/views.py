@@ -1,38 +1,143 @@
 
 """ The various views for the survey URLs """
 
+import calendar
+import hashlib
+import uuid
+
+from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.forms import UserCreationForm
 from django.core import exceptions
-from django.http import Http404, HttpResponseRedirect
-from django.shortcuts import get_object_or_404, render
+from django.db import IntegrityError
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseNotModified, HttpResponseRedirect,
+                         StreamingHttpResponse)
+from django.middleware.csrf import get_token
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.http import http_date, parse_etags, quote_etag
 from django.views.generic import FormView
 from rest_framework import generics
 from rest_framework import permissions
-
-from .models import Survey, Tag
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response as APIResponse
+
+from .analytics import tag_analytics
+from .cache import SNAPSHOTS, LRUCache
+from .export import EXPORT_FORMATS, stream_tag_answers, survey_export
+from .models import Answer, DBError, Survey, Tag
+from .pagination import (AnswerCursorPagination, OrdinalCursorPagination,
+                         OrdinalList, RankedPagination)
+from .search import search_answers
+from .spool import get_spool
 from .serializers import (SurveySerializer, ResponseSerializer,
-                          QuestionSerializer, AnswerSerializer, TagSerializer)
+                          ArchivedResponseSerializer,
+                          ResponseSubmissionSerializer, QuestionSerializer,
+                          AnswerSerializer, AnswerSearchSerializer,
+                          AnswerSelectionSerializer, TaggedAnswerSerializer,
+                          TagSerializer,
+                          TagMergeSerializer)
 
 
 ################################################################################
 # UI/response submission handlers
 #
 
+CSRF_PLACEHOLDER = uuid.uuid4().hex
+"""
+Stands in for the CSRF token in cached renderings of the respond page
+"""
+
+RESPOND_PAGES = LRUCache(settings.SURVEYS_SNAPSHOT_CACHE_SIZE)
+"""
+The respond page of each recently used published survey, keyed by survey id,
+as a `(snapshot, page_parts, digest)` triple: the snapshot it was rendered
+from, the page split around the CSRF token and a digest of the page
+"""
+
+def etag_matches(request, etag):
+    """ Tells whether the request's If-None-Match header matches `etag` """
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    return etag.strip('"') in if_none_match or '*' in if_none_match
+
+def respond_page(snapshot):
+    """ Returns the `(page_parts, digest)` of the respond page for a survey
+    snapshot, rendering it only if the snapshot has changed since the page was
+    cached
+    """
+    cached = RESPOND_PAGES.get(snapshot.id)
+    if cached is None or cached[0] != snapshot:
+        page = render_to_string('surveys/respond.html',
+                                {'survey':snapshot,
+                                 'csrf_token':CSRF_PLACEHOLDER})
+        cached = (snapshot, page.split(CSRF_PLACEHOLDER),
+                  hashlib.sha1(page.encode()).hexdigest())
+        if snapshot.published:
+            RESPOND_PAGES.set(snapshot.id, cached)
+    return cached[1:]
+
 def respond(request, sid):
-    """ Renders the landing page for a user taking a survey """
-    survey = get_object_or_404(Survey, id=sid)
-    return render(request, 'surveys/respond.html', {'survey':survey})
+    """ Renders the landing page for a user taking a survey.
+
+    The page is rendered once per version of the survey and the respondent's
+    CSRF token is spliced in. Its ETag covers both, so a respondent (or a
+    proxy keyed on their cookie) revalidating an unchanged page gets a 304.
+    """
+    try:
+        survey = Survey.snapshot(sid)
+    except Survey.DoesNotExist:
+        raise Http404
+    page_parts, digest = respond_page(survey)
+    token = get_token(request)
+    etag = quote_etag(hashlib.sha1(
+        (digest + token).encode()).hexdigest())
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(token.join(page_parts))
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
 
 def submit(request, sid):
-    """ Processes the response to the survey as rendered by `respond()` """
-    response_values = request.POST
-    survey = get_object_or_404(Survey, id=sid)
-    response = survey.responses.create()
-    for question_ix, question in enumerate(survey.questions.all()):
-        response.answers.create(
-            question=question,
-            answer_text=response_values[str(question_ix)])
+    """ Processes the response to the survey as rendered by `respond()`.
+
+    The survey's published state and questions come from its snapshot, so
+    the only queries made are those that write the response. In the async
+    ingest mode (see `spool.py`) the response is appended to the spool instead
+    and no queries are made at all.
+    """
+    # The form names each answer input after its zero-based question index
+    response_values = sorted((int(key), value)
+                             for key, value in request.POST.items()
+                             if key.isdigit())
+    answers = [value for _, value in response_values]
+    try:
+        snapshot = Survey.snapshot(sid)
+    except Survey.DoesNotExist:
+        raise Http404
+
+    spool = get_spool()
+    if spool is not None:
+        try:
+            Survey.check_answer_sets(snapshot.published,
+                                     len(snapshot.questions), [answers])
+        except DBError as error:
+            return HttpResponseBadRequest(str(error))
+        spool.append(snapshot.id, answers)
+        return HttpResponseRedirect('/thankyou/')
+
+    survey = Survey(id=snapshot.id, published=snapshot.published)
+    try:
+        survey.add_responses(
+            [answers], [question_id for question_id, _ in snapshot.questions])
+    except (DBError, IntegrityError) as error:
+        # The snapshot may be out of date, e.g. if a question was deleted
+        # from the survey by another process within its TTL
+        SNAPSHOTS.invalidate(snapshot.id)
+        return HttpResponseBadRequest(str(error))
 
     return HttpResponseRedirect('/thankyou/')
 
@@ -67,143 +172,422 @@ def survey_context(func):
     not found
 
     Example:- if only 3 responses exist under a survey, then accessing
-              /survey/<id>/responses/4 will result in an indexerror as
-              ResponseDetail.get_object() will assume survey.responses.all()[3]
-              to exist.
+              /survey/<id>/responses/4 will result in a DoesNotExist as
+              ResponseDetail.get_object() will look for a response with
+              ordinal 4 under the survey.
     """
 
     def query_wrapper(view):
         """ The wrapped query to return """
+        survey = request_survey(view.request, view.kwargs['sid'])
+        if survey is None:
+            raise exceptions.PermissionDenied
         try:
-            survey = Survey.objects.get(id=view.kwargs['sid'], owner=view.request.user)
             return func(view, survey)
-        except Survey.DoesNotExist:
-            raise exceptions.PermissionDenied
-        except IndexError:
+        except exceptions.ObjectDoesNotExist:
             raise Http404
 
     return query_wrapper
 
 
-def uri2ix(view, key):
-    """ Maps an ordinal number string from a URI to an actual index
+def request_survey(request, sid):
+    """ Returns the survey with id `sid` if the request's user owns it, and
+    None otherwise.
+
+    The surveys looked up are kept in an identity map on the request, so
+    however many times a view calls `get_object()` or `get_queryset()` the
+    survey is read once per request, along with its owner, and every lookup
+    shares the same instance.
+    """
+    # Keep the map on the Django request, which DRF's request wraps
+    request = getattr(request, '_request', request)
+    surveys = request.__dict__.setdefault('surveys', {})
+    sid = int(sid)
+    if sid not in surveys:
+        # pylint: disable=no-member
+        surveys[sid] = Survey.objects.select_related('owner').filter(
+            id=sid, owner=request.user).first()
+    return surveys[sid]
+
+
+def refuse_archived(survey):
+    """ Raises a ValidationError, i.e. a 400, if the survey's answers have
+    been archived and so can no longer change, see `Survey.archive()`
+    """
+    if survey.archived:
+        raise ValidationError('This survey has been archived')
+
+
+def uri2ordinal(view, key):
+    """ Maps an ordinal number string from a URI to the `ordinal` of the object
+    it addresses
 
     Example:- /surveys/<id>/responses/1 translates to 'get the first response
               for survey with ID <id>', which translates into Python as
-              survey.responses.all()[0]
+              survey.responses.get(ordinal=1)
+    """
+    return int(view.kwargs[key])
+
+
+def select_answers(survey, selection):
+    """ Returns a queryset of the answers in `survey` matching every field of
+    a validated `AnswerSelectionSerializer`
+    """
+    if 'q' in selection:
+        answers = search_answers(survey, selection['q'])
+    else:
+        answers = Answer.objects.filter(survey=survey)
+    if 'question' in selection:
+        answers = answers.filter(question__ordinal=selection['question'])
+    if 'responses' in selection:
+        answers = answers.filter(response__ordinal__in=selection['responses'])
+    if 'answers' in selection:
+        pairs = selection['answers'] or [(0, 0)]
+        # Joins the responses, whose ordinals the pairs hold
+        answers = answers.filter(response__survey=survey).extra(
+            where=['(surveys_response.ordinal, surveys_answer.ordinal) IN '
+                   '(VALUES %s)' % ', '.join(['(%s, %s)'] * len(pairs))],
+            params=[ordinal for pair in pairs for ordinal in pair])
+    return answers
+
+
+def archived_answers(view, survey):
+    """ Returns the `ArchivedAnswer`s of the response in the URI of `view`,
+    for a survey that has been archived
+    """
+    response = survey.responses.select_related('archive').get(
+        ordinal=uri2ordinal(view, 'rid'))
+    return response.archive.answers(survey.tag_texts())
+
+
+class SurveyVersionMixin(object):
+    """ Mixin for views that answer conditional GETs from the `version` of the
+    survey in the URI.
+
+    GET responses carry an ETag made from the survey's version, along with its
+    Last-Modified time. A request whose If-None-Match holds the current ETag
+    is answered with an empty 304 after a single query, before the view's own
+    queryset or serializer runs. The survey read for the version is the one
+    the rest of the view uses, see `request_survey()`.
     """
-    return int(view.kwargs[key]) - 1
 
+    def get_version(self):
+        """ Returns a `(version, modified)` pair for the data behind this view,
+        where `version` is a string that changes whenever the data does, or
+        None if the user can't see it
+        """
+        survey = request_survey(self.request, self.kwargs['sid'])
+        if survey is None:
+            return None
+        return '%s.%s' % (survey.id, survey.version), survey.modified
+
+    def get(self, request, *args, **kwargs):
+        """ Answers with a 304 if the client's copy is current, otherwise
+        with the view's usual response
+        """
+        version = self.get_version()
+        if version is None:
+            return super(SurveyVersionMixin, self).get(
+                request, *args, **kwargs)
+
+        etag = quote_etag('%s.%s' % (version[0],
+                                     request.accepted_renderer.format))
+        if etag_matches(request, etag):
+            response = APIResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super(SurveyVersionMixin, self).get(
+                request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if version[1] is not None:
+                response['Last-Modified'] = http_date(
+                    calendar.timegm(version[1].utctimetuple()))
+        return response
+
+
+class ArchivedResponseMixin(object):
+    """ Mixin for the views of responses, which serialize the responses of an
+    archived survey from the archive
+    """
+
+    def get_serializer_class(self):
+        """ Returns `ArchivedResponseSerializer` if the survey in the URI has
+        been archived
+        """
+        survey = request_survey(self.request, self.kwargs['sid'])
+        if survey is not None and survey.archived:
+            return ArchivedResponseSerializer
+        return self.serializer_class
 
-class SurveyList(generics.ListCreateAPIView):
+
+class SurveyList(SurveyVersionMixin, generics.ListCreateAPIView):
     """ A list of `Survey` objects. The queryset is limited to surveys of which
     the request maker is the owner
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        read_replica          Whether safe GETs may read from the read
+                              replica, see `pushkin.db`
     """
 
     serializer_class = SurveySerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 4
+    read_replica = True
 
     def get_queryset(self):
-        return Survey.objects.filter(owner=self.request.user)
+        return Survey.objects.filter(owner=self.request.user).prefetch_related(
+            'questions', 'tag_options')
+
+    def get_version(self):
+        """ The version of the list covers the id and version of every survey
+        in it, and its modified time is that of the latest change
+        """
+        # pylint: disable=no-member
+        versions = list(Survey.objects.filter(
+            owner=self.request.user).order_by('id').values_list(
+                'id', 'version', 'modified'))
+        digest = hashlib.sha1(repr(
+            [version[:2] for version in versions]).encode()).hexdigest()
+        return digest, max((version[2] for version in versions), default=None)
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
 
 # pylint: disable=too-many-ancestors
-class SurveyDetail(generics.RetrieveUpdateDestroyAPIView):
+class SurveyDetail(SurveyVersionMixin,
+                   generics.RetrieveUpdateDestroyAPIView):
     """ The view for an individual survey
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
     """
 
     serializer_class = SurveySerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 3
+
+    @survey_context
+    def get_object(self, survey): # pylint: disable=arguments-differ
+        return survey
+
+
+class SurveyExport(SurveyVersionMixin, generics.RetrieveAPIView):
+    """ A download of every response to a survey, along with the tags on each
+    answer, as CSV or newline-delimited JSON depending on the extension in the
+    URI. The file is streamed as it is read from the database.
+
+    Attributes:
+        permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        read_replica          Whether safe GETs may read from the read
+                              replica, see `pushkin.db`
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 7
+    read_replica = True
 
     @survey_context
     def get_object(self, survey): # pylint: disable=arguments-differ
         return survey
 
+    def perform_content_negotiation(self, request, force=False):
+        # The export is never passed through a renderer; just make sure an
+        # unusual Accept header can't turn the download into a 406
+        return super(SurveyExport, self).perform_content_negotiation(
+            request, force=True)
+
+    # pylint: disable=unused-argument
+    def retrieve(self, request, *args, **kwargs):
+        """ Streams the export in the format given by the URI """
+        survey = self.get_object()
+        content_type, stream = EXPORT_FORMATS[kwargs['export_format']]
+        response = StreamingHttpResponse(
+            stream(*survey_export(survey)),
+            content_type='%s; charset=utf-8' % content_type)
+        response['Content-Disposition'] = (
+            'attachment; filename="survey_%s.%s"'
+            % (survey.id, kwargs['export_format']))
+        return response
+
+
+class SurveyArchive(generics.GenericAPIView):
+    """ The view for archiving a survey, see `Survey.archive()`
+
+    Attributes:
+        permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make for a
+                              survey of up to `ARCHIVE_CHUNK_SIZE` responses;
+                              each further chunk costs three more
+    """
 
-class ResponseList(generics.ListAPIView):
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 11
+
+    @survey_context
+    def get_object(self, survey): # pylint: disable=arguments-differ
+        return survey
+
+    # pylint: disable=unused-argument
+    def post(self, request, *args, **kwargs):
+        """ Archives the survey, returning the number of responses archived """
+        survey = self.get_object()
+        refuse_archived(survey)
+        return APIResponse({'archived' : survey.archive()})
+
+
+class ResponseList(ArchivedResponseMixin, SurveyVersionMixin,
+                   generics.ListAPIView):
     """ The view for survey's list of responses. The queryset is limited
     to a specific survey, as identified in the URI
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        pagination_class      The paginator splitting the list into pages
+        read_replica          Whether safe GETs may read from the read
+                              replica, see `pushkin.db`
     """
 
     serializer_class = ResponseSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 3
+    read_replica = True
+    pagination_class = OrdinalCursorPagination
 
     @survey_context
     def get_queryset(self, survey): # pylint: disable=arguments-differ
-        return survey.responses.all()
+        if survey.archived:
+            return survey.responses.select_related('archive')
+        return survey.responses.prefetch_related('answers')
+
 
+class ResponseBulkCreate(generics.GenericAPIView):
+    """ The view for posting a batch of responses to a survey at once. All of
+    the responses are created in a single transaction, or none are.
 
-class ResponseDetail(generics.RetrieveDestroyAPIView):
+    Attributes:
+        serializer_class      The serializer used for the objects in this view
+        permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+    """
+
+    serializer_class = ResponseSubmissionSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 10
+
+    @survey_context
+    def get_object(self, survey): # pylint: disable=arguments-differ
+        return survey
+
+    # pylint: disable=unused-argument
+    def post(self, request, *args, **kwargs):
+        """ Creates every response in the request body, returning the number
+        created
+        """
+        survey = self.get_object()
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            responses = survey.add_responses(
+                [data['answers'] for data in serializer.validated_data])
+        except DBError as error:
+            raise ValidationError(str(error))
+        return APIResponse({'created' : len(responses)},
+                           status=status.HTTP_201_CREATED)
+
+
+class ResponseDetail(ArchivedResponseMixin, SurveyVersionMixin,
+                     generics.RetrieveDestroyAPIView):
     """ The view for an individual response
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
     """
 
     serializer_class = ResponseSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 3
 
     @survey_context
     def get_object(self, survey): # pylint: disable=arguments-differ
-        return survey.responses.all()[uri2ix(self, 'rid')]
+        return survey.responses.select_related('archive').get(
+            ordinal=uri2ordinal(self, 'rid'))
 
+    def perform_destroy(self, instance):
+        refuse_archived(request_survey(self.request, self.kwargs['sid']))
+        instance.delete()
 
-class QuestionList(generics.ListCreateAPIView):
+
+class QuestionList(SurveyVersionMixin, generics.ListCreateAPIView):
     """ The view for a list of questions. The queryset is limited to a specific
     survey.
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        pagination_class      The paginator splitting the list into pages
     """
 
     serializer_class = QuestionSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 2
+    pagination_class = OrdinalCursorPagination
 
     @survey_context
     def get_queryset(self, survey): # pylint: disable=arguments-differ
         return survey.questions.all()
 
     def perform_create(self, serializer):
+        refuse_archived(request_survey(self.request, self.kwargs['sid']))
         serializer.save(survey_id=self.kwargs['sid'])
 
 
-class QuestionDetail(generics.RetrieveDestroyAPIView):
+class QuestionDetail(SurveyVersionMixin, generics.RetrieveDestroyAPIView):
     """ The view for a single Question
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
     """
 
     serializer_class = QuestionSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 2
 
     @survey_context
     def get_object(self, survey): # pylint: disable=arguments-differ
-        return survey.questions.all()[uri2ix(self, 'qid')]
+        return survey.questions.get(ordinal=uri2ordinal(self, 'qid'))
+
+    def perform_destroy(self, instance):
+        refuse_archived(request_survey(self.request, self.kwargs['sid']))
+        instance.delete()
 
     # @@@ Question text needs to be put-able only ONCE, by the survey taker
     #     Only the survey owner can add tags
 
 
-class AnswerList(generics.ListAPIView):
+class AnswerList(SurveyVersionMixin, generics.ListAPIView):
     """ The view for a list of answers (i.e. within an individual response).
     The queryset is limited to a specific response to a specific survey,
     as identified in the URI
@@ -211,78 +595,350 @@ class AnswerList(generics.ListAPIView):
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        pagination_class      The paginator splitting the list into pages
     """
 
     serializer_class = AnswerSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 4
+    pagination_class = OrdinalCursorPagination
 
     @survey_context
     def get_queryset(self, survey): # pylint: disable=arguments-differ
-        return survey.responses.all()[uri2ix(self, 'rid')].answers.all()
+        if survey.archived:
+            return OrdinalList(archived_answers(self, survey))
+        return survey.responses.get(
+            ordinal=uri2ordinal(self, 'rid')).answers.prefetch_related('tags')
 
 
 # pylint: disable=too-many-ancestors
-class AnswerDetail(generics.RetrieveUpdateDestroyAPIView):
+class AnswerDetail(SurveyVersionMixin,
+                   generics.RetrieveUpdateDestroyAPIView):
     """ The view for a single answer
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
     """
 
     serializer_class = AnswerSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 3
 
     @survey_context
     def get_object(self, survey): # pylint: disable=arguments-differ
-        return survey.responses.all()[
-            uri2ix(self, 'rid')].answers.all()[uri2ix(self, 'aid')]
+        ordinal = uri2ordinal(self, 'aid')
+        if survey.archived:
+            for answer in archived_answers(self, survey):
+                if answer.ordinal == ordinal:
+                    return answer
+            raise Answer.DoesNotExist
+        answer = Answer.objects.get(survey=survey,
+                                    response__ordinal=uri2ordinal(self, 'rid'),
+                                    ordinal=ordinal)
+        answer.survey = survey
+        return answer
 
     def perform_update(self, serializer):
-        tag_strings = serializer.validated_data.pop('tag_strings', [])
-        answer = serializer.save()
-        tags = Tag.objects.filter(tag_text__in=tag_strings)
-        for tag in tags:
-            answer.tags.add(tag)
-        answer.save()
-
-class TagList(generics.ListCreateAPIView):
+        """ Sets the answer's tags to those of the survey matching the given
+        `tag_strings`, see `Tag.resolve()`. Other fields are read-only.
+        """
+        refuse_archived(request_survey(self.request, self.kwargs['sid']))
+        answer = serializer.instance
+        tag_strings = serializer.validated_data.pop('tag_strings', None)
+        if tag_strings is not None:
+            answer.set_tags(Tag.resolve(answer.survey, tag_strings))
+
+    def perform_destroy(self, instance):
+        refuse_archived(request_survey(self.request, self.kwargs['sid']))
+        instance.delete()
+
+class AnswerSearch(SurveyVersionMixin, generics.ListAPIView):
+    """ The view for a full-text search over all the answers to a survey,
+    best matches first. The search string is given by the `q` query parameter,
+    and the results can be limited to a single question by giving its ordinal
+    as the `question` query parameter.
+
+    Attributes:
+        serializer_class      The serializer used for the objects in this view
+        permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        pagination_class      The paginator splitting the list into pages
+    """
+
+    serializer_class = AnswerSearchSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 3
+    pagination_class = RankedPagination
+
+    @survey_context
+    def get_queryset(self, survey): # pylint: disable=arguments-differ
+        params = self.request.query_params
+        if not params.get('q'):
+            raise ValidationError({'q' : 'A search string is required'})
+        answers = search_answers(survey, params['q'])
+        if 'question' in params:
+            try:
+                answers = answers.filter(
+                    question__ordinal=int(params['question']))
+            except ValueError:
+                raise ValidationError(
+                    {'question' : 'The question must be given by its number'})
+        return answers
+
+
+class TagList(SurveyVersionMixin, generics.ListCreateAPIView):
     """ The view for a set of tags. The queryset is limited to a specific
     Survey (identified by the URI)
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        pagination_class      The paginator splitting the list into pages
     """
 
     serializer_class = TagSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 2
+    pagination_class = OrdinalCursorPagination
 
     @survey_context
     def get_queryset(self, survey): # pylint: disable=arguments-differ
         return survey.tag_options.all()
 
     def perform_create(self, serializer):
-        if not Tag.objects.filter(
-                tag_text=serializer.validated_data["tag_text"]).exists():
-            serializer.save(survey_id=self.kwargs["sid"])
+        """ Adds the tag, or finds the tag of the survey with the same
+        normalized text, see `Tag.add()`
+        """
+        survey = request_survey(self.request, self.kwargs['sid'])
+        if survey is None:
+            raise exceptions.PermissionDenied
+        serializer.instance, _ = Tag.add(
+            survey, serializer.validated_data['tag_text'])
 
 
 # pylint: disable=too-many-ancestors
-class TagDetail(generics.RetrieveUpdateDestroyAPIView):
+class TagDetail(SurveyVersionMixin,
+                generics.RetrieveUpdateDestroyAPIView):
     """ The view for a single tag
 
     Attributes:
         serializer_class      The serializer used for the objects in this view
         permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
     """
 
     serializer_class = TagSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 2
 
     @survey_context
     def get_object(self, survey): # pylint: disable=arguments-differ
-        return survey.tag_options.all()[uri2ix(self, 'tid')]
+        return survey.tag_options.get(ordinal=uri2ordinal(self, 'tid'))
+
+    def perform_update(self, serializer):
+        """ Saves the tag, rejecting text that normalizes the same as another
+        tag of the survey
+        """
+        try:
+            serializer.save()
+        except IntegrityError:
+            raise ValidationError(
+                {'tag_text' : ['The survey already has this tag.']})
+
+
+class TagAnswerList(SurveyVersionMixin, generics.ListAPIView):
+    """ The view for the list of answers in a survey carrying a tag, which can
+    be limited to a single question by giving its ordinal as the `question`
+    query parameter. The answers are listed in the order they were written,
+    read through the `(tag_id, answer_id)` index on the tags on answers.
+
+    Attributes:
+        serializer_class      The serializer used for the objects in this view
+        permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        pagination_class      The paginator splitting the list into pages
+        read_replica          Whether safe GETs may read from the read
+                              replica, see `pushkin.db`
+    """
+
+    serializer_class = TaggedAnswerSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 3
+    pagination_class = AnswerCursorPagination
+    read_replica = True
+
+    @survey_context
+    def get_queryset(self, survey): # pylint: disable=arguments-differ
+        tag = survey.tag_options.get(ordinal=uri2ordinal(self, 'tid'))
+        answers = Answer.objects.filter(
+            survey=survey, answertag__tag=tag,
+            answertag__survey=survey).select_related('response', 'question')
+        if 'question' in self.request.query_params:
+            try:
+                answers = answers.filter(question__ordinal=int(
+                    self.request.query_params['question']))
+            except ValueError:
+                raise ValidationError(
+                    {'question' : 'The question must be given by its number'})
+        return answers
+
+
+class TagAnswerExport(TagAnswerList):
+    """ A download of every answer in a survey carrying a tag, optionally for
+    one question as in `TagAnswerList`, as newline-delimited JSON. The file is
+    streamed as it is read through the same index, so it isn't paginated.
+
+    Attributes:
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+    """
+
+    query_budget = 5
+    pagination_class = None
+
+    def perform_content_negotiation(self, request, force=False):
+        # As for SurveyExport, the download is never passed through a renderer
+        return super(TagAnswerExport, self).perform_content_negotiation(
+            request, force=True)
+
+    # pylint: disable=unused-argument
+    def list(self, request, *args, **kwargs):
+        """ Streams the answers """
+        answers = self.get_queryset()
+        response = StreamingHttpResponse(
+            stream_tag_answers(answers.using(answers.db)),
+            content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = (
+            'attachment; filename="survey_%s_tag_%s.ndjson"'
+            % (self.kwargs['sid'], self.kwargs['tid']))
+        return response
+
+
+class TagAnalytics(SurveyVersionMixin, generics.RetrieveAPIView):
+    """ The number of answers to each question carrying each of the survey's
+    tags, and how often each pair of tags is found on the same answer, see
+    `tag_analytics()`
+
+    Attributes:
+        permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+        read_replica          Whether safe GETs may read from the read
+                              replica, see `pushkin.db`
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 5
+    read_replica = True
+
+    @survey_context
+    def get_object(self, survey): # pylint: disable=arguments-differ
+        return survey
+
+    # pylint: disable=unused-argument
+    def retrieve(self, request, *args, **kwargs):
+        """ Returns the analytics of the survey's tags """
+        return APIResponse(tag_analytics(self.get_object()))
+
+
+class TagApply(generics.GenericAPIView):
+    """ The view for tagging a selection of answers in a survey with a single
+    tag in one go. The answers are given by an `AnswerSelectionSerializer`.
+
+    Attributes:
+        serializer_class      The serializer used for the objects in this view
+        permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+    """
+
+    serializer_class = AnswerSelectionSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 8
+
+    @survey_context
+    def get_object(self, survey): # pylint: disable=arguments-differ
+        tag = survey.tag_options.get(ordinal=uri2ordinal(self, 'tid'))
+        tag.survey = survey
+        return tag
+
+    # pylint: disable=no-self-use
+    def perform_tagging(self, tag, answers):
+        """ Tags the selected answers, returning how many were changed """
+        return tag.apply_to(answers)
+
+    # pylint: disable=unused-argument
+    def post(self, request, *args, **kwargs):
+        """ Tags the selected answers, returning how many were changed """
+        tag = self.get_object()
+        refuse_archived(tag.survey)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        count = self.perform_tagging(
+            tag, select_answers(tag.survey, serializer.validated_data))
+        return APIResponse({'count' : count})
+
+
+class TagRemove(TagApply):
+    """ The view for removing a single tag from a selection of answers in a
+    survey in one go. The answers are given by an `AnswerSelectionSerializer`.
+    """
+
+    def perform_tagging(self, tag, answers):
+        """ Untags the selected answers, returning how many were changed """
+        return tag.remove_from(answers)
+
+
+class TagMerge(generics.GenericAPIView):
+    """ The view for merging a set of source tags into a target tag, e.g. to
+    fold 'Foo ' and 'foo' into 'Foo'. Every answer tagged with a source is
+    tagged with the target instead, and the sources are deleted.
+
+    Attributes:
+        serializer_class      The serializer used for the objects in this view
+        permission_classes    The required permissions to access this view
+        query_budget          The most queries a request may make, however
+                              much data the survey holds
+    """
+
+    serializer_class = TagMergeSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    query_budget = 18
+
+    @survey_context
+    def get_object(self, survey): # pylint: disable=arguments-differ
+        return survey
+
+    # pylint: disable=unused-argument
+    def post(self, request, *args, **kwargs):
+        """ Merges the tags, returning the target's ordinal after the merge
+        and the number of answers newly tagged with it
+        """
+        survey = self.get_object()
+        refuse_archived(survey)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ordinals = set(serializer.validated_data['source'])
+        target_ordinal = serializer.validated_data['target']
+        tags = {tag.ordinal : tag for tag in survey.tag_options.filter(
+            ordinal__in=ordinals | {target_ordinal})}
+        missing = (ordinals | {target_ordinal}) - set(tags)
+        if missing:
+            raise ValidationError('No such tags: %s' % sorted(missing))
+
+        target = tags.pop(target_ordinal)
+        count = target.merge(tags.values())
+        return APIResponse({'target' : target.ordinal, 'count' : count})
 
 
 class Register(FormView):